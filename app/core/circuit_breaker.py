@@ -0,0 +1,130 @@
+"""
+Circuit breaker for calls to a dependency that can go down or slow down.
+
+Closed, calls pass through. After `failure_threshold` consecutive failures
+the breaker opens: calls are rejected right away with CircuitOpenError for
+`open_seconds`, instead of each waiting out its timeout. Then it goes half
+open and lets up to `half_open_probes` calls through at a time: a probe that
+succeeds closes it, one that fails opens it again.
+
+Metrics (labelled with the breaker name):
+    circuit_breaker_state: 0 closed, 1 half open, 2 open.
+    circuit_breaker_transitions_total{state}: transitions into each state.
+    circuit_breaker_rejected_total: calls rejected while open.
+"""
+
+import threading
+import time
+
+from .metrics import metrics
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit {name} is open")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Callers ask allow() before each call, then report its outcome with
+    success() or failure(), passing on what allow() returned, or release()
+    when the call ended without one.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int,
+        open_seconds: float,
+        half_open_probes: int = 1,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        metrics.register_gauge(
+            "circuit_breaker_state", lambda: STATE_VALUES[self._state], breaker=name
+        )
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def _transition(self, state: str):
+        self._state = state
+        metrics.inc("circuit_breaker_transitions_total", breaker=self.name, state=state)
+
+    def allow(self) -> bool:
+        """
+        Raises CircuitOpenError if the call must not be made. Returns whether
+        it is a half-open probe.
+        """
+        with self._lock:
+            if self._state == OPEN:
+                remaining = self._opened_at + self.open_seconds - time.monotonic()
+                if remaining > 0:
+                    metrics.inc("circuit_breaker_rejected_total", breaker=self.name)
+                    raise CircuitOpenError(self.name, remaining)
+                self._transition(HALF_OPEN)
+                self._probes = 0
+            if self._state == HALF_OPEN:
+                if self._probes >= self.half_open_probes:
+                    metrics.inc("circuit_breaker_rejected_total", breaker=self.name)
+                    raise CircuitOpenError(self.name, 0.0)
+                self._probes += 1
+                return True
+            return False
+
+    def success(self, probe: bool = False):
+        with self._lock:
+            if probe:
+                self._probes -= 1
+                if self._state == HALF_OPEN:
+                    self._transition(CLOSED)
+            if self._state == CLOSED:
+                self._failures = 0
+
+    def failure(self, probe: bool = False):
+        with self._lock:
+            if probe:
+                self._probes -= 1
+            if self._state == HALF_OPEN and probe:
+                self._open()
+            elif self._state == CLOSED:
+                self._failures += 1
+                if self._failures >= self.failure_threshold:
+                    self._open()
+
+    def release(self, probe: bool = False):
+        """
+        Frees a probe's slot without counting an outcome, e.g. when the call
+        was cancelled.
+        """
+        if probe:
+            with self._lock:
+                self._probes -= 1
+
+    def _open(self):
+        self._opened_at = time.monotonic()
+        self._failures = 0
+        self._transition(OPEN)
+
+    def reset(self):
+        """
+        Closes the breaker. Used for testing.
+        """
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._probes = 0
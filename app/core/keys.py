@@ -0,0 +1,258 @@
+"""
+JWT signing keys identified by `kid`, rotated without restarts.
+
+Keys live in JWT_KEYS_DIR, one file per key, named after its kid:
+    <kid>.pem     an unencrypted Ed25519 (EdDSA) or P-256 (ES256) private
+                  key, in PEM.
+    <kid>.secret  a shared secret for ALGORITHM (HS256...), for deployments
+                  without asymmetric keys.
+
+Each worker rescans the directory every JWT_KEYS_RELOAD_SECONDS and parses
+only new or modified files. Every key in the directory verifies tokens, and
+the public ones are published as a JWKS. A new key starts signing only once
+it is JWT_KEY_PUBLISH_SECONDS old, so that downstream caches of the JWKS and
+the other workers know it by then. Until then, the newest key old enough
+signs. A key removed from the directory stops verifying at the next rescan.
+
+Without JWT_KEYS_DIR, or with no key in it, tokens are signed with
+SECRET_KEY and carry no kid. Tokens without a kid still verify against
+SECRET_KEY, so the ones issued before a key directory was set up stay valid,
+until `accept_legacy` (JWT_ACCEPT_LEGACY_TOKENS) is turned off.
+
+Usage (prints a new Ed25519 key):
+    uv run python -m app.core.keys > "$JWT_KEYS_DIR/$(date +%Y%m%d).pem"
+"""
+
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+import jwt
+from cryptography.exceptions import UnsupportedAlgorithm
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+from jwt.algorithms import get_default_algorithms
+from pydantic_core import to_json
+
+from .logger import AppLogger
+from .metrics import metrics
+
+KEY_SUFFIXES = (".pem", ".secret")
+
+
+class Key(NamedTuple):
+    kid: Optional[str]
+    algorithm: str
+    signing_key: Any
+    verifying_key: Any
+    # File mtime; when the key was added to the directory
+    created_at: float
+    # Public JWK, None for shared secrets
+    jwk: Optional[Dict[str, Any]]
+
+
+def _algorithm_of(private_key: Any) -> str:
+    if isinstance(private_key, ed25519.Ed25519PrivateKey):
+        return "EdDSA"
+    if isinstance(private_key, ec.EllipticCurvePrivateKey) and isinstance(
+        private_key.curve, ec.SECP256R1
+    ):
+        return "ES256"
+    raise ValueError("Only Ed25519 and P-256 keys are supported")
+
+
+def load_key(path: str, secret_algorithm: str) -> Key:
+    """
+    Parses one key file; raises ValueError if it can't be used.
+    """
+    kid, suffix = os.path.splitext(os.path.basename(path))
+    created_at = os.stat(path).st_mtime
+    with open(path, "rb") as f:
+        data = f.read()
+
+    if suffix == ".secret":
+        if not secret_algorithm.startswith("HS"):
+            raise ValueError(f"{secret_algorithm} keys can't be shared secrets")
+        secret = data.strip().decode()
+        if not secret:
+            raise ValueError("Empty secret")
+        return Key(kid, secret_algorithm, secret, secret, created_at, None)
+
+    try:
+        private_key = serialization.load_pem_private_key(data, password=None)
+    except TypeError as e:
+        # Raised for encrypted keys, which would need a password
+        raise ValueError(f"Can't load the key: {e}") from e
+    except UnsupportedAlgorithm as e:
+        raise ValueError(f"Unsupported key type: {e}") from e
+    algorithm = _algorithm_of(private_key)
+    public_key = private_key.public_key()
+    jwk = get_default_algorithms()[algorithm].to_jwk(public_key, as_dict=True)
+    jwk.update({"kid": kid, "alg": algorithm, "use": "sig"})
+    return Key(kid, algorithm, private_key, public_key, created_at, jwk)
+
+
+class KeyRing:
+    """
+    Signs and verifies tokens with the keys in `keys_dir`, reloaded lazily:
+    the first call after `reload_seconds` rescans the directory. Callbacks
+    registered with on_change() run after a rescan that changed the keys.
+    """
+
+    def __init__(
+        self,
+        keys_dir: Optional[str],
+        secret: str,
+        algorithm: str,
+        reload_seconds: float,
+        publish_seconds: float,
+        logger: Optional[AppLogger] = None,
+        accept_legacy: bool = True,
+    ):
+        self.keys_dir = keys_dir
+        self.algorithm = algorithm
+        self.accept_legacy = accept_legacy
+        self.reload_seconds = reload_seconds
+        self.publish_seconds = publish_seconds
+        self.logger = logger
+        self._legacy = Key(None, algorithm, secret, secret, 0.0, None)
+        self._keys: Dict[str, Key] = {}
+        self._signing = self._legacy
+        self._jwks: Optional[bytes] = None
+        self._listeners: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self._next_reload = 0.0
+
+    def on_change(self, callback: Callable[[], None]):
+        self._listeners.append(callback)
+
+    def maybe_reload(self):
+        """
+        Rescans the directory if it is due. Callers that skip decode(), such
+        as a cache of verified claims, call it so removed keys still take
+        effect.
+        """
+        if self.keys_dir and time.monotonic() >= self._next_reload:
+            self.reload()
+
+    def reload(self):
+        """
+        Rescans the key directory; a no-op if another thread is at it. If the
+        directory can't be read (e.g. briefly unmounted during a rotation),
+        the current keys stay in use until the next reload.
+        """
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            keys: Dict[str, Key] = {}
+            try:
+                with os.scandir(self.keys_dir) as entries:
+                    paths = sorted(
+                        entry.path
+                        for entry in entries
+                        if entry.is_file() and entry.name.endswith(KEY_SUFFIXES)
+                    )
+            except OSError as e:
+                metrics.inc("jwt_key_load_errors_total")
+                if self.logger:
+                    self.logger.error(
+                        {"context": "Keeping JWT keys, can't scan", "error": str(e)}
+                    )
+                self._next_reload = time.monotonic() + self.reload_seconds
+                return
+            for path in paths:
+                kid = os.path.splitext(os.path.basename(path))[0]
+                known = self._keys.get(kid)
+                try:
+                    if known is not None and known.created_at == os.stat(path).st_mtime:
+                        keys[kid] = known
+                    else:
+                        keys[kid] = load_key(path, self.algorithm)
+                except (OSError, ValueError) as e:
+                    metrics.inc("jwt_key_load_errors_total")
+                    if self.logger:
+                        self.logger.error(
+                            {"context": "Skipping JWT key", "kid": kid, "error": str(e)}
+                        )
+            changed = keys != self._keys
+            self._keys = keys
+            self._signing = self._pick_signing_key(keys)
+            if changed:
+                self._jwks = None
+            metrics.set_gauge("jwt_keys", len(keys))
+            self._next_reload = time.monotonic() + self.reload_seconds
+        finally:
+            self._lock.release()
+        if changed:
+            for callback in self._listeners:
+                callback()
+
+    def _pick_signing_key(self, keys: Dict[str, Key]) -> Key:
+        if not keys:
+            return self._legacy
+        by_age = sorted(keys.values(), key=lambda key: (key.created_at, key.kid))
+        published = [
+            key
+            for key in by_age
+            if key.created_at <= time.time() - self.publish_seconds
+        ]
+        # A fresh deployment's only key signs right away
+        return published[-1] if published else by_age[0]
+
+    def encode(self, claims: Dict[str, Any]) -> str:
+        self.maybe_reload()
+        key = self._signing
+        headers = {"kid": key.kid} if key.kid else None
+        return jwt.encode(
+            claims, key.signing_key, algorithm=key.algorithm, headers=headers
+        )
+
+    def decode(self, token: str) -> Dict[str, Any]:
+        """
+        Verifies `token` with the key its kid names, and only with that key's
+        algorithm. Raises jwt.InvalidTokenError.
+        """
+        self.maybe_reload()
+        kid = jwt.get_unverified_header(token).get("kid")
+        if kid is None:
+            key = self._legacy if self.accept_legacy else None
+        else:
+            key = self._keys.get(kid) if isinstance(kid, str) else None
+        if key is None:
+            raise jwt.InvalidTokenError(f"Unknown key id {kid!r}")
+        return jwt.decode(token, key.verifying_key, algorithms=[key.algorithm])
+
+    def jwks(self) -> bytes:
+        """
+        The public keys as an encoded JWKS document, rendered once per key set.
+        """
+        self.maybe_reload()
+        jwks = self._jwks
+        if jwks is None:
+            jwks = to_json(
+                {
+                    "keys": [
+                        key.jwk
+                        for key in sorted(
+                            self._keys.values(), key=lambda key: key.created_at
+                        )
+                        if key.jwk is not None
+                    ]
+                }
+            )
+            self._jwks = jwks
+        return jwks
+
+
+def main():
+    pem = ed25519.Ed25519PrivateKey.generate().private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption(),
+    )
+    print(pem.decode(), end="")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+In-process metrics registry exposed through the /metrics endpoint.
+"""
+
+import threading
+from typing import Callable, Dict
+
+
+def _metric_key(name: str, labels: Dict[str, str]) -> str:
+    if not labels:
+        return name
+    rendered = ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+    return f"{name}{{{rendered}}}"
+
+
+class Metrics:
+    """
+    Thread-safe counters, gauges and timing summaries.
+
+    Gauges can either be set directly or registered as callbacks, which are
+    evaluated only when a snapshot is taken (e.g. replica lag, which needs a
+    query to measure).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._gauges: Dict[str, float] = {}
+        self._gauge_callbacks: Dict[str, Callable[[], float]] = {}
+        self._timings: Dict[str, Dict[str, float]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels: str):
+        key = _metric_key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels: str):
+        key = _metric_key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def register_gauge(self, name: str, callback: Callable[[], float], **labels: str):
+        key = _metric_key(name, labels)
+        with self._lock:
+            self._gauge_callbacks[key] = callback
+
+    def observe(self, name: str, seconds: float, **labels: str):
+        key = _metric_key(name, labels)
+        with self._lock:
+            timing = self._timings.setdefault(
+                key, {"count": 0, "sum_seconds": 0.0, "max_seconds": 0.0}
+            )
+            timing["count"] += 1
+            timing["sum_seconds"] += seconds
+            timing["max_seconds"] = max(timing["max_seconds"], seconds)
+
+    def get(self, name: str, **labels: str) -> float:
+        key = _metric_key(name, labels)
+        with self._lock:
+            return self._counters.get(key, self._gauges.get(key, 0))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            callbacks = dict(self._gauge_callbacks)
+            timings = {key: dict(value) for key, value in self._timings.items()}
+
+        for key, callback in callbacks.items():
+            try:
+                gauges[key] = callback()
+            except Exception:
+                # A failing probe (e.g. replica down) must not break /metrics
+                gauges[key] = -1
+
+        return {"counters": counters, "gauges": gauges, "timings": timings}
+
+    def reset(self):
+        """
+        Clears all recorded values. Used for testing.
+        """
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._timings.clear()
+
+
+metrics = Metrics()
@@ -0,0 +1,266 @@
+"""
+Versioned schema migrations.
+
+Migrations are the `schema/NNN_name.sql` files (plus the layout overlay, see
+discover_migrations), applied in version order and recorded in the
+`schema_migrations` table of the current schema. Runners serialize on a
+Postgres advisory lock keyed on the schema, so workers booting together apply
+each pending file exactly once. Each file runs in its own transaction
+together with its version row.
+
+A file whose first line is `-- migrate: no-transaction` runs in autocommit
+mode instead, one statement at a time, which `CREATE INDEX CONCURRENTLY`
+requires. Its statements are split on semicolons that end a line, and should
+be safe to re-run (e.g. `DROP INDEX CONCURRENTLY IF EXISTS` first), since a
+failure part-way leaves earlier statements applied.
+
+Usage:
+    uv run python -m app.core.migrations status
+    uv run python -m app.core.migrations upgrade
+    uv run python -m app.core.migrations baseline 1
+"""
+
+import argparse
+import hashlib
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from psycopg import Connection, errors
+from psycopg.rows import dict_row
+
+from app.settings import settings
+
+MIGRATIONS_DIR = Path(__file__).resolve().parents[2] / "schema"
+NO_TRANSACTION_MARKER = "-- migrate: no-transaction"
+
+_FILENAME = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+CREATE_MIGRATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        checksum VARCHAR(64) NOT NULL,
+        applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+# Session-level, so it spans the autocommit statements of no-transaction files
+LOCK_KEY = "hashtext('schema_migrations.' || current_schema())"
+
+
+class MigrationError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    path: Path
+
+    @property
+    def sql(self) -> str:
+        return self.path.read_text(encoding="utf-8")
+
+    @property
+    def checksum(self) -> str:
+        return hashlib.sha256(self.path.read_bytes()).hexdigest()
+
+    @property
+    def transactional(self) -> bool:
+        return not self.sql.lstrip().startswith(NO_TRANSACTION_MARKER)
+
+
+def _scan(directory: Path) -> Dict[int, Migration]:
+    migrations: Dict[int, Migration] = {}
+    for path in sorted(directory.glob("*.sql")):
+        match = _FILENAME.match(path.name)
+        if not match:
+            continue
+        version = int(match.group(1))
+        if version in migrations:
+            raise MigrationError(
+                f"Duplicate migration version {version}: "
+                f"{migrations[version].path.name}, {path.name}"
+            )
+        migrations[version] = Migration(version, match.group(2), path)
+    return migrations
+
+
+def discover_migrations(directory: Path = MIGRATIONS_DIR) -> List[Migration]:
+    """
+    Lists the migration files by name only; their SQL is read when applied.
+
+    Files in the `<directory>/<USERS_TABLE_LAYOUT>/` subdirectory, when there
+    is one, replace the base files of the same version.
+    """
+    migrations = _scan(Path(directory))
+    overlay = Path(directory) / settings.USERS_TABLE_LAYOUT
+    if overlay.is_dir():
+        migrations.update(_scan(overlay))
+    return [migrations[version] for version in sorted(migrations)]
+
+
+def split_statements(sql: str) -> List[str]:
+    """
+    Splits a no-transaction migration on semicolons that end a line.
+    """
+    statements = []
+    for chunk in re.split(r";[ \t]*(?:\n|$)", sql):
+        lines = [
+            line
+            for line in chunk.strip().splitlines()
+            if not line.lstrip().startswith("--")
+        ]
+        if any(line.strip() for line in lines):
+            statements.append("\n".join(lines).strip())
+    return statements
+
+
+def get_applied_versions(conn: Connection) -> Dict[int, str]:
+    """
+    Returns {version: checksum} of the applied migrations.
+    """
+    with conn.cursor(row_factory=dict_row) as cur:
+        cur.execute(CREATE_MIGRATIONS_TABLE)
+        cur.execute("SELECT version, checksum FROM schema_migrations;")
+        return {row["version"]: row["checksum"] for row in cur.fetchall()}
+
+
+def _record(conn: Connection, migration: Migration):
+    conn.execute(
+        "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s);",
+        (migration.version, migration.name, migration.checksum),
+    )
+
+
+def _apply(conn: Connection, migration: Migration):
+    if migration.transactional:
+        with conn.transaction():
+            conn.execute(migration.sql)
+            _record(conn, migration)
+        return
+    for statement in split_statements(migration.sql):
+        conn.execute(statement)
+    _record(conn, migration)
+
+
+def migrate(
+    conn: Connection,
+    directory: Path = MIGRATIONS_DIR,
+    baseline: Optional[int] = None,
+    target: Optional[int] = None,
+) -> List[int]:
+    """
+    Applies the pending migrations to the connection's current schema and
+    returns their versions. With `baseline`, versions up to it are recorded
+    as applied without running them (for databases set up by hand). With
+    `target`, later versions are left pending.
+
+    The connection must be idle; it runs in autocommit mode while migrating.
+    """
+    migrations = discover_migrations(directory)
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        conn.execute(f"SELECT pg_advisory_lock({LOCK_KEY});")
+        try:
+            # Read after taking the lock: another runner may have just finished
+            applied = get_applied_versions(conn)
+            done = []
+            for migration in migrations:
+                if migration.version in applied:
+                    continue
+                if target is not None and migration.version > target:
+                    break
+                if baseline is not None and migration.version <= baseline:
+                    _record(conn, migration)
+                else:
+                    _apply(conn, migration)
+                done.append(migration.version)
+            return done
+        finally:
+            conn.execute(f"SELECT pg_advisory_unlock({LOCK_KEY});")
+    finally:
+        conn.autocommit = autocommit
+
+
+def check(conn: Connection, directory: Path = MIGRATIONS_DIR):
+    """
+    Raises MigrationError unless every migration file has been applied.
+
+    Costs one query and a directory listing, so every worker can run it on
+    startup.
+    """
+    migrations = discover_migrations(directory)
+    latest = migrations[-1].version if migrations else 0
+    try:
+        with conn.transaction(), conn.cursor(row_factory=dict_row) as cur:
+            cur.execute(
+                "SELECT count(*) AS applied, COALESCE(max(version), 0) AS version "
+                "FROM schema_migrations;"
+            )
+            row = cur.fetchone()
+    except errors.UndefinedTable:
+        row = {"applied": 0, "version": 0}
+    if row["version"] < latest or row["applied"] < len(migrations):
+        raise MigrationError(
+            f"Database schema is at version {row['version']} with "
+            f"{len(migrations) - row['applied']} migration(s) pending (latest "
+            f"is {latest}); run `python -m app.core.migrations upgrade`"
+        )
+
+
+def status(conn: Connection, directory: Path = MIGRATIONS_DIR) -> List[dict]:
+    """
+    Returns each migration file with whether it is applied, and whether the
+    file changed since.
+    """
+    applied = get_applied_versions(conn)
+    return [
+        {
+            "version": migration.version,
+            "name": migration.name,
+            "applied": migration.version in applied,
+            "changed": migration.version in applied
+            and applied[migration.version] != migration.checksum,
+            "transactional": migration.transactional,
+        }
+        for migration in discover_migrations(directory)
+    ]
+
+
+def main():
+    import psycopg
+
+    from app.database import get_pool_conninfo
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("command", choices=["status", "upgrade", "baseline"])
+    parser.add_argument(
+        "version", type=int, nargs="?", help="baseline: last version already applied"
+    )
+    parser.add_argument("--database-url", default=settings.DATABASE_URL)
+    args = parser.parse_args()
+    if args.command == "baseline" and args.version is None:
+        parser.error("baseline needs the last version already applied")
+
+    with psycopg.connect(get_pool_conninfo(args.database_url)) as conn:
+        if args.command == "status":
+            for row in status(conn):
+                state = "applied" if row["applied"] else "pending"
+                if row["changed"]:
+                    state += " (file changed since)"
+                print(f"{row['version']:03d}_{row['name']}: {state}")
+            conn.commit()
+        else:
+            applied = migrate(
+                conn, baseline=args.version if args.command == "baseline" else None
+            )
+            print(f"applied: {', '.join(map(str, applied)) or 'nothing pending'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+Password hashing with a cost calibrated to the CPU it runs on.
+
+PasswordHasher wraps a passlib CryptContext whose default scheme is
+PASSWORD_HASH_SCHEME: pbkdf2_sha256 (the historical default), scrypt (memory
+hard, from the standard library) or argon2 (memory hard, needs the optional
+argon2-cffi package). Hashes of the other schemes still verify, and
+needs_update() flags them, like hashes more than one step cheaper than the
+current cost.
+
+With PASSWORD_HASH_TARGET_MS set, calibrate() times the scheme on this CPU at
+startup and picks the cost whose hash takes about that long, never less than
+passlib's default for the scheme. Costs move in steps, each doubling the
+hashing time, so timing noise between workers and boots doesn't change the
+cost, nor make the hashes of the previous step due for a rehash.
+
+Metrics (labelled with the scheme):
+    password_hash_seconds, password_verify_seconds: timing summaries.
+    password_hash_cost: the cost new hashes use.
+    password_rehash_total{result="updated"|"skipped"|"failed"}: background
+        rehashes after a login.
+
+Usage:
+    uv run python -m app.core.passwords --scheme scrypt --target-ms 100
+"""
+
+import argparse
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, List, Optional, Set
+
+from passlib import hash as passlib_hash
+from passlib.context import CryptContext
+
+from app.settings import settings
+
+from .logger import AppLogger
+from .metrics import metrics
+
+# How each scheme's "rounds" setting scales the hashing time
+COST_SCALING: Dict[str, str] = {
+    "pbkdf2_sha256": "linear",  # iterations
+    "scrypt": "log2",  # log2 of the CPU/memory cost N
+    "argon2": "linear",  # time cost (passes over the memory)
+}
+
+
+def available_schemes() -> List[str]:
+    """
+    The schemes whose backend is installed; pbkdf2 needs only hashlib.
+    """
+    return [
+        scheme
+        for scheme in COST_SCALING
+        if getattr(getattr(passlib_hash, scheme), "has_backend", lambda: True)()
+    ]
+
+
+def default_cost(scheme: str) -> int:
+    return getattr(passlib_hash, scheme).default_rounds
+
+
+def step_cost(scheme: str, cost: int, steps: int) -> int:
+    """
+    The cost `steps` doublings of hashing time away from `cost`.
+    """
+    if COST_SCALING[scheme] == "log2":
+        return cost + steps
+    return max(1, math.floor(cost * 2.0**steps))
+
+
+class PasswordHasher:
+    """
+    Drop-in for the CryptContext the services used (hash, verify), with
+    per-scheme timings. configure() swaps the context in place, so modules
+    holding a reference pick up a calibrated cost.
+    """
+
+    def __init__(self, scheme: str = "pbkdf2_sha256", cost: Optional[int] = None):
+        self.configure(scheme, cost)
+
+    def configure(self, scheme: str, cost: Optional[int] = None):
+        if scheme not in available_schemes():
+            raise ValueError(
+                f"Password hash scheme {scheme!r} is not available "
+                f"(installed: {', '.join(available_schemes())})"
+            )
+        cost = cost or default_cost(scheme)
+        schemes = [scheme] + [s for s in available_schemes() if s != scheme]
+        self.context = CryptContext(
+            schemes=schemes,
+            default=scheme,
+            deprecated=schemes[1:],
+            **{
+                f"{scheme}__default_rounds": cost,
+                # Hashes a step cheaper (e.g. calibrated on a slower boot)
+                # are kept; anything cheaper than that is due for a rehash
+                f"{scheme}__min_rounds": step_cost(scheme, cost, -1),
+            },
+        )
+        self.scheme = scheme
+        self.cost = cost
+        metrics.set_gauge("password_hash_cost", cost, scheme=scheme)
+
+    def hash(self, password: str) -> str:
+        t0 = time.perf_counter()
+        hashed = self.context.hash(password)
+        metrics.observe(
+            "password_hash_seconds", time.perf_counter() - t0, scheme=self.scheme
+        )
+        return hashed
+
+    def verify(self, password: str, hashed: str) -> bool:
+        scheme = self.context.identify(hashed) or "unknown"
+        t0 = time.perf_counter()
+        valid = self.context.verify(password, hashed)
+        metrics.observe(
+            "password_verify_seconds", time.perf_counter() - t0, scheme=scheme
+        )
+        return valid
+
+    def needs_update(self, hashed: str) -> bool:
+        return self.context.needs_update(hashed)
+
+
+def time_hash(scheme: str, cost: int, samples: int = 3) -> float:
+    """
+    Best of `samples` hashes, in seconds.
+    """
+    handler = getattr(passlib_hash, scheme).using(rounds=cost)
+    best = math.inf
+    for _ in range(samples):
+        t0 = time.perf_counter()
+        handler.hash("calibration-password")
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def calibrate(scheme: str, target_seconds: float, samples: int = 3) -> int:
+    """
+    Returns the cost whose hash takes at most `target_seconds` on this CPU,
+    but not less than passlib's default. Times the default cost once and
+    scales it by whole steps, see step_cost().
+    """
+    base = default_cost(scheme)
+    elapsed = time_hash(scheme, base, samples)
+    steps = math.floor(math.log2(target_seconds / elapsed))
+    return step_cost(scheme, base, max(0, steps))
+
+
+def configure_from_settings(hasher: PasswordHasher, logger: AppLogger):
+    """
+    Applies PASSWORD_HASH_SCHEME, calibrating its cost when
+    PASSWORD_HASH_TARGET_MS is set. Takes about a second per worker boot.
+    """
+    scheme = settings.PASSWORD_HASH_SCHEME
+    cost = None
+    if settings.PASSWORD_HASH_TARGET_MS > 0:
+        cost = calibrate(scheme, settings.PASSWORD_HASH_TARGET_MS / 1000)
+    hasher.configure(scheme, cost)
+    logger.info(
+        {
+            "message": "Password hashing configured",
+            "scheme": scheme,
+            "cost": hasher.cost,
+        }
+    )
+
+
+class BackgroundRehasher:
+    """
+    Re-hashes passwords whose stored hash is outdated, off the request path.
+    `save(key, old_hash, new_hash)` must store the new hash only if the stored
+    one is still `old_hash`, so a password changed meanwhile is kept. A key
+    already queued is not queued again, and a single thread does the hashing
+    so a burst of logins can't take more than one core from the requests.
+    """
+
+    def __init__(
+        self, hasher: PasswordHasher, save: Callable[[Hashable, str, str], bool]
+    ):
+        self.hasher = hasher
+        self.save = save
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rehash")
+        self._lock = threading.Lock()
+        self._pending: Set[Hashable] = set()
+
+    def submit(self, key: Hashable, old_hash: str, password: str) -> bool:
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+        self._executor.submit(self._rehash, key, old_hash, password)
+        return True
+
+    def _rehash(self, key: Hashable, old_hash: str, password: str):
+        scheme = self.hasher.scheme
+        try:
+            updated = self.save(key, old_hash, self.hasher.hash(password))
+            result = "updated" if updated else "skipped"
+        except Exception:
+            result = "failed"
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+        metrics.inc("password_rehash_total", scheme=scheme, result=result)
+
+    def wait(self):
+        """
+        Blocks until the rehashes queued so far are done. Used for testing.
+        """
+        self._executor.submit(lambda: None).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--scheme", choices=available_schemes(), default=settings.PASSWORD_HASH_SCHEME
+    )
+    parser.add_argument(
+        "--target-ms",
+        type=float,
+        default=settings.PASSWORD_HASH_TARGET_MS or 100,
+    )
+    args = parser.parse_args()
+
+    cost = calibrate(args.scheme, args.target_ms / 1000)
+    for rounds in sorted({default_cost(args.scheme), cost}):
+        elapsed = time_hash(args.scheme, rounds)
+        print(f"{args.scheme} cost={rounds}: {elapsed * 1000:.1f} ms per hash")
+    print(f"calibrated cost for {args.target_ms:g} ms: {cost}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,54 +1,448 @@
 """
 R2 (S3-compatible) storage utility for file uploads.
+
+Requests go through one pooled httpx.AsyncClient per event loop, signed with
+AWS Signature Version 4, so an upload waits on the network without holding a
+thread. At most R2_MAX_CONCURRENCY requests are in flight per worker; the
+others queue for a slot. Keep the limit modest: httpcore scans every pooled
+connection each time one frees up, so past a few dozen connections the pool
+costs more CPU than the uploads.
+
+Each attempt connects within R2_CONNECT_TIMEOUT_SECONDS and waits at most
+R2_READ_TIMEOUT_SECONDS on any read or write, and a failed attempt is retried
+up to R2_MAX_RETRIES times while the process's retry budget lasts. The whole
+operation, queueing and retries included, fails after R2_TIMEOUT_SECONDS.
+When R2 keeps failing the circuit breaker opens and operations fail at once
+with R2Unavailable, rather than piling up on timeouts.
+
+Metrics (labelled with the client name):
+    r2_operations_total{operation, result="ok"|"error"|"rejected"}
+    r2_operation_seconds{operation}: retries included.
+    r2_requests_total{operation, status}: each attempt; status is the HTTP
+        status, or "timeout" / "error" when there was no response.
+    r2_request_seconds{operation}
+    r2_requests_in_flight
 """
 
-from typing import Optional
+import asyncio
+import hashlib
+import hmac
+import random
+import time
+from datetime import datetime, timezone
+from typing import IO, AsyncIterator, Callable, Dict, Optional
+from urllib.parse import quote, urlsplit
 
-import boto3
-from botocore.client import Config
+import httpx
+from anyio import to_thread
 
 from app.settings import Settings
 
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from .metrics import metrics
+from .retry_budget import RetryBudget
+
 settings = Settings()
 
+# S3's marker for a payload whose hash isn't part of the signature
+UNSIGNED_PAYLOAD = "UNSIGNED-PAYLOAD"
+READ_CHUNK_BYTES = 64 * 1024
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RETRY_BACKOFF_SECONDS = 0.05
+
 
-def get_r2_client() -> boto3.client:
+class R2Error(Exception):
+    pass
+
+
+class R2Unavailable(R2Error):
     """
-    Returns a boto3 S3 client configured for Cloudflare R2.
+    Rejected without calling R2, because its circuit breaker is open.
     """
-    return boto3.client(
-        "s3",
-        endpoint_url=settings.R2_ENDPOINT_URL,
-        aws_access_key_id=settings.R2_ACCESS_KEY_ID,
-        aws_secret_access_key=settings.R2_SECRET_ACCESS_KEY,
-        config=Config(signature_version="s3v4"),
-        region_name=getattr(settings, "R2_REGION", "auto"),
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _hmac(key: bytes, message: str) -> bytes:
+    return hmac.new(key, message.encode(), hashlib.sha256).digest()
+
+
+def sign_request(
+    method: str,
+    url: str,
+    headers: Dict[str, str],
+    payload_hash: str,
+    access_key_id: str,
+    secret_access_key: str,
+    region: str,
+    now: datetime,
+    service: str = "s3",
+) -> Dict[str, str]:
+    """
+    Returns `headers` plus the Host, X-Amz-Date, X-Amz-Content-SHA256 and
+    Authorization headers of a SigV4-signed request. Every header passed in
+    is signed. `url` must be URI-encoded and have no query string.
+    """
+    parts = urlsplit(url)
+    amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+    signed = {key.lower(): " ".join(value.split()) for key, value in headers.items()}
+    signed.update(
+        {
+            "host": parts.netloc,
+            "x-amz-content-sha256": payload_hash,
+            "x-amz-date": amz_date,
+        }
+    )
+    names = sorted(signed)
+    signed_headers = ";".join(names)
+    canonical_request = "\n".join(
+        [
+            method,
+            parts.path or "/",
+            "",
+            "".join(f"{name}:{signed[name]}\n" for name in names),
+            signed_headers,
+            payload_hash,
+        ]
     )
+    scope = f"{amz_date[:8]}/{region}/{service}/aws4_request"
+    string_to_sign = "\n".join(
+        [
+            "AWS4-HMAC-SHA256",
+            amz_date,
+            scope,
+            hashlib.sha256(canonical_request.encode()).hexdigest(),
+        ]
+    )
+    key = _hmac(f"AWS4{secret_access_key}".encode(), amz_date[:8])
+    for part in (region, service, "aws4_request"):
+        key = _hmac(key, part)
+    signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+    return {
+        **headers,
+        "Host": parts.netloc,
+        "X-Amz-Date": amz_date,
+        "X-Amz-Content-SHA256": payload_hash,
+        "Authorization": (
+            f"AWS4-HMAC-SHA256 Credential={access_key_id}/{scope}, "
+            f"SignedHeaders={signed_headers}, Signature={signature}"
+        ),
+    }
+
 
+async def _read_chunks(file_obj: IO[bytes]) -> AsyncIterator[bytes]:
+    # A spooled upload may be on disk, so reads happen off the event loop
+    while True:
+        chunk = await to_thread.run_sync(file_obj.read, READ_CHUNK_BYTES)
+        if not chunk:
+            return
+        yield chunk
 
-def upload_file_to_r2(
+
+class AsyncR2Client:
+    """
+    Path-style S3 client for the few operations the app needs. The httpx
+    client and the concurrency semaphore belong to the event loop that first
+    uses them, and are rebuilt if another loop (a new TestClient) takes over.
+
+    Each attempt has its own connect and read timeouts; `timeout_seconds`
+    bounds the whole operation, retries included. Timeouts, transport errors,
+    429s and 5xxs are retried up to `max_retries` times, when the
+    `retry_budget` allows. Only timeouts, transport errors and 5xxs count as
+    failures for the `breaker`; a cancelled attempt counts as nothing.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        endpoint_url: str,
+        access_key_id: str,
+        secret_access_key: str,
+        region: str,
+        max_concurrency: int,
+        timeout_seconds: float,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        connect_timeout_seconds: Optional[float] = None,
+        read_timeout_seconds: Optional[float] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        retry_budget: Optional[RetryBudget] = None,
+        max_retries: int = 0,
+    ):
+        self.name = name
+        self.endpoint_url = endpoint_url.rstrip("/")
+        self.access_key_id = access_key_id
+        self.secret_access_key = secret_access_key
+        self.region = region
+        self.max_concurrency = max_concurrency
+        self.timeout_seconds = timeout_seconds
+        self.transport = transport
+        self.attempt_timeout = httpx.Timeout(
+            read_timeout_seconds or timeout_seconds,
+            connect=connect_timeout_seconds or timeout_seconds,
+        )
+        self.breaker = breaker
+        self.retry_budget = retry_budget
+        self.max_retries = max_retries
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._in_flight = 0
+        metrics.register_gauge(
+            "r2_requests_in_flight", lambda: self._in_flight, client=name
+        )
+
+    def _bind(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._client = httpx.AsyncClient(
+                timeout=self.attempt_timeout,
+                transport=self.transport,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                ),
+            )
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+        self._loop = self._client = self._slots = None
+
+    async def put_object(
+        self,
+        bucket: str,
+        key: str,
+        file_obj: IO[bytes],
+        size: int,
+        sha256: Optional[str] = None,
+        content_type: Optional[str] = None,
+        acl: Optional[str] = "public-read",
+    ):
+        """
+        Uploads `size` bytes of `file_obj`, streamed from its current
+        position (rewound to it for a retry). With the payload's `sha256` the
+        storage verifies it. Raises R2Error.
+        """
+        headers = {"Content-Length": str(size)}
+        if content_type:
+            headers["Content-Type"] = content_type
+        if acl:
+            headers["X-Amz-Acl"] = acl
+        position = file_obj.tell()
+
+        def content() -> AsyncIterator[bytes]:
+            file_obj.seek(position)
+            return _read_chunks(file_obj)
+
+        await self._request(
+            "put_object",
+            "PUT",
+            f"{self.endpoint_url}/{bucket}/{quote(key, safe='/~')}",
+            headers,
+            sha256 or UNSIGNED_PAYLOAD,
+            content,
+        )
+
+    async def _request(
+        self,
+        operation: str,
+        method: str,
+        url: str,
+        headers: Dict[str, str],
+        payload_hash: str,
+        content: Callable[[], AsyncIterator[bytes]],
+    ) -> httpx.Response:
+        self._bind()
+        start = time.perf_counter()
+        result = "error"
+        try:
+            async with asyncio.timeout(self.timeout_seconds):
+                response = await self._attempt(
+                    operation, method, url, headers, payload_hash, content
+                )
+            result = "ok"
+            return response
+        except TimeoutError as e:
+            raise R2Error(f"{operation} timed out") from e
+        except CircuitOpenError as e:
+            result = "rejected"
+            raise R2Unavailable(f"{operation} rejected: {e}", e.retry_after) from e
+        finally:
+            metrics.inc(
+                "r2_operations_total",
+                client=self.name,
+                operation=operation,
+                result=result,
+            )
+            metrics.observe(
+                "r2_operation_seconds",
+                time.perf_counter() - start,
+                client=self.name,
+                operation=operation,
+            )
+
+    async def _attempt(
+        self,
+        operation: str,
+        method: str,
+        url: str,
+        headers: Dict[str, str],
+        payload_hash: str,
+        content: Callable[[], AsyncIterator[bytes]],
+    ) -> httpx.Response:
+        if self.retry_budget is not None:
+            self.retry_budget.record_call()
+        retries = 0
+        while True:
+            probe = self.breaker.allow() if self.breaker is not None else False
+            try:
+                response = await self._send(
+                    operation, method, url, headers, payload_hash, content()
+                )
+            except httpx.TimeoutException as e:
+                error, response = R2Error(f"{operation} timed out"), None
+                error.__cause__ = e
+            except httpx.HTTPError as e:
+                error, response = R2Error(f"{operation} failed: {e}"), None
+                error.__cause__ = e
+            except BaseException:
+                # Cancelled (by the operation deadline or the caller), or the
+                # body couldn't be read: nothing learned about R2's health
+                if self.breaker is not None:
+                    self.breaker.release(probe)
+                raise
+            else:
+                error = None
+                if response.is_error:
+                    error = R2Error(
+                        f"{operation} failed with status {response.status_code}"
+                    )
+
+            if self.breaker is not None:
+                # A 4xx, 429 included, is the store answering: it says
+                # nothing about its health
+                if response is None or response.status_code >= 500:
+                    self.breaker.failure(probe)
+                else:
+                    self.breaker.success(probe)
+            transient = response is None or response.status_code in RETRY_STATUSES
+            if error is None:
+                return response
+            if (
+                not transient
+                or retries >= self.max_retries
+                or self.retry_budget is None
+                or not self.retry_budget.try_retry()
+            ):
+                raise error
+            retries += 1
+            # Full jitter, so failed callers don't all come back at once
+            await asyncio.sleep(random.uniform(0, RETRY_BACKOFF_SECONDS * 2**retries))
+
+    async def _send(
+        self,
+        operation: str,
+        method: str,
+        url: str,
+        headers: Dict[str, str],
+        payload_hash: str,
+        content: AsyncIterator[bytes],
+    ) -> httpx.Response:
+        start = time.perf_counter()
+        status = "error"
+        try:
+            async with self._slots:
+                self._in_flight += 1
+                try:
+                    signed = sign_request(
+                        method,
+                        url,
+                        headers,
+                        payload_hash,
+                        self.access_key_id,
+                        self.secret_access_key,
+                        self.region,
+                        datetime.now(timezone.utc),
+                    )
+                    response = await self._client.request(
+                        method, url, headers=signed, content=content
+                    )
+                finally:
+                    self._in_flight -= 1
+            status = str(response.status_code)
+            return response
+        except httpx.TimeoutException:
+            status = "timeout"
+            raise
+        finally:
+            metrics.inc(
+                "r2_requests_total",
+                client=self.name,
+                operation=operation,
+                status=status,
+            )
+            metrics.observe(
+                "r2_request_seconds",
+                time.perf_counter() - start,
+                client=self.name,
+                operation=operation,
+            )
+
+
+r2_client = AsyncR2Client(
+    "r2",
+    settings.R2_ENDPOINT_URL,
+    settings.R2_ACCESS_KEY_ID,
+    settings.R2_SECRET_ACCESS_KEY,
+    settings.R2_REGION,
+    settings.R2_MAX_CONCURRENCY,
+    settings.R2_TIMEOUT_SECONDS,
+    connect_timeout_seconds=settings.R2_CONNECT_TIMEOUT_SECONDS,
+    read_timeout_seconds=settings.R2_READ_TIMEOUT_SECONDS,
+    breaker=CircuitBreaker(
+        "r2",
+        settings.R2_BREAKER_FAILURE_THRESHOLD,
+        settings.R2_BREAKER_OPEN_SECONDS,
+    ),
+    retry_budget=RetryBudget(
+        "r2", settings.R2_RETRY_BUDGET_RATIO, settings.R2_RETRY_BUDGET_MIN_PER_SECOND
+    ),
+    max_retries=settings.R2_MAX_RETRIES,
+)
+
+
+async def upload_file_to_r2(
     file_obj,
     filename: str,
+    size: int,
     bucket: Optional[str] = None,
     content_type: Optional[str] = None,
+    sha256: Optional[str] = None,
 ) -> str:
     """
     Uploads a file-like object to R2 and returns the public URL.
 
     Args:
-        file_obj: File-like object to upload.
+        file_obj: File-like object to upload, read from its current position.
         filename (str): The key (path) to use in the bucket.
+        size (int): Number of bytes to upload.
         bucket (Optional[str]): The R2 bucket name. Defaults to settings.R2_BUCKET_NAME.
         content_type (Optional[str]): Content type for the file.
+        sha256 (Optional[str]): Hex SHA-256 of the content, checked by R2.
 
     Returns:
         str: The public URL of the uploaded file.
+
+    Raises:
+        R2Error: If the upload failed or timed out.
     """
     bucket = bucket or settings.R2_BUCKET_NAME
-    client = get_r2_client()
-    extra_args = {"ACL": "public-read"}
-    if content_type:
-        extra_args["ContentType"] = content_type
-    client.upload_fileobj(file_obj, bucket, filename, ExtraArgs=extra_args)
+    await r2_client.put_object(
+        bucket, filename, file_obj, size, sha256=sha256, content_type=content_type
+    )
     public_url = f"{settings.R2_PUBLIC_BASE_URL.rstrip('/')}/{filename}"
     return public_url
@@ -0,0 +1,224 @@
+"""
+Sliding-window rate limiters.
+
+Both limiters approximate a sliding window with two fixed windows: the count
+of the current window plus the previous window's count weighted by how much
+of it still overlaps the sliding window. That needs two counters per key
+instead of a timestamp per attempt. Every attempt is counted, rejected ones
+included, so a client that keeps hammering stays limited; clear() forgets a
+key's attempts, e.g. once a login succeeds.
+
+MemoryRateLimiter keeps the counters in the process, in lock-striped shards
+so concurrent requests for different keys rarely contend. PostgresRateLimiter
+keeps them in the `rate_limits` table, shared by every worker, at the cost of
+one query per attempt.
+
+Metrics (labelled with the limiter name):
+    rate_limit_attempts_total{result="allowed"|"rejected"}: every hit().
+    rate_limit_tracked_keys: keys with live counters (memory only).
+"""
+
+import abc
+import math
+import threading
+import time
+import zlib
+from contextlib import AbstractContextManager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from psycopg import Connection
+
+from .metrics import metrics
+
+
+def _weighted_count(
+    window: float, now: float, window_start: float, previous: int, current: int
+) -> float:
+    overlap = 1 - (now - window_start) / window
+    return current + previous * overlap
+
+
+class RateLimiter(abc.ABC):
+    """
+    Allows `limit` attempts per key over any `window` seconds.
+    """
+
+    def __init__(self, name: str, limit: int, window: float):
+        self.name = name
+        self.limit = limit
+        self.window = window
+
+    def hit(self, key: str) -> Tuple[bool, float]:
+        """
+        Counts an attempt for `key`. Returns whether it is allowed and, when
+        not, the seconds until it would be.
+        """
+        allowed, retry_after = self._hit(key, time.time())
+        metrics.inc(
+            "rate_limit_attempts_total",
+            limiter=self.name,
+            result="allowed" if allowed else "rejected",
+        )
+        return allowed, retry_after
+
+    @abc.abstractmethod
+    def _hit(self, key: str, now: float) -> Tuple[bool, float]:
+        """
+        Counts an attempt for `key` at `now`, see hit().
+        """
+
+    @abc.abstractmethod
+    def clear(self, key: str):
+        """
+        Forgets the attempts counted for `key`.
+        """
+
+    def _decide(
+        self, now: float, window_start: float, previous: int, current: int
+    ) -> Tuple[bool, float]:
+        count = _weighted_count(self.window, now, window_start, previous, current)
+        if count <= self.limit:
+            return True, 0.0
+        window_end = window_start + self.window
+        if current > self.limit or previous == 0:
+            # Over the limit even once the previous window has slid out
+            return False, window_end - now
+        # The previous window's weight shrinks linearly until window_end
+        needed = (count - self.limit) / previous * self.window
+        return False, min(needed, window_end - now)
+
+
+class _Shard:
+    __slots__ = ("lock", "counters", "next_sweep")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # key -> [window_start, previous count, current count]
+        self.counters: Dict[str, List[float]] = {}
+        self.next_sweep = 0.0
+
+
+class MemoryRateLimiter(RateLimiter):
+    """
+    Counters live in `shards` dicts, each with its own lock; a key always maps
+    to the same shard. Each shard drops keys idle for two windows at most once
+    per window, while it already holds its lock.
+    """
+
+    def __init__(self, name: str, limit: int, window: float, shards: int = 64):
+        super().__init__(name, limit, window)
+        self._shards = [_Shard() for _ in range(shards)]
+        metrics.register_gauge("rate_limit_tracked_keys", self.size, limiter=name)
+
+    def _shard(self, key: str) -> _Shard:
+        return self._shards[zlib.crc32(key.encode()) % len(self._shards)]
+
+    def _hit(self, key: str, now: float) -> Tuple[bool, float]:
+        window_start = math.floor(now / self.window) * self.window
+        shard = self._shard(key)
+        with shard.lock:
+            if now >= shard.next_sweep:
+                self._sweep(shard, window_start)
+                shard.next_sweep = window_start + self.window
+            counter = shard.counters.get(key)
+            if counter is None:
+                counter = shard.counters[key] = [window_start, 0, 0]
+            elif counter[0] != window_start:
+                # Roll over: the current window becomes the previous one,
+                # unless it is older than that
+                adjacent = counter[0] == window_start - self.window
+                counter[:] = [window_start, counter[2] if adjacent else 0, 0]
+            counter[2] += 1
+            previous, current = counter[1], counter[2]
+        return self._decide(now, window_start, previous, current)
+
+    def clear(self, key: str):
+        shard = self._shard(key)
+        with shard.lock:
+            shard.counters.pop(key, None)
+
+    def _sweep(self, shard: _Shard, window_start: float):
+        stale = window_start - self.window
+        for key in [k for k, c in shard.counters.items() if c[0] < stale]:
+            del shard.counters[key]
+
+    def size(self) -> int:
+        return sum(len(shard.counters) for shard in self._shards)
+
+    def reset(self):
+        """
+        Clears all counters. Used for testing.
+        """
+        for shard in self._shards:
+            with shard.lock:
+                shard.counters.clear()
+
+
+class PostgresRateLimiter(RateLimiter):
+    """
+    Counters live in the `rate_limits` table (see
+    schema/003_create_rate_limits.sql). Each attempt is a single upsert that
+    also reads the previous window, on a connection from `get_connection`
+    held only for that query. Windows older than the previous one are
+    deleted by whichever attempt first sees a new window start.
+    """
+
+    HIT = """
+        WITH current AS (
+            INSERT INTO rate_limits (limiter, key, window_start, hits)
+            VALUES (%(limiter)s, %(key)s, %(window_start)s, 1)
+            ON CONFLICT (limiter, key, window_start)
+            DO UPDATE SET hits = rate_limits.hits + 1
+            RETURNING hits
+        )
+        SELECT
+            (SELECT hits FROM current) AS current,
+            COALESCE(
+                (
+                    SELECT hits FROM rate_limits
+                    WHERE limiter = %(limiter)s AND key = %(key)s
+                        AND window_start = %(previous_start)s
+                ),
+                0
+            ) AS previous;
+    """
+    PURGE = "DELETE FROM rate_limits WHERE limiter = %s AND window_start < %s;"
+    CLEAR = "DELETE FROM rate_limits WHERE limiter = %s AND key = %s;"
+
+    def __init__(
+        self,
+        name: str,
+        limit: int,
+        window: float,
+        get_connection: Callable[[], AbstractContextManager[Connection]],
+    ):
+        super().__init__(name, limit, window)
+        self._get_connection = get_connection
+        self._purged_before: Optional[int] = None
+        self._purge_lock = threading.Lock()
+
+    def _hit(self, key: str, now: float) -> Tuple[bool, float]:
+        window_start = math.floor(now / self.window) * self.window
+        # Stored as integer milliseconds so window starts compare exactly
+        start_ms = int(window_start * 1000)
+        previous_ms = int((window_start - self.window) * 1000)
+        with self._get_connection() as conn:
+            row = conn.execute(
+                self.HIT,
+                {
+                    "limiter": self.name,
+                    "key": key,
+                    "window_start": start_ms,
+                    "previous_start": previous_ms,
+                },
+            ).fetchone()
+            with self._purge_lock:
+                purge = self._purged_before != previous_ms
+                self._purged_before = previous_ms
+            if purge:
+                conn.execute(self.PURGE, (self.name, previous_ms))
+        return self._decide(now, window_start, row["previous"], row["current"])
+
+    def clear(self, key: str):
+        with self._get_connection() as conn:
+            conn.execute(self.CLEAR, (self.name, key))
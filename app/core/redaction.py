@@ -0,0 +1,18 @@
+"""
+Request fields that are never logged or captured. Shared by the logging
+middleware, which redacts them, and benchmarks/replay.py, which fills them
+back in from its own accounts. The OAuth2 login form sends the email as
+`username`, so usernames are redacted too.
+"""
+
+PASSWORD_KEYS = frozenset(
+    {
+        "password",
+        "current_password",
+        "old_password",
+        "new_password",
+        "confirm_password",
+    }
+)
+
+SENSITIVE_KEYS = PASSWORD_KEYS | {"email", "username", "refresh_token"}
@@ -0,0 +1,61 @@
+"""
+JSON response classes backed by pydantic-core's Rust encoder, and helpers
+for conditional GETs.
+"""
+
+import hashlib
+from typing import Any, Optional
+
+from fastapi.responses import JSONResponse, Response
+from pydantic_core import to_json
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    Drop-in replacement for JSONResponse (orjson-style): encodes straight to
+    compact UTF-8 bytes without going through the stdlib json module.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return to_json(content)
+
+
+class RawJSONResponse(Response):
+    """
+    Response for bodies that are already encoded JSON bytes.
+    """
+
+    media_type = "application/json"
+
+
+def weak_etag(*parts: Any) -> str:
+    """
+    A weak validator for a representation derived from `parts` (e.g. a row's
+    id and updated_at), so its freshness can be checked without rendering it.
+    """
+    digest = hashlib.blake2b(
+        "\x1f".join(map(str, parts)).encode(), digest_size=12
+    ).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    If-None-Match uses the weak comparison: W/ prefixes are ignored.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(
+        candidate.strip().removeprefix("W/") == opaque
+        for candidate in if_none_match.split(",")
+    )
+
+
+def not_modified(headers: dict) -> Response:
+    """
+    A 304 carrying the validator and caching headers the 200 would have had.
+    """
+    return Response(status_code=304, headers=headers)
@@ -0,0 +1,76 @@
+"""
+Per-process retry budget.
+
+Retrying every failed call multiplies the load on a dependency exactly when
+it is struggling. The budget caps retries over the last `window` seconds at
+`ratio` of the calls made in that window, plus `min_per_second` so that a
+quiet process can still retry now and then. Past that, failures are returned
+as they are.
+
+Metrics (labelled with the budget name):
+    retry_budget_retries_total{result="allowed"|"exhausted"}
+"""
+
+import threading
+import time
+
+from .metrics import metrics
+
+
+class RetryBudget:
+    """
+    Counts calls and retries in one-second buckets over a sliding window.
+    """
+
+    def __init__(
+        self, name: str, ratio: float, min_per_second: float, window: int = 10
+    ):
+        self.name = name
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window = window
+        self._lock = threading.Lock()
+        self._calls = [0] * window
+        self._retries = [0] * window
+        self._second = int(time.monotonic())
+
+    def _advance(self) -> int:
+        now = int(time.monotonic())
+        for second in range(max(self._second + 1, now - self.window + 1), now + 1):
+            self._calls[second % self.window] = 0
+            self._retries[second % self.window] = 0
+        self._second = max(self._second, now)
+        return now % self.window
+
+    def record_call(self):
+        """
+        Counts a first attempt, which earns `ratio` of a retry.
+        """
+        with self._lock:
+            self._calls[self._advance()] += 1
+
+    def try_retry(self) -> bool:
+        """
+        Takes a retry from the budget if there is one left.
+        """
+        with self._lock:
+            bucket = self._advance()
+            allowed = sum(self._retries) < (
+                self.ratio * sum(self._calls) + self.min_per_second * self.window
+            )
+            if allowed:
+                self._retries[bucket] += 1
+        metrics.inc(
+            "retry_budget_retries_total",
+            budget=self.name,
+            result="allowed" if allowed else "exhausted",
+        )
+        return allowed
+
+    def reset(self):
+        """
+        Forgets the calls and retries counted so far. Used for testing.
+        """
+        with self._lock:
+            self._calls = [0] * self.window
+            self._retries = [0] * self.window
@@ -0,0 +1,166 @@
+"""
+In-memory filter of revoked ids, synced from the database.
+
+A Bloom filter answers "definitely not revoked" without a query; only a
+possible hit (a revoked id, or a false positive at about `error_rate`) has to
+be confirmed against the database. It can't forget an id, so it is rebuilt
+from the live revocations every few syncs, which drops the expired ones.
+
+Metrics (labelled with the filter name):
+    revocation_filter_checks_total{result="negative"|"positive"}
+    revocation_filter_false_positives_total: positives the database cleared.
+    revocation_filter_entries: ids added since the last rebuild.
+"""
+
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from .metrics import metrics
+
+# Incremental syncs reload this far before the newest revocation seen:
+# revoked_at is taken when the revoking transaction starts, not when it
+# commits, so a slow transaction can land behind the watermark
+SYNC_OVERLAP = timedelta(seconds=60)
+
+# Returns (id, revoked_at) for revocations after `since`, or all live ones
+LoadRevocations = Callable[[Optional[datetime]], List[Tuple[str, datetime]]]
+
+
+class BloomFilter:
+    """
+    `capacity` ids at `error_rate` false positives, with k bit positions per
+    id derived from one blake2b digest (double hashing).
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(
+            8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        )
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str) -> Iterable[int]:
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+
+class RevocationFilter:
+    """
+    Syncs lazily: the first check after `sync_seconds` loads the revocations
+    since the newest one seen, through the caller's `load`, and every
+    `rebuild_every` syncs (or once past capacity) reloads them all into a
+    fresh filter. Other threads keep checking the current filter meanwhile.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        capacity: int,
+        error_rate: float,
+        sync_seconds: float,
+        rebuild_every: int = 20,
+    ):
+        self.name = name
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_seconds = sync_seconds
+        self.rebuild_every = rebuild_every
+        self._filter = BloomFilter(capacity, error_rate)
+        self._sync_lock = threading.Lock()
+        self._add_lock = threading.Lock()
+        self._next_sync = 0.0
+        self._syncs = 0
+        self._watermark: Optional[datetime] = None
+        self._added_while_rebuilding: Optional[List[str]] = None
+        metrics.register_gauge(
+            "revocation_filter_entries", lambda: self._filter.count, filter=name
+        )
+
+    def add(self, key: str):
+        """
+        Records a revocation made by this process right away.
+        """
+        with self._add_lock:
+            self._filter.add(key)
+            if self._added_while_rebuilding is not None:
+                self._added_while_rebuilding.append(key)
+
+    def might_contain(self, key: str) -> bool:
+        hit = key in self._filter
+        metrics.inc(
+            "revocation_filter_checks_total",
+            filter=self.name,
+            result="positive" if hit else "negative",
+        )
+        return hit
+
+    def false_positive(self):
+        metrics.inc("revocation_filter_false_positives_total", filter=self.name)
+
+    def is_stale(self) -> bool:
+        return time.monotonic() >= self._next_sync
+
+    def sync(self, load: LoadRevocations):
+        """
+        Loads new revocations; a no-op if another thread is already syncing.
+        """
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            rebuild = (
+                self._watermark is None
+                or self._syncs % self.rebuild_every == 0
+                or self._filter.count > self.capacity
+            )
+            if rebuild:
+                with self._add_lock:
+                    self._added_while_rebuilding = []
+                rows = load(None)
+                fresh = BloomFilter(self.capacity, self.error_rate)
+                for key, _ in rows:
+                    fresh.add(key)
+                with self._add_lock:
+                    # Revocations made here while the load ran
+                    for key in self._added_while_rebuilding:
+                        fresh.add(key)
+                    self._added_while_rebuilding = None
+                    self._filter = fresh
+            else:
+                rows = load(self._watermark - SYNC_OVERLAP)
+                for key, _ in rows:
+                    self.add(key)
+            if rows:
+                newest = max(revoked_at for _, revoked_at in rows)
+                self._watermark = max(self._watermark or newest, newest)
+            self._syncs += 1
+            self._next_sync = time.monotonic() + self.sync_seconds
+        finally:
+            self._sync_lock.release()
+
+    def reset(self):
+        """
+        Empties the filter and forces a full sync on next use. Used for testing.
+        """
+        with self._sync_lock, self._add_lock:
+            self._filter = BloomFilter(self.capacity, self.error_rate)
+            self._watermark = None
+            self._syncs = 0
+            self._next_sync = 0.0
@@ -0,0 +1,61 @@
+"""
+Singleflight: concurrent callers asking for the same key share one in-flight
+call and its result (or exception) instead of each doing the work.
+"""
+
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+from .metrics import metrics
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Results are only shared between callers that overlap in time; nothing is
+    cached once the leader's call returns.
+
+    Metrics (labelled with the group name):
+        singleflight_calls_total: every call to do().
+        singleflight_shared_total: calls served by another caller's result.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        metrics.inc("singleflight_calls_total", group=self.name)
+        if not leader:
+            metrics.inc("singleflight_shared_total", group=self.name)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
@@ -0,0 +1,78 @@
+"""
+Bounded cache of verified JWT claims, keyed by a digest of the token.
+
+Clients send the same access token until it expires, so verifying its
+signature once per worker is enough: later requests with the same token get
+the claims decoded the first time, until their `exp`. Tokens that fail to
+verify, and tokens without an `exp`, are never cached.
+
+Metrics (labelled with the cache name):
+    token_cache_lookups_total{result="hit"|"miss"|"expired"}
+    token_cache_entries: tokens currently cached.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Tuple
+
+from .metrics import metrics
+
+Claims = Dict[str, Any]
+
+
+class TokenCache:
+    """
+    Least recently used entries are evicted past `max_size`; 0 disables the
+    cache. The returned claims are shared between requests and must not be
+    modified.
+    """
+
+    def __init__(self, name: str, max_size: int):
+        self.name = name
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[bytes, Tuple[float, Claims]]" = OrderedDict()
+        metrics.register_gauge("token_cache_entries", self.size, cache=name)
+
+    def size(self) -> int:
+        return len(self._entries)
+
+    def decode(self, token: str, verify: Callable[[str], Claims]) -> Claims:
+        """
+        Returns the claims of `token`, calling `verify` (which raises on an
+        invalid token) unless a live entry is cached.
+        """
+        if self.max_size <= 0:
+            return verify(token)
+        key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    result = "hit"
+                else:
+                    del self._entries[key]
+                    result = "expired"
+            else:
+                result = "miss"
+        metrics.inc("token_cache_lookups_total", cache=self.name, result=result)
+        if result == "hit":
+            return entry[1]
+
+        claims = verify(token)
+        expires = claims.get("exp")
+        if isinstance(expires, (int, float)) and expires > now:
+            with self._lock:
+                self._entries[key] = (float(expires), claims)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return claims
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
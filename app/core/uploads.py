@@ -0,0 +1,185 @@
+"""
+Streaming multipart upload of a single file, bounded while it arrives.
+
+The request body is parsed chunk by chunk as the client sends it: the file
+part is hashed and written to a spool that stays in memory up to
+`spool_bytes` and rolls over to a temporary file above that, and the other
+parts are discarded. A request declaring a Content-Length over the limit is
+rejected before its body is read; one that doesn't is cut off at the first
+chunk past it, so an oversized upload costs at most the limit in memory or
+disk, never the full body.
+
+Metrics:
+    upload_bytes_total: file bytes accepted.
+    upload_rejected_total{reason="too_large"|"invalid"}
+    upload_spooled_to_disk_total: uploads that rolled over to disk.
+"""
+
+import hashlib
+from tempfile import SpooledTemporaryFile
+from typing import AsyncIterator, Dict, Mapping, Optional
+
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from .metrics import metrics
+
+# Part headers and boundaries around the file: a body over the file limit
+# plus this much is too large whatever its parts are
+MULTIPART_OVERHEAD_BYTES = 16 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class SpooledUpload:
+    """
+    An uploaded file, its spool rewound for reading. `on_disk` tells whether
+    the spool rolled over to a temporary file. Close it when done.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        content_type: Optional[str],
+        file: SpooledTemporaryFile,
+        size: int,
+        sha256: str,
+        on_disk: bool = False,
+    ):
+        self.filename = filename
+        self.content_type = content_type
+        self.file = file
+        self.size = size
+        self.sha256 = sha256
+        self.on_disk = on_disk
+
+    def close(self):
+        self.file.close()
+
+
+def _disposition(headers: Dict[bytes, bytes]) -> Dict[bytes, bytes]:
+    _, options = parse_options_header(headers.get(b"content-disposition", b""))
+    return options
+
+
+async def read_upload(
+    headers: Mapping[str, str],
+    stream: AsyncIterator[bytes],
+    field: str,
+    max_bytes: int,
+    spool_bytes: int,
+) -> SpooledUpload:
+    """
+    Reads the file sent as `field` from a multipart/form-data body.
+
+    Raises UploadTooLarge past `max_bytes`, and ValueError for a body that
+    isn't multipart, is malformed or has no such file.
+    """
+    content_type, options = parse_options_header(headers.get("content-type", ""))
+    boundary = options.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        metrics.inc("upload_rejected_total", reason="invalid")
+        raise ValueError("Expected a multipart/form-data body")
+    max_body = max_bytes + MULTIPART_OVERHEAD_BYTES
+    declared = headers.get("content-length")
+    if declared is not None and declared.isdigit() and int(declared) > max_body:
+        metrics.inc("upload_rejected_total", reason="too_large")
+        raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+
+    # No max_size: the spool rolls over when on_part_data says so, since it
+    # already counts the file's bytes
+    spool = SpooledTemporaryFile()
+    digest = hashlib.sha256()
+    part_headers: Dict[bytes, bytes] = {}
+    header_name = bytearray()
+    header_value = bytearray()
+    state = {"in_file": False, "found": None, "size": 0, "on_disk": False}
+
+    def on_part_begin():
+        part_headers.clear()
+        state["in_file"] = False
+
+    def on_header_field(data: bytes, start: int, end: int):
+        header_name.extend(data[start:end])
+
+    def on_header_value(data: bytes, start: int, end: int):
+        header_value.extend(data[start:end])
+
+    def on_header_end():
+        part_headers[bytes(header_name).lower()] = bytes(header_value)
+        header_name.clear()
+        header_value.clear()
+
+    def on_headers_finished():
+        disposition = _disposition(part_headers)
+        filename = disposition.get(b"filename")
+        if (
+            state["found"] is None
+            and filename is not None
+            and disposition.get(b"name") == field.encode()
+        ):
+            state["in_file"] = True
+            state["found"] = (
+                filename.decode("utf-8", "replace"),
+                part_headers.get(b"content-type", b"").decode("latin-1") or None,
+            )
+
+    def on_part_data(data: bytes, start: int, end: int):
+        if not state["in_file"]:
+            return
+        chunk = data[start:end]
+        state["size"] += len(chunk)
+        if state["size"] > max_bytes:
+            raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+        digest.update(chunk)
+        if not state["on_disk"] and state["size"] > spool_bytes:
+            # Before the write, so the chunk goes straight to the file
+            spool.rollover()
+            state["on_disk"] = True
+        spool.write(chunk)
+
+    parser = MultipartParser(
+        boundary,
+        {
+            "on_part_begin": on_part_begin,
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished,
+            "on_part_data": on_part_data,
+        },
+    )
+    received = 0
+    try:
+        async for chunk in stream:
+            received += len(chunk)
+            if received > max_body:
+                raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+            parser.write(chunk)
+        parser.finalize()
+        if state["found"] is None:
+            raise ValueError(f"Missing file field {field!r}")
+    except UploadTooLarge:
+        spool.close()
+        metrics.inc("upload_rejected_total", reason="too_large")
+        raise
+    except (MultipartParseError, ValueError) as e:
+        spool.close()
+        metrics.inc("upload_rejected_total", reason="invalid")
+        raise ValueError(str(e) or "Invalid multipart body") from e
+
+    if state["on_disk"]:
+        metrics.inc("upload_spooled_to_disk_total")
+    metrics.inc("upload_bytes_total", state["size"])
+    spool.seek(0)
+    filename, content_type = state["found"]
+    return SpooledUpload(
+        filename,
+        content_type,
+        spool,
+        state["size"],
+        digest.hexdigest(),
+        on_disk=state["on_disk"],
+    )
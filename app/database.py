@@ -1,13 +1,63 @@
+import hashlib
+import hmac
+import math
+import time
 from contextlib import contextmanager
+from typing import Callable, ContextManager, Optional
 
+from fastapi import Request, Response
+from psycopg import Connection
+from psycopg.conninfo import make_conninfo
 from psycopg.rows import dict_row
 from psycopg_pool import ConnectionPool
 
 from app.settings import settings
 
+from .core.metrics import metrics
+
 # Global connection pool
 pool: ConnectionPool = None
 
+# Optional read-only pool pointing at a streaming replica
+replica_pool: ConnectionPool = None
+
+# Read-your-writes: after a write, the client gets a cookie holding the
+# deadline (epoch seconds) until which its reads go to the primary, signed for
+# the user who wrote. Any worker or app replica can check it.
+PRIMARY_STICKY_COOKIE = "primary_until"
+
+REPLICA_LAG_QUERY = """
+    SELECT COALESCE(
+        CASE
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+        END,
+        0
+    ) AS lag_seconds;
+"""
+
+
+def get_connection_kwargs() -> dict:
+    """
+    Returns the keyword arguments used for every pooled connection.
+
+    With prepared statements disabled, psycopg's automatic preparation is
+    turned off as well, since a transaction-pooling pgbouncer may hand the
+    next query to a server session that never saw the PREPARE.
+    """
+    kwargs = {"row_factory": dict_row}
+    if not settings.DB_PREPARED_STATEMENTS:
+        kwargs["prepare_threshold"] = None
+    return kwargs
+
+
+def get_pool_conninfo(database_url: str) -> str:
+    """
+    Pins search_path to public. Merged with make_conninfo so URLs that already
+    carry query parameters (e.g. ?host=/var/run/postgresql) keep working.
+    """
+    return make_conninfo(database_url, options="-c search_path=public")
+
 
 def get_db_pool() -> ConnectionPool:
     """
@@ -16,10 +66,10 @@ def get_db_pool() -> ConnectionPool:
     global pool
     if pool is None:
         pool = ConnectionPool(
-            conninfo=f"{settings.DATABASE_URL}?options=-c%20search_path%3Dpublic",
+            conninfo=get_pool_conninfo(settings.DATABASE_URL),
             min_size=1,
             max_size=10,
-            kwargs={"row_factory": dict_row},
+            kwargs=get_connection_kwargs(),
             open=True,
         )
     return pool
@@ -33,6 +83,90 @@ def set_db_pool(db_pool: ConnectionPool):
     pool = db_pool
 
 
+def _configure_replica_connection(conn: Connection):
+    # Anything that tries to write (or lock with FOR UPDATE) on a replica
+    # connection fails fast instead of hanging on a hot standby.
+    conn.read_only = True
+
+
+def get_replica_pool() -> Optional[ConnectionPool]:
+    """
+    Returns the read replica pool, or None when no replica is configured.
+    """
+    global replica_pool
+    if replica_pool is None and settings.DATABASE_REPLICA_URL:
+        replica_pool = ConnectionPool(
+            conninfo=get_pool_conninfo(settings.DATABASE_REPLICA_URL),
+            min_size=1,
+            max_size=10,
+            kwargs=get_connection_kwargs(),
+            configure=_configure_replica_connection,
+            open=True,
+        )
+        metrics.register_gauge("db_replica_lag_seconds", measure_replica_lag)
+    return replica_pool
+
+
+def set_replica_pool(db_pool: Optional[ConnectionPool]):
+    """
+    Sets the global replica pool. Used for testing.
+    """
+    global replica_pool
+    replica_pool = db_pool
+
+
+def measure_replica_lag() -> float:
+    """
+    Returns how far (in seconds) the replica's replay is behind the primary.
+    """
+    db_pool = get_replica_pool()
+    if db_pool is None:
+        return 0.0
+    with db_pool.connection() as conn:
+        row = conn.execute(REPLICA_LAG_QUERY).fetchone()
+        return float(row["lag_seconds"])
+
+
+def _sticky_signature(subject: str, deadline: int) -> str:
+    message = f"primary-sticky|{subject}|{deadline}".encode()
+    return hmac.new(settings.SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()
+
+
+def set_primary_sticky(response: Response, subject: str):
+    """
+    Routes the reads of `subject` (the email of the user who just wrote) to
+    the primary for REPLICA_STICKY_SECONDS, so they see their own write even
+    if the replica hasn't replayed it yet.
+    """
+    if not subject or settings.REPLICA_STICKY_SECONDS <= 0:
+        return
+    max_age = math.ceil(settings.REPLICA_STICKY_SECONDS)
+    deadline = int(time.time()) + max_age
+    response.set_cookie(
+        PRIMARY_STICKY_COOKIE,
+        f"{deadline}.{_sticky_signature(subject, deadline)}",
+        max_age=max_age,
+        httponly=True,
+        samesite="lax",
+    )
+
+
+def is_primary_sticky(request: Request) -> bool:
+    """
+    Whether the request's cookie asks for the primary, for the subject that
+    authentication verified (get_current_user_row stores it on request.state).
+    Unauthenticated reads always go to the replica.
+    """
+    subject = getattr(request.state, "subject", None)
+    cookie = request.cookies.get(PRIMARY_STICKY_COOKIE)
+    if not subject or not cookie:
+        return False
+    deadline, _, signature = cookie.partition(".")
+    if not deadline.isdigit() or int(deadline) <= time.time():
+        return False
+    return hmac.compare_digest(signature, _sticky_signature(subject, int(deadline)))
+
+
 @contextmanager
 def get_db_connection_context():
     """
@@ -44,11 +178,37 @@ def get_db_connection_context():
         yield conn
 
 
-def get_db_dependency():
+@contextmanager
+def get_read_connection_context(primary: bool = False):
     """
-    A FastAPI dependency that provides a database connection from the pool.
-    This is what the router layer will use.
+    Provides a connection for read-only queries: from the replica pool when
+    one is configured, from the primary otherwise or when `primary` is set.
+    Transactions and FOR UPDATE locks must use the primary.
     """
-    db_pool = get_db_pool()
+    db_pool = get_replica_pool()
+    if db_pool is None or primary:
+        metrics.inc("db_reads_total", target="primary")
+        db_pool = get_db_pool()
+    else:
+        metrics.inc("db_reads_total", target="replica")
     with db_pool.connection() as conn:
         yield conn
+
+
+def get_connection_provider() -> Callable[[], ContextManager[Connection]]:
+    """
+    A FastAPI dependency that provides a factory for primary connections, for
+    routes that must not hold one while they wait on something else.
+    """
+    return get_db_connection_context
+
+
+def get_read_connection_provider(
+    request: Request,
+) -> Callable[[], ContextManager[Connection]]:
+    """
+    A FastAPI dependency that provides a factory for read connections instead
+    of a connection, so callers only check one out when they actually query.
+    Stickiness is checked at checkout, once authentication has run.
+    """
+    return lambda: get_read_connection_context(is_primary_sticky(request))
@@ -1,5 +1,6 @@
-import jwt
-from fastapi import Depends, HTTPException, status
+from typing import Callable, ContextManager
+
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from jwt.exceptions import InvalidTokenError
 from psycopg import Connection
@@ -7,22 +8,41 @@ from psycopg import Connection
 from app.settings import settings
 
 from ..core.logger import AppLogger
-from ..database import get_db_dependency
+from ..core.token_cache import TokenCache
+from ..database import get_read_connection_provider
 from ..middleware.trace_id import get_trace_id
-from ..users import storage as user_storage
-from ..users.models import User
+from ..users.backends import get_user_storage
+from ..users.models import User, UserRow
+from ..users.services import (
+    is_token_family_revoked,
+    key_ring,
+    to_public_user,
+    user_lookups,
+)
 from .logger import get_app_logger
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 
+# Claims of access tokens already verified by this worker
+access_token_cache = TokenCache("access_tokens", settings.ACCESS_TOKEN_CACHE_SIZE)
+# Tokens of a removed key must not outlive it in the cache
+key_ring.on_change(access_token_cache.clear)
+
+
+def verify_access_token(token: str) -> dict:
+    return key_ring.decode(token)
+
 
-def get_current_user(
+def get_current_user_row(
+    request: Request,
     token: str = Depends(oauth2_scheme),
-    conn: Connection = Depends(get_db_dependency),
+    get_connection: Callable[[], ContextManager[Connection]] = Depends(
+        get_read_connection_provider
+    ),
     logger: AppLogger = Depends(lambda: get_app_logger("auth.get_current_user")),
-) -> User:
+) -> UserRow:
     """
-    Dependency to get the current user from a JWT token.
+    Dependency to get the stored row of the current user from a JWT token.
     """
     trace_id = get_trace_id()
     credentials_exception = HTTPException(
@@ -30,21 +50,49 @@ def get_current_user(
         detail={"message": "Could not validate credentials", "trace_id": trace_id},
         headers={"WWW-Authenticate": "Bearer"},
     )
+    # A cache hit skips key_ring.decode(), which is what rescans the keys and
+    # clears the cache once one is removed
+    key_ring.maybe_reload()
     try:
-        payload = jwt.decode(
-            token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
-        )
+        payload = access_token_cache.decode(token, verify_access_token)
         email: str = payload.get("sub")
         if email is None:
             raise credentials_exception
     except InvalidTokenError:
         raise credentials_exception
+    # Access tokens outlive the revocation of their refresh token family, so
+    # they are checked too; most checks end in the in-memory filter
+    family_id = payload.get("fam")
+    if family_id is not None:
+        try:
+            revoked = is_token_family_revoked(
+                get_connection, family_id, trace_id, logger
+            )
+        except ValueError:
+            raise credentials_exception
+        if revoked:
+            raise credentials_exception
+    # Verified, so the read-your-writes cookie may be checked against it
+    request.state.subject = email
 
-    user = user_storage.get_user_by_email(
-        conn, email=email, trace_id=trace_id, logger=logger
-    )
+    def load_user():
+        with get_connection() as conn:
+            return get_user_storage().get_user_by_email(
+                conn, email=email, trace_id=trace_id, logger=logger
+            )
+
+    # Only the leader of concurrent lookups for this email checks out a
+    # pooled connection; the others wait for its result.
+    user = user_lookups.do(("email", email), load_user)
 
     if user is None:
         raise credentials_exception
 
-    return User(**user.model_dump())
+    return user
+
+
+def get_current_user(user: UserRow = Depends(get_current_user_row)) -> User:
+    """
+    Dependency to get the current user from a JWT token.
+    """
+    return to_public_user(user)
@@ -0,0 +1,20 @@
+from fastapi import Depends
+
+from ..core.logger import AppLogger
+from ..middleware.trace_id import get_trace_id
+from ..users.loader import UserLoader
+from ..users.services import UnitOfWork
+from .logger import get_app_logger
+from .unit_of_work import get_read_unit_of_work
+
+
+def get_user_loader(
+    uow: UnitOfWork = Depends(get_read_unit_of_work),
+    logger: AppLogger = Depends(lambda: get_app_logger("loader.users")),
+) -> UserLoader:
+    """
+    Dependency that provides the request's UserLoader. FastAPI caches it per
+    request, so every dependant shares (and coalesces through) one instance.
+    A connection is only checked out while it dispatches a query.
+    """
+    return UserLoader(uow, get_trace_id(), logger)
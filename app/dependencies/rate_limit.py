@@ -0,0 +1,111 @@
+from typing import Dict, Optional
+
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.security import OAuth2PasswordRequestForm
+
+from app.settings import settings
+
+from ..core.logger import AppLogger
+from ..core.rate_limit import MemoryRateLimiter, PostgresRateLimiter, RateLimiter
+from ..database import get_db_connection_context
+from ..middleware.trace_id import get_trace_id
+from .logger import get_app_logger
+
+# Built on first use from the settings, one per key kind
+_login_limiters: Optional[Dict[str, RateLimiter]] = None
+
+
+def build_login_limiters() -> Dict[str, RateLimiter]:
+    """
+    The in-memory store has no database to share counters through, so it
+    always gets in-memory limiters.
+    """
+    limits = {
+        "ip": settings.LOGIN_RATE_LIMIT_PER_IP,
+        "email": settings.LOGIN_RATE_LIMIT_PER_EMAIL,
+    }
+    window = settings.LOGIN_RATE_LIMIT_WINDOW_SECONDS
+    shared = (
+        settings.LOGIN_RATE_LIMIT_BACKEND == "postgres"
+        and settings.USERS_STORAGE_BACKEND == "postgres"
+    )
+    if shared:
+        return {
+            kind: PostgresRateLimiter(
+                f"login_{kind}", limit, window, get_db_connection_context
+            )
+            for kind, limit in limits.items()
+        }
+    return {
+        kind: MemoryRateLimiter(f"login_{kind}", limit, window)
+        for kind, limit in limits.items()
+    }
+
+
+def get_login_limiters() -> Dict[str, RateLimiter]:
+    global _login_limiters
+    if _login_limiters is None:
+        _login_limiters = build_login_limiters()
+    return _login_limiters
+
+
+def set_login_limiters(limiters: Optional[Dict[str, RateLimiter]]):
+    """
+    Replaces the login limiters; None rebuilds them from the settings on next
+    use. Used for testing.
+    """
+    global _login_limiters
+    _login_limiters = limiters
+
+
+def _email_key(email: str) -> str:
+    # Login matches emails regardless of case, and so does the limit
+    return email.strip().lower()[:255]
+
+
+def limit_login_attempts(
+    request: Request,
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    logger: AppLogger = Depends(lambda: get_app_logger("rate_limit.login")),
+):
+    """
+    Counts a login attempt against the client IP and the submitted email, and
+    rejects it with 429 when either is over its limit. Routes must declare it
+    before their connection dependency, so rejected attempts neither check
+    out a connection nor verify a password hash.
+    """
+    if settings.LOGIN_RATE_LIMIT_BACKEND == "off":
+        return
+    limiters = get_login_limiters()
+    keys = {
+        "ip": request.client.host if request.client else "unknown",
+        "email": _email_key(form_data.username),
+    }
+    for kind, key in keys.items():
+        allowed, retry_after = limiters[kind].hit(key)
+        if not allowed:
+            trace_id = get_trace_id()
+            logger.warning(
+                {
+                    "trace_id": trace_id,
+                    "message": "Login rate limit exceeded",
+                    "limit": kind,
+                }
+            )
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail={"message": "Too many login attempts", "trace_id": trace_id},
+                headers={"Retry-After": str(max(1, round(retry_after)))},
+            )
+
+
+def clear_login_attempts(email: str):
+    """
+    Forgets the attempts counted against `email` once a login with it
+    succeeds, so the per-email limit only ever holds back failed guesses and
+    its owner logging in often doesn't lock the account. The per-IP count is
+    kept.
+    """
+    if settings.LOGIN_RATE_LIMIT_BACKEND == "off":
+        return
+    get_login_limiters()["email"].clear(_email_key(email))
@@ -0,0 +1,39 @@
+from typing import Callable, ContextManager
+
+from fastapi import Depends, Request
+from psycopg import Connection
+
+from ..database import get_connection_provider, get_read_connection_provider
+from ..users.services import UnitOfWork
+
+
+def _route_of(request: Request) -> str:
+    route = request.scope.get("route")
+    return route.path if route is not None else request.url.path
+
+
+def get_unit_of_work(
+    request: Request,
+    get_connection: Callable[[], ContextManager[Connection]] = Depends(
+        get_connection_provider
+    ),
+) -> UnitOfWork:
+    """
+    Dependency that provides the request's UnitOfWork instead of a connection:
+    services check one out around their storage calls only. Hold times are
+    labelled with the route's path template.
+    """
+    return UnitOfWork(get_connection, _route_of(request))
+
+
+def get_read_unit_of_work(
+    request: Request,
+    get_connection: Callable[[], ContextManager[Connection]] = Depends(
+        get_read_connection_provider
+    ),
+) -> UnitOfWork:
+    """
+    Like get_unit_of_work, for read-only routes: connections come from the
+    replica when one is configured, or the primary for sticky users.
+    """
+    return UnitOfWork(get_connection, _route_of(request))
@@ -0,0 +1,46 @@
+from typing import AsyncIterator
+
+from fastapi import Depends, HTTPException, Request, status
+
+from app.settings import settings
+
+from ..core.logger import AppLogger
+from ..core.uploads import SpooledUpload, UploadTooLarge, read_upload
+from ..middleware.trace_id import get_trace_id
+from .logger import get_app_logger
+
+
+async def get_avatar_upload(
+    request: Request,
+    logger: AppLogger = Depends(lambda: get_app_logger("uploads.avatar")),
+) -> AsyncIterator[SpooledUpload]:
+    """
+    Streams the `file` part of the request into a spool, rejecting it with 413
+    once it is over AVATAR_MAX_BYTES. Routes must declare it after their auth
+    dependency and before their connection dependency, so unauthenticated
+    uploads aren't read and no connection is held while the body arrives.
+    """
+    trace_id = get_trace_id()
+    try:
+        upload = await read_upload(
+            request.headers,
+            request.stream(),
+            "file",
+            max_bytes=settings.AVATAR_MAX_BYTES,
+            spool_bytes=settings.AVATAR_SPOOL_BYTES,
+        )
+    except UploadTooLarge as e:
+        logger.warning({"trace_id": trace_id, "message": str(e)})
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail={"message": str(e), "trace_id": trace_id},
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"message": str(e), "trace_id": trace_id},
+        )
+    try:
+        yield upload
+    finally:
+        upload.close()
@@ -1,13 +1,67 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from starlette.concurrency import run_in_threadpool
 
+from app.core import migrations, passwords
+from app.core.metrics import metrics
+from app.core.responses import FastJSONResponse
+from app.database import get_db_connection_context
+from app.dependencies.logger import get_app_logger
+from app.middleware.compression import CompressionMiddleware
 from app.middleware.logging import LoggingMiddleware
 from app.middleware.trace_id import TraceIdMiddleware
+from app.settings import settings
+from app.users import memory_storage, services
 from app.users.routers import auth_router, users_router
 
-app = FastAPI()
+
+def check_migrations():
+    """
+    One version query per worker boot; with MIGRATIONS_ON_STARTUP=apply the
+    pending migrations are applied first, under the runner's advisory lock.
+    """
+    with get_db_connection_context() as conn:
+        if settings.MIGRATIONS_ON_STARTUP == "apply":
+            migrations.migrate(conn)
+        migrations.check(conn)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Times the hash on this CPU when PASSWORD_HASH_TARGET_MS is set
+    await run_in_threadpool(
+        passwords.configure_from_settings,
+        services.pwd_context,
+        get_app_logger("startup.passwords"),
+    )
+    if (
+        settings.MIGRATIONS_ON_STARTUP != "off"
+        and settings.USERS_STORAGE_BACKEND == "postgres"
+    ):
+        await run_in_threadpool(check_migrations)
+    yield
+
+
+app = FastAPI(default_response_class=FastJSONResponse, lifespan=lifespan)
+
+if settings.USERS_STORAGE_BACKEND == "memory":
+    # Every database dependency hands out a connection to the in-memory store
+    app.dependency_overrides.update(memory_storage.get_dependency_overrides())
 
 app.add_middleware(LoggingMiddleware)
 app.add_middleware(TraceIdMiddleware)
+# Outermost, so the logging middleware sees uncompressed bodies
+app.add_middleware(
+    CompressionMiddleware,
+    encodings=[
+        encoding.strip()
+        for encoding in settings.COMPRESSION_ENCODINGS.split(",")
+        if encoding.strip()
+    ],
+    minimum_size=settings.COMPRESSION_MIN_BYTES,
+    logger=get_app_logger("middleware.compression"),
+)
 
 app.include_router(users_router)
 app.include_router(auth_router)
@@ -16,3 +70,8 @@ app.include_router(auth_router)
 @app.get("/")
 def read_root():
     return {"Hello": "World"}
+
+
+@app.get("/metrics")
+def read_metrics():
+    return metrics.snapshot()
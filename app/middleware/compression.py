@@ -0,0 +1,253 @@
+"""
+Response compression negotiated from Accept-Encoding.
+
+zstd and br are used when the optional zstandard and brotli packages are
+installed (the `compression` extra); gzip always is. A configured encoding
+that isn't available is logged once, when the middleware is built. The first of COMPRESSION_ENCODINGS that the client
+accepts (with the highest q-value) wins.
+
+The response streams through: each body chunk is compressed and sent as it
+arrives, and only the response start is held until the first chunk shows
+whether the body is worth compressing. Bodies under COMPRESSION_MIN_BYTES,
+content types that are not text (images, archives, octet streams are already
+compressed or not worth it) and responses with a Content-Encoding pass
+through untouched.
+
+CPU per response is bounded by fast compression levels (about 3x on JSON),
+and chunks above OFFLOAD_BYTES are compressed in a worker thread so a large
+listing doesn't stall the event loop for other requests.
+
+Metrics (labelled with the encoding):
+    http_compressed_responses_total
+    http_compression_bytes_total{direction="in"|"out"}
+"""
+
+import zlib
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from anyio import to_thread
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.logger import AppLogger
+from app.core.metrics import metrics
+
+# Fast levels: most of the size reduction for a fraction of the CPU
+GZIP_LEVEL = 5
+ZSTD_LEVEL = 3
+BROTLI_QUALITY = 4
+
+OFFLOAD_BYTES = 64 * 1024
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "application/problem+json",
+)
+
+# compress(chunk) -> bytes, finish() -> bytes
+Compressor = Tuple[Callable[[bytes], bytes], Callable[[], bytes]]
+
+
+def _gzip() -> Compressor:
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress, compressor.flush
+
+
+def _zstd() -> Compressor:
+    import zstandard
+
+    compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    return compressor.compress, compressor.flush
+
+
+def _brotli() -> Compressor:
+    import brotli
+
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    return compressor.process, compressor.finish
+
+
+def _installed(module: str) -> bool:
+    try:
+        __import__(module)
+    except ImportError:
+        return False
+    return True
+
+
+COMPRESSORS = {
+    "zstd": (_zstd, "zstandard"),
+    "br": (_brotli, "brotli"),
+    "gzip": (_gzip, None),
+}
+
+
+def available_encodings(preferred: Iterable[str]) -> List[str]:
+    """
+    The `preferred` encodings whose compressor is installed, in order.
+    """
+    return [
+        encoding
+        for encoding in preferred
+        if encoding in COMPRESSORS
+        and (COMPRESSORS[encoding][1] is None or _installed(COMPRESSORS[encoding][1]))
+    ]
+
+
+def negotiate(accept_encoding: str, encodings: List[str]) -> Optional[str]:
+    """
+    Picks the encoding the client accepts with the highest q-value, ties
+    going to the earlier of `encodings`. None if it accepts none of them.
+    """
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    best, best_quality = None, 0.0
+    for encoding in encodings:
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def is_compressible(headers: Headers) -> bool:
+    content_type = headers.get("content-type", "").lower()
+    return content_type.startswith(COMPRESSIBLE_TYPES) or "+json" in content_type
+
+
+class CompressionMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        encodings: List[str],
+        minimum_size: int,
+        logger: Optional[AppLogger] = None,
+    ):
+        self.app = app
+        self.encodings = available_encodings(encodings)
+        self.minimum_size = minimum_size
+        if logger:
+            for encoding in encodings:
+                if encoding in self.encodings:
+                    continue
+                package = COMPRESSORS.get(encoding, (None, None))[1]
+                logger.warning(
+                    {
+                        "message": "Compression encoding unavailable, skipped",
+                        "encoding": encoding,
+                        "reason": (
+                            f"{package} is not installed"
+                            if package
+                            else "unknown encoding"
+                        ),
+                    }
+                )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] == "HEAD" or not self.encodings:
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(
+            Headers(scope=scope).get("accept-encoding", ""), self.encodings
+        )
+        responder = _CompressingSender(send, encoding, self.minimum_size)
+        await self.app(scope, receive, responder)
+
+
+class _CompressingSender:
+    """
+    Wraps `send` for one response: holds the response start until the first
+    body chunk, then either passes everything through or compresses.
+    """
+
+    def __init__(self, send: Send, encoding: Optional[str], minimum_size: int):
+        self.send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start: Optional[Message] = None
+        self.decided = False
+        self.compressor: Optional[Compressor] = None
+
+    async def __call__(self, message: Message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+        if message["type"] != "http.response.body" or self.decided:
+            if self.compressor is not None and message["type"] == "http.response.body":
+                await self._send_compressed(message)
+            else:
+                await self.send(message)
+            return
+
+        self.decided = True
+        self.start["headers"] = list(self.start.get("headers", []))
+        headers = MutableHeaders(scope=self.start)
+        if self._should_compress(headers, message):
+            self.compressor = COMPRESSORS[self.encoding][0]()
+            headers["Content-Encoding"] = self.encoding
+            del headers["Content-Length"]
+            # The compressed bytes differ, a strong validator must not match
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                headers["ETag"] = f"W/{etag}"
+            metrics.inc("http_compressed_responses_total", encoding=self.encoding)
+            await self.send(self.start)
+            await self._send_compressed(message)
+        else:
+            await self.send(self.start)
+            await self.send(message)
+
+    def _should_compress(self, headers: MutableHeaders, message: Message) -> bool:
+        if self.start["status"] in (204, 304) or "content-encoding" in headers:
+            return False
+        if not is_compressible(headers):
+            return False
+        # Caches must keep one copy per encoding from here on
+        headers.add_vary_header("Accept-Encoding")
+        if self.encoding is None:
+            return False
+        body = message.get("body", b"")
+        if not message.get("more_body", False):
+            return len(body) >= self.minimum_size
+        length = headers.get("content-length")
+        return length is None or int(length) >= self.minimum_size
+
+    async def _send_compressed(self, message: Message):
+        compress, finish = self.compressor
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if len(body) >= OFFLOAD_BYTES:
+            output = await to_thread.run_sync(compress, body)
+        else:
+            output = compress(body) if body else b""
+        if not more_body:
+            output += finish()
+        metrics.inc(
+            "http_compression_bytes_total",
+            len(body),
+            encoding=self.encoding,
+            direction="in",
+        )
+        metrics.inc(
+            "http_compression_bytes_total",
+            len(output),
+            encoding=self.encoding,
+            direction="out",
+        )
+        if output or not more_body:
+            await self.send(
+                {"type": "http.response.body", "body": output, "more_body": more_body}
+            )
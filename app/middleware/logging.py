@@ -2,11 +2,15 @@ import json
 import logging
 import sys
 import time
-from typing import Any, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
 
 from fastapi import Request
 from starlette.middleware.base import BaseHTTPMiddleware
 
+from app.settings import settings
+
+from ..core.redaction import SENSITIVE_KEYS
 from .trace_id import get_trace_id
 
 # Configure logger to output JSON
@@ -22,15 +26,6 @@ logger.setLevel(logging.INFO)
 logger.propagate = False
 
 
-SENSITIVE_KEYS = [
-    "password",
-    "email",
-    "current_password",
-    "new_password",
-    "confirm_password",
-]
-
-
 def sanitize_body(request: Request, body: bytes) -> Dict[str, Any]:
     """
     Sanitizes sensitive keys from a request or response body.
@@ -42,16 +37,16 @@ def sanitize_body(request: Request, body: bytes) -> Dict[str, Any]:
     Returns:
         Dictionary with sanitized values
     """
-    if not body:
-        return {}
-
     # Check content type
     content_type = request.headers.get("content-type", "")
 
-    # Handle multipart form data
+    # Handle multipart form data (whose body the middleware doesn't read)
     if "multipart/form-data" in content_type:
         return {"detail": "Multipart form data, not logged"}
 
+    if not body:
+        return {}
+
     # Handle application/x-www-form-urlencoded
     if "application/x-www-form-urlencoded" in content_type:
         try:
@@ -88,23 +83,87 @@ def sanitize_body(request: Request, body: bytes) -> Dict[str, Any]:
         return {"detail": "Non-JSON body, not logged"}
 
 
+def _content_length(request: Request, body: bytes) -> int:
+    declared = request.headers.get("content-length", "")
+    return int(declared) if declared.isdigit() else len(body)
+
+
+class TrafficCapture:
+    """
+    Appends sanitized request shapes as JSON lines, for replay with
+    benchmarks/replay.py. Credentials are never written: bodies go through
+    sanitize_body() and only the presence of an Authorization header is kept.
+    Lines are written by a single thread, so the middleware never waits on
+    the disk.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="traffic-capture"
+        )
+        self._file = None
+
+    def record(self, entry: Dict[str, Any]):
+        self._executor.submit(self._write, json.dumps(entry) + "\n")
+
+    def _write(self, line: str):
+        try:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+            self._file.write(line)
+        except OSError as e:
+            logger.error(
+                json.dumps({"context": "Traffic capture write failed", "error": str(e)})
+            )
+
+    def wait(self):
+        """
+        Blocks until the lines recorded so far are written. Used for testing.
+        """
+        self._executor.submit(lambda: None).result()
+
+
+_traffic_capture: Optional[TrafficCapture] = None
+
+
+def get_traffic_capture() -> Optional[TrafficCapture]:
+    """
+    Returns the capture sink when TRAFFIC_CAPTURE_PATH is set (opt-in).
+    """
+    global _traffic_capture
+    path = settings.TRAFFIC_CAPTURE_PATH
+    if not path:
+        return None
+    if _traffic_capture is None or _traffic_capture.path != path:
+        _traffic_capture = TrafficCapture(path)
+    return _traffic_capture
+
+
 class LoggingMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
         start_time = time.time()
+        capture = get_traffic_capture()
 
-        request_body_bytes = await request.body()
+        if "multipart/form-data" in request.headers.get("content-type", ""):
+            # Uploads are never logged: leave their body to stream to the
+            # endpoint instead of holding all of it in memory here
+            request_body_bytes = b""
+            response = await call_next(request)
+        else:
+            request_body_bytes = await request.body()
 
-        # To allow the request body to be read again by the endpoint
-        async def receive():
-            return {
-                "type": "http.request",
-                "body": request_body_bytes,
-                "more_body": False,
-            }
+            # To allow the request body to be read again by the endpoint
+            async def receive():
+                return {
+                    "type": "http.request",
+                    "body": request_body_bytes,
+                    "more_body": False,
+                }
 
-        modified_request = Request(request.scope, receive)
+            modified_request = Request(request.scope, receive)
 
-        response = await call_next(modified_request)
+            response = await call_next(modified_request)
 
         process_time = time.time() - start_time
 
@@ -123,4 +182,20 @@ class LoggingMiddleware(BaseHTTPMiddleware):
 
         logger.info(json.dumps(log_dict))
 
+        if capture is not None:
+            capture.record(
+                {
+                    "timestamp": start_time,
+                    "method": request.method,
+                    "path": request.url.path,
+                    "query": request.url.query,
+                    "content_type": request.headers.get("content-type", ""),
+                    "content_length": _content_length(request, request_body_bytes),
+                    "authenticated": "authorization" in request.headers,
+                    "body": log_dict["request"]["body"],
+                    "status_code": response.status_code,
+                    "duration_seconds": round(process_time, 6),
+                }
+            )
+
         return response
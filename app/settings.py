@@ -1,3 +1,5 @@
+from typing import Literal, Optional
+
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -21,6 +23,82 @@ class Settings(BaseSettings):
         R2_BUCKET_NAME (str): Cloudflare R2 bucket name.
         R2_PUBLIC_BASE_URL (str): Cloudflare R2 public base URL.
         R2_REGION (str): Cloudflare R2 region.
+        R2_MAX_CONCURRENCY (int): R2 requests each worker has in flight at most;
+            the others wait for a slot. Each slot holds a pooled connection.
+        R2_TIMEOUT_SECONDS (float): Time limit of an R2 operation, waiting for a
+            slot and retries included.
+        R2_CONNECT_TIMEOUT_SECONDS (float): Time limit to connect to R2, per attempt.
+        R2_READ_TIMEOUT_SECONDS (float): Time limit of each read or write of an
+            R2 attempt.
+        R2_MAX_RETRIES (int): Retries of a failed R2 attempt (timeout, transport
+            error, 429 or 5xx).
+        R2_RETRY_BUDGET_RATIO (float): Retries allowed per R2 operation, over the
+            last 10 seconds.
+        R2_RETRY_BUDGET_MIN_PER_SECOND (float): Retries allowed per second on
+            top of the ratio.
+        R2_BREAKER_FAILURE_THRESHOLD (int): Consecutive failed R2 attempts that
+            open the circuit breaker.
+        R2_BREAKER_OPEN_SECONDS (float): How long the open breaker rejects R2
+            operations before letting a probe through.
+        DB_PREPARED_STATEMENTS (bool): Use server-side prepared statements for hot
+            queries. Disable when running behind a transaction-pooling pgbouncer.
+        DATABASE_REPLICA_URL (Optional[str]): Read replica URL for read-only queries.
+        REPLICA_STICKY_SECONDS (float): How long a user's reads stay on the primary
+            after they write, through a signed cookie (rounded up to seconds).
+        USERS_BATCH_MAX_SIZE (int): Maximum number of ids and codes per batch lookup.
+        TRAFFIC_CAPTURE_PATH (Optional[str]): JSONL file to capture sanitized
+            request shapes to. Capture is off when unset.
+        USERS_STORAGE_BACKEND (str): "postgres", or "memory" to keep users in
+            process memory (profiling without a database).
+        MIGRATIONS_ON_STARTUP (str): "check" refuses to start with pending
+            migrations, "apply" runs them, "off" skips the check.
+        USERS_TABLE_LAYOUT (str): "heap" (single table), or "partitioned" to hash
+            partition users on id. Pick it before the first migration.
+        USERS_IMPORT_BATCH_SIZE (int): Rows per staging batch in the bulk import.
+        USERS_IMPORT_WORKERS (int): Password hashing processes for the bulk
+            import; 0 uses one per CPU.
+        LOGIN_RATE_LIMIT_BACKEND (str): Where login attempt counters live:
+            "memory" (per worker), "postgres" (shared by all workers) or "off".
+        LOGIN_RATE_LIMIT_WINDOW_SECONDS (float): Sliding window for login limits.
+        LOGIN_RATE_LIMIT_PER_IP (int): Login attempts allowed per client IP
+            per window.
+        LOGIN_RATE_LIMIT_PER_EMAIL (int): Login attempts allowed per submitted
+            email per window.
+        PASSWORD_HASH_SCHEME (str): Scheme for new password hashes:
+            "pbkdf2_sha256", "scrypt" or "argon2" (needs argon2-cffi).
+        PASSWORD_HASH_TARGET_MS (float): Hashing time to calibrate the cost to
+            at startup; 0 keeps passlib's default cost.
+        REFRESH_TOKEN_REVOCATION_SYNC_SECONDS (float): How often the in-memory
+            filter of revoked token families reloads from the database.
+        REFRESH_TOKEN_FILTER_CAPACITY (int): Revoked families the filter is
+            sized for before its false positive rate degrades.
+        REFRESH_TOKEN_FILTER_ERROR_RATE (float): Share of unrevoked families the
+            filter sends to the database to confirm.
+        REFRESH_TOKEN_PURGE_SECONDS (float): How often each worker deletes a
+            batch of expired refresh tokens, on a login or refresh.
+        REFRESH_TOKEN_PURGE_BATCH_SIZE (int): Expired refresh tokens deleted per
+            batch; a full batch makes the next login or refresh purge again.
+        ACCESS_TOKEN_CACHE_SIZE (int): Verified access tokens each worker keeps
+            the claims of, so their signature is checked once; 0 disables it.
+        JWT_KEYS_DIR (Optional[str]): Directory of signing keys named <kid>.pem
+            (EdDSA or ES256) or <kid>.secret (HMAC). Unset signs with SECRET_KEY.
+        JWT_KEYS_RELOAD_SECONDS (float): How often the key directory is rescanned.
+        JWT_KEY_PUBLISH_SECONDS (float): How long a new key is only published
+            before it starts signing. Keep it above JWKS_MAX_AGE_SECONDS plus
+            JWT_KEYS_RELOAD_SECONDS.
+        JWT_ACCEPT_LEGACY_TOKENS (bool): Whether tokens without a kid still
+            verify against SECRET_KEY. Turn off once the keys in JWT_KEYS_DIR
+            sign and the last legacy refresh token has expired.
+        JWKS_MAX_AGE_SECONDS (int): How long clients may cache the JWKS.
+        COMPRESSION_ENCODINGS (str): Comma-separated response encodings in order
+            of preference (zstd, br, gzip); empty disables compression. zstd and
+            br need the compression extra (zstandard and brotli).
+        COMPRESSION_MIN_BYTES (int): Response bodies smaller than this are sent
+            uncompressed.
+        AVATAR_MAX_BYTES (int): Largest avatar upload; bigger ones get a 413 as
+            soon as their bytes pass it.
+        AVATAR_SPOOL_BYTES (int): Avatar uploads up to this size are kept in
+            memory, larger ones are spooled to a temporary file.
     """
 
     DATABASE_URL: str = Field(..., validation_alias="DATABASE_URL")
@@ -40,6 +118,102 @@ class Settings(BaseSettings):
     R2_BUCKET_NAME: str = Field(..., validation_alias="R2_BUCKET_NAME")
     R2_PUBLIC_BASE_URL: str = Field(..., validation_alias="R2_PUBLIC_BASE_URL")
     R2_REGION: str = Field(..., validation_alias="R2_REGION")
+    R2_MAX_CONCURRENCY: int = Field(16, validation_alias="R2_MAX_CONCURRENCY")
+    R2_TIMEOUT_SECONDS: float = Field(10.0, validation_alias="R2_TIMEOUT_SECONDS")
+    R2_CONNECT_TIMEOUT_SECONDS: float = Field(
+        1.0, validation_alias="R2_CONNECT_TIMEOUT_SECONDS"
+    )
+    R2_READ_TIMEOUT_SECONDS: float = Field(
+        3.0, validation_alias="R2_READ_TIMEOUT_SECONDS"
+    )
+    R2_MAX_RETRIES: int = Field(2, validation_alias="R2_MAX_RETRIES")
+    R2_RETRY_BUDGET_RATIO: float = Field(0.1, validation_alias="R2_RETRY_BUDGET_RATIO")
+    R2_RETRY_BUDGET_MIN_PER_SECOND: float = Field(
+        1.0, validation_alias="R2_RETRY_BUDGET_MIN_PER_SECOND"
+    )
+    R2_BREAKER_FAILURE_THRESHOLD: int = Field(
+        5, validation_alias="R2_BREAKER_FAILURE_THRESHOLD"
+    )
+    R2_BREAKER_OPEN_SECONDS: float = Field(
+        15.0, validation_alias="R2_BREAKER_OPEN_SECONDS"
+    )
+    DB_PREPARED_STATEMENTS: bool = Field(
+        True, validation_alias="DB_PREPARED_STATEMENTS"
+    )
+    DATABASE_REPLICA_URL: Optional[str] = Field(
+        None, validation_alias="DATABASE_REPLICA_URL"
+    )
+    REPLICA_STICKY_SECONDS: float = Field(
+        5.0, validation_alias="REPLICA_STICKY_SECONDS"
+    )
+    USERS_BATCH_MAX_SIZE: int = Field(100, validation_alias="USERS_BATCH_MAX_SIZE")
+    TRAFFIC_CAPTURE_PATH: Optional[str] = Field(
+        None, validation_alias="TRAFFIC_CAPTURE_PATH"
+    )
+    USERS_STORAGE_BACKEND: Literal["postgres", "memory"] = Field(
+        "postgres", validation_alias="USERS_STORAGE_BACKEND"
+    )
+    MIGRATIONS_ON_STARTUP: Literal["check", "apply", "off"] = Field(
+        "check", validation_alias="MIGRATIONS_ON_STARTUP"
+    )
+    USERS_TABLE_LAYOUT: Literal["heap", "partitioned"] = Field(
+        "heap", validation_alias="USERS_TABLE_LAYOUT"
+    )
+    USERS_IMPORT_BATCH_SIZE: int = Field(
+        1000, validation_alias="USERS_IMPORT_BATCH_SIZE"
+    )
+    USERS_IMPORT_WORKERS: int = Field(0, validation_alias="USERS_IMPORT_WORKERS")
+    LOGIN_RATE_LIMIT_BACKEND: Literal["memory", "postgres", "off"] = Field(
+        "memory", validation_alias="LOGIN_RATE_LIMIT_BACKEND"
+    )
+    LOGIN_RATE_LIMIT_WINDOW_SECONDS: float = Field(
+        60.0, validation_alias="LOGIN_RATE_LIMIT_WINDOW_SECONDS"
+    )
+    LOGIN_RATE_LIMIT_PER_IP: int = Field(20, validation_alias="LOGIN_RATE_LIMIT_PER_IP")
+    LOGIN_RATE_LIMIT_PER_EMAIL: int = Field(
+        5, validation_alias="LOGIN_RATE_LIMIT_PER_EMAIL"
+    )
+    PASSWORD_HASH_SCHEME: Literal["pbkdf2_sha256", "scrypt", "argon2"] = Field(
+        "pbkdf2_sha256", validation_alias="PASSWORD_HASH_SCHEME"
+    )
+    PASSWORD_HASH_TARGET_MS: float = Field(
+        0.0, validation_alias="PASSWORD_HASH_TARGET_MS"
+    )
+    REFRESH_TOKEN_REVOCATION_SYNC_SECONDS: float = Field(
+        30.0, validation_alias="REFRESH_TOKEN_REVOCATION_SYNC_SECONDS"
+    )
+    REFRESH_TOKEN_FILTER_CAPACITY: int = Field(
+        100000, validation_alias="REFRESH_TOKEN_FILTER_CAPACITY"
+    )
+    REFRESH_TOKEN_FILTER_ERROR_RATE: float = Field(
+        0.001, validation_alias="REFRESH_TOKEN_FILTER_ERROR_RATE"
+    )
+    REFRESH_TOKEN_PURGE_SECONDS: float = Field(
+        300.0, validation_alias="REFRESH_TOKEN_PURGE_SECONDS"
+    )
+    REFRESH_TOKEN_PURGE_BATCH_SIZE: int = Field(
+        1000, validation_alias="REFRESH_TOKEN_PURGE_BATCH_SIZE"
+    )
+    ACCESS_TOKEN_CACHE_SIZE: int = Field(
+        10000, validation_alias="ACCESS_TOKEN_CACHE_SIZE"
+    )
+    JWT_KEYS_DIR: Optional[str] = Field(None, validation_alias="JWT_KEYS_DIR")
+    JWT_KEYS_RELOAD_SECONDS: float = Field(
+        30.0, validation_alias="JWT_KEYS_RELOAD_SECONDS"
+    )
+    JWT_KEY_PUBLISH_SECONDS: float = Field(
+        600.0, validation_alias="JWT_KEY_PUBLISH_SECONDS"
+    )
+    JWT_ACCEPT_LEGACY_TOKENS: bool = Field(
+        True, validation_alias="JWT_ACCEPT_LEGACY_TOKENS"
+    )
+    JWKS_MAX_AGE_SECONDS: int = Field(300, validation_alias="JWKS_MAX_AGE_SECONDS")
+    COMPRESSION_ENCODINGS: str = Field(
+        "zstd,br,gzip", validation_alias="COMPRESSION_ENCODINGS"
+    )
+    COMPRESSION_MIN_BYTES: int = Field(1024, validation_alias="COMPRESSION_MIN_BYTES")
+    AVATAR_MAX_BYTES: int = Field(5 * 1024 * 1024, validation_alias="AVATAR_MAX_BYTES")
+    AVATAR_SPOOL_BYTES: int = Field(256 * 1024, validation_alias="AVATAR_SPOOL_BYTES")
 
     model_config = SettingsConfigDict(
         env_file=".env", env_file_encoding="utf-8", extra="ignore"
@@ -0,0 +1,165 @@
+"""
+Storage backends for users.
+
+Both `app.users.storage` (Postgres) and `app.users.memory_storage` implement
+the UserStorage interface as plain modules; USERS_STORAGE_BACKEND picks the
+one services and the loader use.
+"""
+
+from datetime import datetime
+from typing import Any, ContextManager, Dict, List, Optional, Protocol, Tuple
+from uuid import UUID
+
+from app.settings import settings
+
+from ..core.logger import AppLogger
+from ..database import get_db_connection_context
+from . import storage
+from .models import UserCreate, UserRow
+
+STORAGE_BACKENDS = ("postgres", "memory")
+
+
+class UserStorage(Protocol):
+    """
+    The operations services need from a users store. `conn` is whatever the
+    backend's connection dependency provides and must support transaction().
+    """
+
+    def get_users(
+        self, conn: Any, trace_id: str, logger: AppLogger
+    ) -> List[UserRow]: ...
+
+    def get_public_users(
+        self, conn: Any, trace_id: str, logger: AppLogger
+    ) -> List[Dict[str, Any]]: ...
+
+    def get_public_users_version(
+        self, conn: Any, trace_id: str, logger: AppLogger
+    ) -> Tuple[int, Any]: ...
+
+    def get_user_by_email(
+        self, conn: Any, email: str, trace_id: str, logger: AppLogger
+    ) -> Optional[UserRow]: ...
+
+    def get_user_by_email_ci(
+        self, conn: Any, email: str, trace_id: str, logger: AppLogger
+    ) -> Optional[UserRow]: ...
+
+    def get_user_by_id(
+        self, conn: Any, user_id: int, trace_id: str, logger: AppLogger
+    ) -> Optional[UserRow]: ...
+
+    def get_users_by_ids_or_codes(
+        self,
+        conn: Any,
+        ids: List[int],
+        codes: List[str],
+        trace_id: str,
+        logger: AppLogger,
+    ) -> List[UserRow]: ...
+
+    def create_user(
+        self,
+        conn: Any,
+        user: UserCreate,
+        hashed_password: str,
+        trace_id: str,
+        logger: AppLogger,
+    ) -> int: ...
+
+    def update_password(
+        self,
+        conn: Any,
+        user_id: int,
+        hashed_password: str,
+        trace_id: str,
+        logger: AppLogger,
+    ) -> bool: ...
+
+    def replace_password_hash(
+        self,
+        conn: Any,
+        user_id: int,
+        old_hash: str,
+        new_hash: str,
+        trace_id: str,
+        logger: AppLogger,
+    ) -> bool: ...
+
+    def lock_user(
+        self, conn: Any, user_id: int, trace_id: str, logger: AppLogger
+    ) -> Optional[UserRow]: ...
+
+    def insert_refresh_token(
+        self,
+        conn: Any,
+        jti: UUID,
+        family_id: UUID,
+        user_id: int,
+        expires_at: datetime,
+        trace_id: str,
+        logger: AppLogger,
+    ): ...
+
+    def rotate_refresh_token(
+        self,
+        conn: Any,
+        jti: UUID,
+        new_jti: UUID,
+        expires_at: datetime,
+        trace_id: str,
+        logger: AppLogger,
+    ) -> Optional[UserRow]: ...
+
+    def get_refresh_token(
+        self, conn: Any, jti: UUID, trace_id: str, logger: AppLogger
+    ) -> Optional[Dict[str, Any]]: ...
+
+    def revoke_token_family(
+        self, conn: Any, family_id: UUID, trace_id: str, logger: AppLogger
+    ) -> int: ...
+
+    def is_token_family_revoked(
+        self, conn: Any, family_id: UUID, trace_id: str, logger: AppLogger
+    ) -> bool: ...
+
+    def purge_expired_refresh_tokens(
+        self, conn: Any, limit: int, trace_id: str, logger: AppLogger
+    ) -> int: ...
+
+    def get_revoked_token_families(
+        self, conn: Any, since: Optional[datetime], trace_id: str, logger: AppLogger
+    ) -> List[Tuple[UUID, datetime]]: ...
+
+    def update_avatar_url(
+        self,
+        conn: Any,
+        user_id: int,
+        avatar_url: str,
+        trace_id: str,
+        logger: AppLogger,
+    ) -> bool: ...
+
+
+def get_user_storage() -> UserStorage:
+    """
+    Returns the storage module selected by USERS_STORAGE_BACKEND.
+    """
+    if settings.USERS_STORAGE_BACKEND == "memory":
+        from . import memory_storage
+
+        return memory_storage
+    return storage
+
+
+def get_connection_context() -> ContextManager[Any]:
+    """
+    A connection to the selected backend, committed on exit, for work done
+    outside a request (e.g. background password rehashes).
+    """
+    if settings.USERS_STORAGE_BACKEND == "memory":
+        from . import memory_storage
+
+        return memory_storage.connect()
+    return get_db_connection_context()
@@ -0,0 +1,263 @@
+"""
+Bulk user import, for onboarding a partner's users in one go.
+
+Streams users from a CSV file (header row with username, email and password)
+or an NDJSON file (one object per line with the same keys) and loads them in
+batches. Passwords are hashed across a process pool a few batches ahead of
+the database. Each batch is copied into a staging table, where rows that
+clash with existing users or with earlier rows of the file are flagged and
+codes are assigned in a handful of set-based statements, then the accepted
+rows are inserted at once (see storage.import_users).
+
+Writes one NDJSON line per input row to stdout: {"line", "status", "id",
+"code", "error"}, with status "created" or "rejected"; a summary goes to
+stderr.
+
+Usage:
+    uv run python -m app.users.bulk_import partner.csv > report.ndjson
+    uv run python -m app.users.bulk_import partner.ndjson --format ndjson
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import IO, Any, Dict, Iterable, Iterator, List, Tuple, Union
+
+from psycopg import Connection
+from psycopg.errors import UniqueViolation
+from pydantic import ValidationError
+
+from app.settings import settings
+
+from ..core.logger import AppLogger
+from . import storage as user_storage
+from .models import UserCreate
+from .services import pwd_context
+
+FORMATS = ("csv", "ndjson")
+IMPORT_FIELDS = ("username", "email", "password")
+
+# Line number and either the parsed user or why the record was rejected
+Record = Tuple[int, Union[UserCreate, str]]
+
+
+def read_records(source: IO[str], fmt: str) -> Iterator[Record]:
+    """
+    Parses `source` lazily; line numbers are 1-based and count the CSV header.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(source)
+        items = ((reader.line_num, record) for record in reader)
+    else:
+        items = enumerate(source, start=1)
+
+    for line, item in items:
+        if fmt == "ndjson":
+            if not item.strip():
+                continue
+            try:
+                item = json.loads(item)
+            except json.JSONDecodeError as e:
+                yield line, f"Invalid JSON: {e.msg}"
+                continue
+            if not isinstance(item, dict):
+                yield line, "Invalid JSON: expected an object"
+                continue
+        try:
+            yield (
+                line,
+                UserCreate(**{field: item.get(field) for field in IMPORT_FIELDS}),
+            )
+        except ValidationError as e:
+            yield (
+                line,
+                "; ".join(
+                    f"{'.'.join(map(str, error['loc']))}: {error['msg']}"
+                    for error in e.errors()
+                ),
+            )
+
+
+def hash_passwords(passwords: List[str]) -> List[str]:
+    """
+    Runs in a pool worker; module level so it can be pickled.
+    """
+    return [pwd_context.hash(password) for password in passwords]
+
+
+def _configure_worker(scheme: str, cost: int):
+    pwd_context.configure(scheme, cost)
+
+
+def hash_executor(workers: int, mp_context=None) -> ProcessPoolExecutor:
+    """
+    A process pool whose workers hash with the parent's scheme and cost. A
+    worker started with spawn or forkserver imports the module afresh, so it
+    would otherwise hash at the default cost rather than the calibrated one.
+    """
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=mp_context,
+        initializer=_configure_worker,
+        initargs=(pwd_context.scheme, pwd_context.cost),
+    )
+
+
+def _batches(
+    records: Iterable[Record], batch_size: int
+) -> Iterator[Tuple[List[Tuple[int, UserCreate]], List[Tuple[int, str]]]]:
+    valid, invalid = [], []
+    for line, record in records:
+        if isinstance(record, str):
+            invalid.append((line, record))
+        else:
+            valid.append((line, record))
+        if len(valid) >= batch_size:
+            yield valid, invalid
+            valid, invalid = [], []
+    if valid or invalid:
+        yield valid, invalid
+
+
+def hashed_batches(
+    records: Iterable[Record], executor: Executor, batch_size: int, lookahead: int
+) -> Iterator[Tuple[List[Tuple[int, UserCreate, str]], List[Tuple[int, str]]]]:
+    """
+    Yields batches of (line, user, hashed_password) plus the records rejected
+    while parsing them, keeping up to `lookahead` batches hashing in the pool
+    so the database never waits on the hashing of the next batch.
+    """
+    pending = deque()
+    for valid, invalid in _batches(records, batch_size):
+        future = executor.submit(hash_passwords, [user.password for _, user in valid])
+        pending.append((valid, invalid, future))
+        if len(pending) > lookahead:
+            yield _collect(*pending.popleft())
+    while pending:
+        yield _collect(*pending.popleft())
+
+
+def _collect(valid, invalid, future):
+    return [
+        (line, user, hashed) for (line, user), hashed in zip(valid, future.result())
+    ], invalid
+
+
+def import_users(
+    conn: Connection,
+    records: Iterable[Record],
+    trace_id: str,
+    logger: AppLogger,
+    batch_size: int = None,
+    workers: int = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Imports the records batch by batch, committing each batch, and yields a
+    report entry for every record.
+    """
+    batch_size = batch_size or settings.USERS_IMPORT_BATCH_SIZE
+    workers = workers or settings.USERS_IMPORT_WORKERS or os.cpu_count()
+    logger.info({"trace_id": trace_id, "batch_size": batch_size, "workers": workers})
+    with hash_executor(workers) as executor:
+        for rows, invalid in hashed_batches(records, executor, batch_size, workers):
+            for line, error in invalid:
+                yield _report(line, error=error)
+            if rows:
+                yield from _import_batch(conn, rows, trace_id, logger)
+
+
+def _import_batch(
+    conn: Connection,
+    rows: List[Tuple[int, UserCreate, str]],
+    trace_id: str,
+    logger: AppLogger,
+) -> Iterator[Dict[str, Any]]:
+    # The staging checks see committed users only, so a registration racing
+    # the batch can still trip a unique constraint. The batch is rolled back
+    # and retried; the retry flags the row that now clashes.
+    retry_count = 0
+    while True:
+        try:
+            result = user_storage.import_users(conn, rows, trace_id, logger)
+            conn.commit()
+            break
+        except UniqueViolation as e:
+            conn.rollback()
+            retry_count += 1
+            logger.warning(
+                {
+                    "trace_id": trace_id,
+                    "context": "Unique constraint violation, retrying batch...",
+                    "error": str(e),
+                }
+            )
+            if retry_count >= 5:
+                raise
+    for row in result:
+        yield _report(row["line"], row["id"], row["code"], row["error"])
+
+
+def _report(line: int, id: int = None, code: str = None, error: str = None) -> dict:
+    return {
+        "line": line,
+        "status": "rejected" if error else "created",
+        "id": id,
+        "code": code,
+        "error": error,
+    }
+
+
+def main():
+    import psycopg
+
+    from app.core.passwords import configure_from_settings
+    from app.database import get_connection_kwargs, get_pool_conninfo
+    from app.dependencies.logger import get_app_logger
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("path", help="CSV or NDJSON file, - for stdin")
+    parser.add_argument(
+        "--format", choices=FORMATS, help="Defaults to the file extension, or csv"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=settings.USERS_IMPORT_BATCH_SIZE
+    )
+    parser.add_argument("--workers", type=int, default=settings.USERS_IMPORT_WORKERS)
+    parser.add_argument("--database-url", default=settings.DATABASE_URL)
+    args = parser.parse_args()
+    fmt = args.format or (
+        "ndjson" if args.path.endswith((".ndjson", ".jsonl")) else "csv"
+    )
+
+    logger = get_app_logger("bulk_import")
+    # Before the pool starts, which hands the scheme and cost to its workers
+    configure_from_settings(pwd_context, logger)
+    counts = {"created": 0, "rejected": 0}
+    source = (
+        sys.stdin if args.path == "-" else open(args.path, newline="", encoding="utf-8")
+    )
+    with source, psycopg.connect(
+        get_pool_conninfo(args.database_url), **get_connection_kwargs()
+    ) as conn:
+        for entry in import_users(
+            conn,
+            read_records(source, fmt),
+            "bulk_import",
+            logger,
+            batch_size=args.batch_size,
+            workers=args.workers,
+        ):
+            counts[entry["status"]] += 1
+            print(json.dumps(entry))
+    print(
+        f"created: {counts['created']}, rejected: {counts['rejected']}",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Per-request dataloader for users.
+
+Code paths that need users by id or code within the same request register
+their keys first; the first load then resolves every pending key with a
+single `= ANY(%s)` query, and later loads are served from the cache. A
+connection is checked out for each such query only.
+
+Only POST /users/batch loads through it. The other single-user lookups don't
+fit: the current user is found by email, and concurrent lookups of the same
+email already share one query (see services.user_lookups). update-password and
+the avatar upload re-read the user on their write connection, so that they
+return the row they just wrote.
+"""
+
+import threading
+from typing import Callable, ContextManager, Iterable, List, Optional, Set
+
+from psycopg import Connection
+
+from ..core.logger import AppLogger
+from .backends import get_user_storage
+from .models import UserRow
+
+
+class UserLoader:
+    def __init__(
+        self,
+        get_connection: Callable[[], ContextManager[Connection]],
+        trace_id: str,
+        logger: AppLogger,
+    ):
+        self.get_connection = get_connection
+        self.trace_id = trace_id
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._pending_ids: Set[int] = set()
+        self._pending_codes: Set[str] = set()
+        self._by_id = {}
+        self._by_code = {}
+        self.dispatch_count = 0
+
+    def prime(self, ids: Iterable[int] = (), codes: Iterable[str] = ()):
+        """
+        Queues keys for the next dispatch without querying.
+        """
+        with self._lock:
+            self._pending_ids.update(i for i in ids if i not in self._by_id)
+            self._pending_codes.update(c for c in codes if c not in self._by_code)
+
+    def dispatch(self):
+        """
+        Resolves every pending key with one query.
+        """
+        with self._lock:
+            ids, self._pending_ids = self._pending_ids, set()
+            codes, self._pending_codes = self._pending_codes, set()
+            if not ids and not codes:
+                return
+            self.dispatch_count += 1
+            with self.get_connection() as conn:
+                users = get_user_storage().get_users_by_ids_or_codes(
+                    conn, sorted(ids), sorted(codes), self.trace_id, self.logger
+                )
+            # Keys that matched nothing are cached as misses too
+            self._by_id.update(dict.fromkeys(ids))
+            self._by_code.update(dict.fromkeys(codes))
+            for user in users:
+                self._by_id[user.id] = user
+                self._by_code[user.code] = user
+
+    def load_by_id(self, user_id: int) -> Optional[UserRow]:
+        if user_id not in self._by_id:
+            self.prime(ids=[user_id])
+            self.dispatch()
+        return self._by_id.get(user_id)
+
+    def load_by_code(self, code: str) -> Optional[UserRow]:
+        if code not in self._by_code:
+            self.prime(codes=[code])
+            self.dispatch()
+        return self._by_code.get(code)
+
+    def load_many(
+        self, ids: Iterable[int] = (), codes: Iterable[str] = ()
+    ) -> List[UserRow]:
+        """
+        Returns the users found for `ids` then `codes`, in request order and
+        without duplicates.
+        """
+        ids, codes = list(ids), list(codes)
+        self.prime(ids=ids, codes=codes)
+        self.dispatch()
+        users, seen = [], set()
+        for user in [self._by_id.get(i) for i in ids] + [
+            self._by_code.get(c) for c in codes
+        ]:
+            if user is not None and user.id not in seen:
+                seen.add(user.id)
+                users.append(user)
+        return users
@@ -0,0 +1,528 @@
+"""
+In-memory implementation of the users storage, for profiling services
+without a database and for tests that don't need Postgres.
+
+It mirrors the Postgres schema's behaviour where services depend on it:
+email, username and code are unique (violations raise psycopg's
+UniqueViolation, so the retry in create_user works unchanged), lock_user
+and updates take a row lock held until the connection commits or rolls back,
+and transaction() undoes its writes when the block raises. There is no MVCC:
+writes are visible to other connections as soon as they are made.
+"""
+
+import itertools
+import threading
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from psycopg.errors import UniqueViolation
+
+from ..core.logger import AppLogger
+from .models import UserCreate, UserRow
+
+UNIQUE_FIELDS = ("email", "username", "code")
+
+
+class MemoryDatabase:
+    """
+    Thread-safe users table with unique indexes and row locks.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._row_released = threading.Condition(self._lock)
+        self._ids = itertools.count(1)
+        self._rows: Dict[int, UserRow] = {}
+        self._unique: Dict[str, Dict[str, int]] = {field: {} for field in UNIQUE_FIELDS}
+        self._row_owners: Dict[int, "MemoryConnection"] = {}
+        # jti -> refresh token record, as in the refresh_tokens table
+        self._refresh_tokens: Dict[UUID, Dict[str, Any]] = {}
+
+    def reset(self):
+        with self._lock:
+            self._ids = itertools.count(1)
+            self._rows.clear()
+            self._refresh_tokens.clear()
+            for index in self._unique.values():
+                index.clear()
+            self._row_owners.clear()
+            self._row_released.notify_all()
+
+    def _index(self, row: UserRow):
+        for field in UNIQUE_FIELDS:
+            self._unique[field][getattr(row, field)] = row.id
+
+    def _unindex(self, row: UserRow):
+        for field in UNIQUE_FIELDS:
+            self._unique[field].pop(getattr(row, field), None)
+
+    def _acquire_row(self, conn: "MemoryConnection", user_id: int):
+        # Called with self._lock held. Like FOR UPDATE, waits for the owner's
+        # transaction to end and is a no-op for a row this connection holds.
+        while True:
+            owner = self._row_owners.get(user_id)
+            if owner is None or owner is conn:
+                break
+            self._row_released.wait()
+        if owner is None and user_id in self._rows:
+            self._row_owners[user_id] = conn
+            conn._undo.append(lambda: self._release_row(conn, user_id))
+
+    def _release_row(self, conn: "MemoryConnection", user_id: int):
+        if self._row_owners.get(user_id) is conn:
+            del self._row_owners[user_id]
+            self._row_released.notify_all()
+
+    def _release_rows(self, conn: "MemoryConnection"):
+        with self._lock:
+            for user_id in [i for i, c in self._row_owners.items() if c is conn]:
+                del self._row_owners[user_id]
+            self._row_released.notify_all()
+
+
+class MemoryConnection:
+    """
+    Stands in for a psycopg Connection: writes are recorded with an undo
+    action so rollback() and a failing transaction() block can revert them.
+    """
+
+    def __init__(self, db: MemoryDatabase):
+        self.db = db
+        self._undo: List[Callable[[], None]] = []
+        self._savepoints: List[int] = []
+
+    def _rollback_to(self, mark: int):
+        with self.db._lock:
+            while len(self._undo) > mark:
+                self._undo.pop()()
+
+    def commit(self):
+        self._undo.clear()
+        self.db._release_rows(self)
+
+    def rollback(self):
+        self._rollback_to(0)
+        self.db._release_rows(self)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Commits when the outermost block exits; a block that raises reverts
+        only its own writes and row locks, like a savepoint.
+        """
+        self._savepoints.append(len(self._undo))
+        try:
+            yield self
+        except BaseException:
+            self._rollback_to(self._savepoints.pop())
+            raise
+        else:
+            self._savepoints.pop()
+            if not self._savepoints:
+                self.commit()
+
+    def close(self):
+        self.rollback()
+
+    def __enter__(self) -> "MemoryConnection":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+
+# Process-wide store used by the connection dependencies
+database = MemoryDatabase()
+
+
+def connect(db: Optional[MemoryDatabase] = None) -> MemoryConnection:
+    return MemoryConnection(db or database)
+
+
+def get_dependency_overrides() -> Dict[Callable, Callable]:
+    """
+    Maps the database dependencies to in-memory connections.
+    """
+    from ..database import (
+        get_connection_provider,
+        get_read_connection_provider,
+    )
+
+    return {
+        # Committed on exit like a pooled connection, releasing its row locks
+        get_connection_provider: lambda: connect,
+        get_read_connection_provider: lambda: lambda: nullcontext(connect()),
+    }
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def get_users(
+    conn: MemoryConnection, trace_id: str, logger: AppLogger
+) -> List[UserRow]:
+    logger.info({"trace_id": trace_id})
+    with conn.db._lock:
+        return list(conn.db._rows.values())
+
+
+def get_public_users(
+    conn: MemoryConnection, trace_id: str, logger: AppLogger
+) -> List[Dict[str, Any]]:
+    logger.info({"trace_id": trace_id})
+    with conn.db._lock:
+        return [
+            {
+                "id": row.id,
+                "username": row.username,
+                "email": row.email,
+                "code": row.code,
+                "avatar_url": row.avatar_url,
+            }
+            # Insertion order is id order: ids are never reused
+            for row in conn.db._rows.values()
+        ]
+
+
+def get_public_users_version(
+    conn: MemoryConnection, trace_id: str, logger: AppLogger
+) -> Tuple[int, Any]:
+    logger.info({"trace_id": trace_id})
+    with conn.db._lock:
+        rows = list(conn.db._rows.values())
+    return len(rows), sum(row.updated_at.timestamp() for row in rows)
+
+
+def get_user_by_email(
+    conn: MemoryConnection,
+    email: str,
+    trace_id: str,
+    logger: AppLogger,
+) -> Optional[UserRow]:
+    logger.info({"trace_id": trace_id, "email": email})
+    with conn.db._lock:
+        user_id = conn.db._unique["email"].get(email)
+        return conn.db._rows.get(user_id)
+
+
+def get_user_by_email_ci(
+    conn: MemoryConnection,
+    email: str,
+    trace_id: str,
+    logger: AppLogger,
+) -> Optional[UserRow]:
+    logger.info({"trace_id": trace_id, "email": email})
+    with conn.db._lock:
+        user_id = conn.db._unique["email"].get(email)
+        if user_id is not None:
+            return conn.db._rows[user_id]
+        lowered = email.lower()
+        return next(
+            (row for row in conn.db._rows.values() if row.email.lower() == lowered),
+            None,
+        )
+
+
+def get_user_by_id(
+    conn: MemoryConnection,
+    user_id: int,
+    trace_id: str,
+    logger: AppLogger,
+) -> Optional[UserRow]:
+    logger.info({"trace_id": trace_id, "user_id": user_id})
+    with conn.db._lock:
+        return conn.db._rows.get(user_id)
+
+
+def get_users_by_ids_or_codes(
+    conn: MemoryConnection,
+    ids: List[int],
+    codes: List[str],
+    trace_id: str,
+    logger: AppLogger,
+) -> List[UserRow]:
+    logger.info({"trace_id": trace_id, "ids": len(ids), "codes": len(codes)})
+    with conn.db._lock:
+        found = {i for i in ids if i in conn.db._rows}
+        found.update(
+            conn.db._unique["code"][c] for c in codes if c in conn.db._unique["code"]
+        )
+        return [conn.db._rows[i] for i in sorted(found)]
+
+
+def create_user(
+    conn: MemoryConnection,
+    user: UserCreate,
+    hashed_password: str,
+    trace_id: str,
+    logger: AppLogger,
+) -> int:
+    logger.info({"trace_id": trace_id, "email": user.email})
+    db = conn.db
+    with db._lock:
+        for field in UNIQUE_FIELDS:
+            if getattr(user, field) in db._unique[field]:
+                raise UniqueViolation(
+                    f'duplicate key value violates unique constraint "users_{field}_key"'
+                )
+        row = UserRow(
+            id=next(db._ids),
+            username=user.username,
+            email=user.email,
+            code=user.code,
+            hashed_password=hashed_password,
+            avatar_url=None,
+            updated_at=_now(),
+        )
+        db._rows[row.id] = row
+        db._index(row)
+
+        def undo():
+            db._rows.pop(row.id, None)
+            db._unindex(row)
+
+        conn._undo.append(undo)
+        return row.id
+
+
+def _update(conn: MemoryConnection, user_id: int, **values) -> bool:
+    db = conn.db
+    with db._lock:
+        if user_id not in db._rows:
+            return False
+        db._acquire_row(conn, user_id)
+        # The row may have been replaced while waiting for its lock
+        previous = db._rows[user_id]
+        db._rows[user_id] = previous._replace(**values, updated_at=_now())
+        conn._undo.append(lambda: db._rows.__setitem__(user_id, previous))
+        return True
+
+
+def update_password(
+    conn: MemoryConnection,
+    user_id: int,
+    hashed_password: str,
+    trace_id: str,
+    logger: AppLogger,
+) -> bool:
+    logger.info({"trace_id": trace_id, "user_id": user_id})
+    if not _update(conn, user_id, hashed_password=hashed_password):
+        logger.warning(
+            {"trace_id": trace_id, "user_id": user_id, "message": "User not found"}
+        )
+        return False
+    return True
+
+
+def replace_password_hash(
+    conn: MemoryConnection,
+    user_id: int,
+    old_hash: str,
+    new_hash: str,
+    trace_id: str,
+    logger: AppLogger,
+) -> bool:
+    logger.info({"trace_id": trace_id, "user_id": user_id})
+    db = conn.db
+    with db._lock:
+        if user_id not in db._rows:
+            return False
+        db._acquire_row(conn, user_id)
+        # Compared once the row lock is held, like the UPDATE's WHERE clause
+        previous = db._rows[user_id]
+        if previous.hashed_password != old_hash:
+            return False
+        db._rows[user_id] = previous._replace(
+            hashed_password=new_hash, updated_at=_now()
+        )
+        conn._undo.append(lambda: db._rows.__setitem__(user_id, previous))
+        return True
+
+
+def lock_user(
+    conn: MemoryConnection,
+    user_id: int,
+    trace_id: str,
+    logger: AppLogger,
+) -> Optional[UserRow]:
+    logger.info({"trace_id": trace_id, "id": user_id})
+    with conn.db._lock:
+        if user_id not in conn.db._rows:
+            return None
+        conn.db._acquire_row(conn, user_id)
+        return conn.db._rows.get(user_id)
+
+
+def update_avatar_url(
+    conn: MemoryConnection,
+    user_id: int,
+    avatar_url: str,
+    trace_id: str,
+    logger: AppLogger,
+) -> bool:
+    logger.info({"trace_id": trace_id, "user_id": user_id, "avatar_url": avatar_url})
+    if not _update(conn, user_id, avatar_url=avatar_url):
+        logger.warning(
+            {"trace_id": trace_id, "user_id": user_id, "message": "User not found"}
+        )
+        return False
+    return True
+
+
+def _set_token(conn: MemoryConnection, jti: UUID, **values):
+    # Called with the database lock held
+    tokens = conn.db._refresh_tokens
+    previous = tokens.get(jti)
+    tokens[jti] = {**previous, **values} if previous else values
+
+    def undo():
+        if previous is None:
+            tokens.pop(jti, None)
+        else:
+            tokens[jti] = previous
+
+    conn._undo.append(undo)
+
+
+def insert_refresh_token(
+    conn: MemoryConnection,
+    jti: UUID,
+    family_id: UUID,
+    user_id: int,
+    expires_at: datetime,
+    trace_id: str,
+    logger: AppLogger,
+):
+    logger.info({"trace_id": trace_id, "user_id": user_id})
+    with conn.db._lock:
+        if jti in conn.db._refresh_tokens:
+            raise UniqueViolation(
+                'duplicate key value violates unique constraint "refresh_tokens_pkey"'
+            )
+        _set_token(
+            conn,
+            jti,
+            family_id=family_id,
+            user_id=user_id,
+            expires_at=expires_at,
+            used_at=None,
+            revoked_at=None,
+        )
+
+
+def rotate_refresh_token(
+    conn: MemoryConnection,
+    jti: UUID,
+    new_jti: UUID,
+    expires_at: datetime,
+    trace_id: str,
+    logger: AppLogger,
+) -> Optional[UserRow]:
+    logger.info({"trace_id": trace_id})
+    db = conn.db
+    with db._lock:
+        token = db._refresh_tokens.get(jti)
+        if (
+            token is None
+            or token["used_at"] is not None
+            or token["revoked_at"] is not None
+            or token["expires_at"] <= _now()
+            or token["user_id"] not in db._rows
+        ):
+            return None
+        _set_token(conn, jti, used_at=_now())
+        _set_token(
+            conn,
+            new_jti,
+            family_id=token["family_id"],
+            user_id=token["user_id"],
+            expires_at=expires_at,
+            used_at=None,
+            revoked_at=None,
+        )
+        return db._rows[token["user_id"]]
+
+
+def get_refresh_token(
+    conn: MemoryConnection, jti: UUID, trace_id: str, logger: AppLogger
+) -> Optional[Dict[str, Any]]:
+    logger.info({"trace_id": trace_id})
+    with conn.db._lock:
+        token = conn.db._refresh_tokens.get(jti)
+        if token is None:
+            return None
+        return {
+            key: token[key] for key in ("family_id", "user_id", "used_at", "revoked_at")
+        }
+
+
+def revoke_token_family(
+    conn: MemoryConnection, family_id: UUID, trace_id: str, logger: AppLogger
+) -> int:
+    logger.info({"trace_id": trace_id, "family_id": str(family_id)})
+    with conn.db._lock:
+        jtis = [
+            jti
+            for jti, token in conn.db._refresh_tokens.items()
+            if token["family_id"] == family_id and token["revoked_at"] is None
+        ]
+        for jti in jtis:
+            _set_token(conn, jti, revoked_at=_now())
+        return len(jtis)
+
+
+def purge_expired_refresh_tokens(
+    conn: MemoryConnection, limit: int, trace_id: str, logger: AppLogger
+) -> int:
+    logger.info({"trace_id": trace_id, "limit": limit})
+    now = _now()
+    tokens = conn.db._refresh_tokens
+    with conn.db._lock:
+        expired = [jti for jti, token in tokens.items() if token["expires_at"] <= now]
+        for jti in expired[:limit]:
+            token = tokens.pop(jti)
+            conn._undo.append(
+                lambda jti=jti, token=token: tokens.setdefault(jti, token)
+            )
+        return len(expired[:limit])
+
+
+def is_token_family_revoked(
+    conn: MemoryConnection, family_id: UUID, trace_id: str, logger: AppLogger
+) -> bool:
+    logger.info({"trace_id": trace_id, "family_id": str(family_id)})
+    with conn.db._lock:
+        return any(
+            token["family_id"] == family_id and token["revoked_at"] is not None
+            for token in conn.db._refresh_tokens.values()
+        )
+
+
+def get_revoked_token_families(
+    conn: MemoryConnection,
+    since: Optional[datetime],
+    trace_id: str,
+    logger: AppLogger,
+) -> List[Tuple[UUID, datetime]]:
+    logger.info({"trace_id": trace_id})
+    now = _now()
+    families: Dict[UUID, datetime] = {}
+    with conn.db._lock:
+        for token in conn.db._refresh_tokens.values():
+            revoked_at = token["revoked_at"]
+            if revoked_at is None:
+                continue
+            if since is None and token["expires_at"] <= now:
+                continue
+            if since is not None and revoked_at <= since:
+                continue
+            families[token["family_id"]] = max(
+                revoked_at, families.get(token["family_id"], revoked_at)
+            )
+    return list(families.items())
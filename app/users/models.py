@@ -1,6 +1,7 @@
-from typing import Optional
+from datetime import datetime
+from typing import List, NamedTuple, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, TypeAdapter
 
 
 class UserBase(BaseModel):
@@ -40,13 +41,37 @@ class User(UserBase):
     id: int
 
 
-class UserInDB(User):
+class UserBatchRequest(BaseModel):
     """
-    Represents a user as stored in the database, including hashed password.
+    Model for resolving several users at once, by id and/or code.
     """
 
+    ids: List[int] = Field(default_factory=list)
+    codes: List[str] = Field(default_factory=list)
+
+
+class UserRow(NamedTuple):
+    """
+    Compact row passed between the storage and service layers. A plain tuple
+    subclass: no per-instance dict and no validation, since the values come
+    straight from the database. Pydantic models are only built at the API
+    boundary (see services.to_public_user).
+    """
+
+    id: int
+    username: str
+    email: str
+    code: str
     hashed_password: str
+    avatar_url: Optional[str]
+    # Set by every storage update; versions the row for ETags
+    updated_at: datetime
 
 
 class Token(BaseModel):
     refresh_token: str
+
+
+# Built once at import: validating through a cached adapter avoids rebuilding
+# the core schema per call, and dump_json encodes in Rust.
+users_adapter = TypeAdapter(List[User])
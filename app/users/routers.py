@@ -1,51 +1,71 @@
-import asyncio
-import time
-from datetime import timedelta
-from typing import List
+import math
+from typing import List, Optional
 
 import jwt
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
-from psycopg import Connection
+from starlette.concurrency import run_in_threadpool
 
 from app.settings import settings
 
 from ..core.logger import AppLogger
-from ..core.r2_storage import upload_file_to_r2
-from ..database import get_db_dependency
-from ..dependencies.auth import get_current_user
+from ..core.r2_storage import R2Error, R2Unavailable, upload_file_to_r2
+from ..core.responses import RawJSONResponse, etag_matches, not_modified
+from ..core.uploads import SpooledUpload
+from ..database import set_primary_sticky
+from ..dependencies.auth import get_current_user, get_current_user_row
+from ..dependencies.loader import get_user_loader
 from ..dependencies.logger import get_app_logger
+from ..dependencies.rate_limit import clear_login_attempts, limit_login_attempts
+from ..dependencies.unit_of_work import get_read_unit_of_work, get_unit_of_work
+from ..dependencies.uploads import get_avatar_upload
 from ..middleware.trace_id import get_trace_id
 from . import services
-from .models import Token, User, UserCreate, UserUpdatePassword
+from .loader import UserLoader
+from .models import (
+    Token,
+    User,
+    UserBatchRequest,
+    UserCreate,
+    UserRow,
+    UserUpdatePassword,
+)
 
 auth_router = APIRouter(tags=["auth"])
 users_router = APIRouter(prefix="/users", tags=["users"])
 
+# Clients may keep these responses but must revalidate them, which an ETag
+# makes cheap; a user's own profile stays out of shared caches
+USERS_LIST_CACHE_CONTROL = "no-cache"
+USERS_ME_CACHE_CONTROL = "private, no-cache"
+
 
 @auth_router.post("/register", response_model=User, status_code=status.HTTP_201_CREATED)
 def register_user(
     user: UserCreate,
-    conn: Connection = Depends(get_db_dependency),
+    response: Response,
+    uow: services.UnitOfWork = Depends(get_unit_of_work),
     logger: AppLogger = Depends(lambda: get_app_logger("router.register_user")),
 ):
     """
     Register a new user.
     """
     trace_id = get_trace_id()
-    new_user, err = services.create_user(conn, user, trace_id, logger)
+    new_user, err = services.create_user(uow, user, trace_id, logger)
     if err:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail={"message": str(err), "trace_id": trace_id},
         )
+    set_primary_sticky(response, new_user.email)
     return new_user
 
 
 @auth_router.post("/login")
 def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    conn: Connection = Depends(get_db_dependency),
+    rate_limit: None = Depends(limit_login_attempts),
+    uow: services.UnitOfWork = Depends(get_unit_of_work),
     logger: AppLogger = Depends(
         lambda: get_app_logger("router.login_for_access_token")
     ),
@@ -55,7 +75,7 @@ def login_for_access_token(
     """
     trace_id = get_trace_id()
     user, err = services.authenticate_user(
-        conn,
+        uow,
         email=form_data.username,
         password=form_data.password,
         trace_id=trace_id,
@@ -67,29 +87,19 @@ def login_for_access_token(
             detail={"message": "Incorrect username or password", "trace_id": trace_id},
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token_expires = timedelta(minutes=services.ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = services.create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
-    )
-    refresh_token_expires = timedelta(minutes=services.REFRESH_TOKEN_EXPIRE_MINUTES)
-    refresh_token = services.create_refresh_token(
-        data={"sub": user.email}, expires_delta=refresh_token_expires
-    )
-    return {
-        "access_token": access_token,
-        "token_type": "bearer",
-        "refresh_token": refresh_token,
-    }
+    clear_login_attempts(form_data.username)
+    return services.issue_tokens(uow, user, trace_id, logger)
 
 
 @auth_router.post("/refresh")
 def refresh_access_token(
     token: Token,
-    conn: Connection = Depends(get_db_dependency),
+    uow: services.UnitOfWork = Depends(get_unit_of_work),
     logger: AppLogger = Depends(lambda: get_app_logger("router.refresh_access_token")),
 ):
     """
-    Refresh the access token.
+    Exchange a refresh token for a new access token and refresh token. Each
+    refresh token can be used once.
     """
     trace_id = get_trace_id()
     credentials_exception = HTTPException(
@@ -98,46 +108,89 @@ def refresh_access_token(
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(
-            token.refresh_token,
-            settings.SECRET_KEY,
-            algorithms=[settings.ALGORITHM],
-        )
+        payload = services.key_ring.decode(token.refresh_token)
         if payload.get("type") != "refresh":
             raise credentials_exception
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
     except jwt.PyJWTError:
         raise credentials_exception
-    user, err = services.get_user_by_email(conn, email, trace_id, logger)
+    tokens, err = services.rotate_refresh_token(uow, payload, trace_id, logger)
     if err:
         raise credentials_exception
-    access_token_expires = timedelta(minutes=services.ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = services.create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+    return tokens
+
+
+@auth_router.get("/.well-known/jwks.json")
+def read_jwks():
+    """
+    The public keys that verify our tokens, for services verifying them
+    locally. Empty when tokens are signed with shared secrets only.
+    """
+    return RawJSONResponse(
+        services.key_ring.jwks(),
+        headers={"Cache-Control": f"public, max-age={settings.JWKS_MAX_AGE_SECONDS}"},
     )
-    return {"access_token": access_token, "token_type": "bearer"}
 
 
 @users_router.get("/", response_model=List[User])
 def read_users(
-    conn: Connection = Depends(get_db_dependency),
+    # Connections are checked out for the two queries only, not while the
+    # list is encoded
+    uow: services.UnitOfWork = Depends(get_read_unit_of_work),
+    if_none_match: Optional[str] = Header(None),
     logger: AppLogger = Depends(lambda: get_app_logger("router.read_users")),
 ) -> List[User]:
     """
-    Retrieve all users.
+    Retrieve all users. Answers 304 to an If-None-Match matching the current
+    ETag, without loading the users.
     """
     trace_id = get_trace_id()
-    return services.get_users(conn, trace_id, logger)
+    etag = services.get_users_etag(uow, trace_id, logger)
+    headers = {"ETag": etag, "Cache-Control": USERS_LIST_CACHE_CONTROL}
+    if etag_matches(if_none_match, etag):
+        return not_modified(headers)
+    # Already validated and encoded by the service, skip response_model handling
+    return RawJSONResponse(
+        services.get_users_json(uow, trace_id, logger), headers=headers
+    )
+
+
+@users_router.post("/batch", response_model=List[User])
+def read_users_batch(
+    batch: UserBatchRequest,
+    loader: UserLoader = Depends(get_user_loader),
+    logger: AppLogger = Depends(lambda: get_app_logger("router.read_users_batch")),
+) -> List[User]:
+    """
+    Retrieve several users by id and/or code in a single query.
+    """
+    trace_id = get_trace_id()
+    if len(batch.ids) + len(batch.codes) > settings.USERS_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={
+                "message": f"At most {settings.USERS_BATCH_MAX_SIZE} ids and codes per batch",
+                "trace_id": trace_id,
+            },
+        )
+    return services.get_users_batch(loader, batch.ids, batch.codes, trace_id, logger)
 
 
 @users_router.get("/me", response_model=User)
-def read_users_me(current_user: User = Depends(get_current_user)):
+def read_users_me(
+    response: Response,
+    current_user: UserRow = Depends(get_current_user_row),
+    if_none_match: Optional[str] = Header(None),
+):
     """
-    Get the current logged-in user.
+    Get the current logged-in user. Answers 304 to an If-None-Match matching
+    the current ETag.
     """
-    return current_user
+    etag = services.user_etag(current_user)
+    headers = {"ETag": etag, "Cache-Control": USERS_ME_CACHE_CONTROL}
+    if etag_matches(if_none_match, etag):
+        return not_modified(headers)
+    response.headers.update(headers)
+    return services.to_public_user(current_user)
 
 
 @auth_router.post(
@@ -145,8 +198,9 @@ def read_users_me(current_user: User = Depends(get_current_user)):
 )
 def update_password(
     user: UserUpdatePassword,
-    conn: Connection = Depends(get_db_dependency),
+    response: Response,
     current_user: User = Depends(get_current_user),
+    uow: services.UnitOfWork = Depends(get_unit_of_work),
     logger: AppLogger = Depends(lambda: get_app_logger("router.update_password")),
 ):
     """
@@ -154,14 +208,16 @@ def update_password(
     """
     trace_id = get_trace_id()
     _, err = services.update_password(
-        conn, current_user.id, user.old_password, user.new_password, trace_id, logger
+        uow, current_user.id, user.old_password, user.new_password, trace_id, logger
     )
     if err:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail={"message": str(err), "trace_id": trace_id},
         )
-    user, err = services.get_user_by_id(conn, current_user.id, trace_id, logger)
+    set_primary_sticky(response, current_user.email)
+    with uow() as conn:
+        user, err = services.get_user_by_id(conn, current_user.id, trace_id, logger)
     if err is not None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -170,11 +226,34 @@ def update_password(
     return user
 
 
-@users_router.post("/me/avatar", response_model=User)
+# The body is parsed by get_avatar_upload, so the form is documented by hand
+AVATAR_REQUEST_BODY = {
+    "required": True,
+    "content": {
+        "multipart/form-data": {
+            "schema": {
+                "type": "object",
+                "properties": {"file": {"type": "string", "format": "binary"}},
+                "required": ["file"],
+            }
+        }
+    },
+}
+
+
+@users_router.post(
+    "/me/avatar",
+    response_model=User,
+    openapi_extra={"requestBody": AVATAR_REQUEST_BODY},
+)
 async def upload_avatar(
-    file: UploadFile = File(...),
-    conn: Connection = Depends(get_db_dependency),
+    response: Response,
     current_user: User = Depends(get_current_user),
+    # Read after authentication, so unauthenticated uploads aren't read
+    file: SpooledUpload = Depends(get_avatar_upload),
+    # A connection is only checked out once the upload is stored: none is
+    # held while the body arrives or while R2 is called
+    uow: services.UnitOfWork = Depends(get_unit_of_work),
     logger: AppLogger = Depends(lambda: get_app_logger("router.upload_avatar")),
 ):
     """
@@ -182,9 +261,8 @@ async def upload_avatar(
     """
     trace_id = get_trace_id()
     ext = file.filename.split(".")[-1] if "." in file.filename else ""
-    filename = f"avatars/user_{current_user.id}_{int(time.time())}.{ext}"
-    # Ensure file.file is at the beginning
-    file.file.seek(0)
+    # Named after the content, so re-uploading the same image reuses its key
+    filename = f"avatars/user_{current_user.id}_{file.sha256[:16]}.{ext}"
     # Ensure bucket is set, raise clear error if not
     bucket = settings.R2_BUCKET_NAME
     if not bucket:
@@ -195,25 +273,46 @@ async def upload_avatar(
                 "trace_id": trace_id,
             },
         )
-    loop = asyncio.get_running_loop()
-    public_url = await loop.run_in_executor(
-        None,
-        lambda: upload_file_to_r2(
-            file.file, filename, bucket=bucket, content_type=file.content_type
-        ),
-    )
-    success, err = services.update_avatar_url(
-        conn, current_user.id, public_url, trace_id, logger
-    )
-    if err:
+    try:
+        public_url = await upload_file_to_r2(
+            file.file,
+            filename,
+            size=file.size,
+            bucket=bucket,
+            content_type=file.content_type,
+            sha256=file.sha256,
+        )
+    except R2Unavailable as e:
+        logger.warning({"trace_id": trace_id, "message": str(e)})
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail={"message": str(err), "trace_id": trace_id},
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail={"message": "Avatar storage is unavailable", "trace_id": trace_id},
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))},
         )
-    user, err = services.get_user_by_id(conn, current_user.id, trace_id, logger)
-    if err:
+    except R2Error as e:
+        logger.error({"trace_id": trace_id, "message": str(e)})
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail={"message": "User not found", "trace_id": trace_id},
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail={"message": "Failed to store avatar", "trace_id": trace_id},
         )
-    return user
+
+    def save_avatar_url() -> User:
+        with uow() as conn:
+            success, err = services.update_avatar_url(
+                conn, current_user.id, public_url, trace_id, logger
+            )
+            if err:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail={"message": str(err), "trace_id": trace_id},
+                )
+            set_primary_sticky(response, current_user.email)
+            user, err = services.get_user_by_id(conn, current_user.id, trace_id, logger)
+            if err:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail={"message": "User not found", "trace_id": trace_id},
+                )
+            return user
+
+    return await run_in_threadpool(save_avatar_url)
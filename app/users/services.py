@@ -1,20 +1,39 @@
-from datetime import datetime, timedelta, timezone
-from typing import List, Optional, Tuple, Union
 import secrets
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+from uuid import UUID, uuid4
 
 from fastapi import Depends
-from jwt import encode
-from passlib.context import CryptContext
 from psycopg import Connection
 from psycopg.errors import UniqueViolation
 
 from app.settings import settings
 
+from ..core.keys import KeyRing
 from ..core.logger import AppLogger
+from ..core.metrics import metrics
+from ..core.passwords import BackgroundRehasher, PasswordHasher
+from ..core.responses import weak_etag
+from ..core.revocation import RevocationFilter
+from ..core.singleflight import SingleFlight
 from ..dependencies.logger import get_app_logger
 from . import common
-from . import storage as user_storage
-from .models import User, UserCreate
+from .backends import get_connection_context, get_user_storage
+from .loader import UserLoader
+from .models import User, UserCreate, UserRow, users_adapter
 
 
 def get_service_logger(
@@ -23,27 +42,213 @@ def get_service_logger(
     return logger
 
 
-# Password hashing context
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+# Password hashing context; its cost is calibrated at startup (see main.py)
+pwd_context = PasswordHasher(settings.PASSWORD_HASH_SCHEME)
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.ACCESS_TOKEN_EXPIRE_MINUTES
 REFRESH_TOKEN_EXPIRE_MINUTES = settings.REFRESH_TOKEN_EXPIRE_MINUTES
 
+# Signs and verifies tokens; rescans JWT_KEYS_DIR for rotated keys
+key_ring = KeyRing(
+    settings.JWT_KEYS_DIR,
+    secret=settings.SECRET_KEY,
+    algorithm=settings.ALGORITHM,
+    reload_seconds=settings.JWT_KEYS_RELOAD_SECONDS,
+    publish_seconds=settings.JWT_KEY_PUBLISH_SECONDS,
+    logger=get_app_logger("service.keys"),
+    accept_legacy=settings.JWT_ACCEPT_LEGACY_TOKENS,
+)
+
+user_storage = get_user_storage()
+
+
+class UnitOfWork:
+    """
+    Checks out a connection from its provider for each `with uow() as conn:`
+    block and returns it when the block exits, committed (or rolled back if it raised)
+    by the provider. Services open a block around their storage calls only,
+    so no connection is held while a request hashes a password, signs a
+    token, encodes a response or waits on another service.
+
+    Metrics (labelled with the route):
+        db_connection_wait_seconds: time spent waiting for the pool.
+        db_connection_hold_seconds: time from checkout to return.
+    """
+
+    def __init__(
+        self, get_connection: Callable[[], ContextManager[Connection]], route: str
+    ):
+        self._get_connection = get_connection
+        self.route = route
+
+    @contextmanager
+    def __call__(self) -> Iterator[Connection]:
+        started = time.perf_counter()
+        acquired = None
+        try:
+            with self._get_connection() as conn:
+                acquired = time.perf_counter()
+                metrics.observe(
+                    "db_connection_wait_seconds", acquired - started, route=self.route
+                )
+                yield conn
+        finally:
+            if acquired is not None:
+                metrics.observe(
+                    "db_connection_hold_seconds",
+                    time.perf_counter() - acquired,
+                    route=self.route,
+                )
+
+
+def save_rehashed_password(user_id: int, old_hash: str, new_hash: str) -> bool:
+    logger = get_app_logger("service.users.rehash")
+    try:
+        with get_connection_context() as conn:
+            return user_storage.replace_password_hash(
+                conn, user_id, old_hash, new_hash, "rehash", logger
+            )
+    except Exception as e:
+        logger.error(
+            {"user_id": user_id, "context": "Password rehash failed", "error": str(e)}
+        )
+        raise
+
+
+# Upgrades outdated hashes (older scheme or lower cost) after a login
+password_rehasher = BackgroundRehasher(pwd_context, save_rehashed_password)
+
+# Concurrent lookups of the same user (e.g. a token refresh storm) share a
+# single query and its result.
+user_lookups = SingleFlight("users")
+
+# Refresh token families revoked after a token reuse. Access tokens carry
+# their family too, so get_current_user checks it without a query unless the
+# filter reports a possible hit.
+revoked_families = RevocationFilter(
+    "refresh_token_families",
+    capacity=settings.REFRESH_TOKEN_FILTER_CAPACITY,
+    error_rate=settings.REFRESH_TOKEN_FILTER_ERROR_RATE,
+    sync_seconds=settings.REFRESH_TOKEN_REVOCATION_SYNC_SECONDS,
+)
+
+# Expired refresh tokens are deleted by logins and refreshes, a batch at a
+# time: once per REFRESH_TOKEN_PURGE_SECONDS, or again on the next one while
+# batches come back full.
+_token_purge_lock = threading.Lock()
+_next_token_purge = 0.0
+
+
+def purge_expired_refresh_tokens(
+    conn: Connection,
+    trace_id: str,
+    logger: AppLogger = Depends(get_service_logger),
+) -> int:
+    """
+    Deletes a batch of expired refresh tokens when one is due, in a
+    savepoint so that a failure never fails the login or refresh it runs in.
+    A no-op while another thread purges.
+    """
+    global _next_token_purge
+    if time.monotonic() < _next_token_purge:
+        return 0
+    if not _token_purge_lock.acquire(blocking=False):
+        return 0
+    try:
+        batch_size = settings.REFRESH_TOKEN_PURGE_BATCH_SIZE
+        with conn.transaction():
+            purged = user_storage.purge_expired_refresh_tokens(
+                conn, batch_size, trace_id, logger
+            )
+        metrics.inc("refresh_tokens_purged_total", purged)
+        if purged < batch_size:
+            _next_token_purge = time.monotonic() + settings.REFRESH_TOKEN_PURGE_SECONDS
+        return purged
+    except Exception as e:
+        logger.error(
+            {
+                "trace_id": trace_id,
+                "context": "Expired refresh token purge failed",
+                "error": str(e),
+            }
+        )
+        _next_token_purge = time.monotonic() + settings.REFRESH_TOKEN_PURGE_SECONDS
+        return 0
+    finally:
+        _token_purge_lock.release()
+
+
+def to_public_user(db_user: UserRow) -> User:
+    """
+    Builds the public User from a stored row, picking the public fields by
+    attribute instead of going through a model_dump() copy.
+    """
+    return User(
+        id=db_user.id,
+        username=db_user.username,
+        email=db_user.email,
+        code=db_user.code,
+        avatar_url=db_user.avatar_url,
+    )
+
 
 def get_users(
     conn: Connection, trace_id: str, logger: AppLogger = Depends(get_service_logger)
 ) -> List[User]:
     logger.info({"trace_id": trace_id})
     db_users = user_storage.get_users(conn, trace_id, logger)
-    return [User(**db_user.model_dump()) for db_user in db_users]
+    return [to_public_user(db_user) for db_user in db_users]
+
+
+def get_users_json(
+    uow: UnitOfWork, trace_id: str, logger: AppLogger = Depends(get_service_logger)
+) -> bytes:
+    """
+    Returns all users encoded as a JSON array. Rows are validated once against
+    the public User schema and encoded without intermediate models, after the
+    connection is returned.
+    """
+    logger.info({"trace_id": trace_id})
+    with uow() as conn:
+        rows = user_storage.get_public_users(conn, trace_id, logger)
+    return users_adapter.dump_json(users_adapter.validate_python(rows))
+
+
+def get_users_etag(
+    uow: UnitOfWork, trace_id: str, logger: AppLogger = Depends(get_service_logger)
+) -> str:
+    """
+    Returns the ETag of the public users list, from an aggregate query
+    instead of the rows themselves.
+    """
+    with uow() as conn:
+        count, version = user_storage.get_public_users_version(conn, trace_id, logger)
+    return weak_etag("users", count, version)
+
+
+def user_etag(db_user: UserRow) -> str:
+    return weak_etag("user", db_user.id, db_user.updated_at)
+
+
+def get_users_batch(
+    loader: UserLoader,
+    ids: List[int],
+    codes: List[str],
+    trace_id: str,
+    logger: AppLogger = Depends(get_service_logger),
+) -> List[User]:
+    logger.info({"trace_id": trace_id, "ids": len(ids), "codes": len(codes)})
+    db_users = loader.load_many(ids=ids, codes=codes)
+    return [to_public_user(db_user) for db_user in db_users]
 
 
 def create_user(
-    conn: Connection,
+    uow: UnitOfWork,
     user: UserCreate,
     trace_id: str,
     logger: AppLogger = Depends(get_service_logger),
 ) -> Union[User, Tuple[None, ValueError]]:
     logger.info({"trace_id": trace_id, "email": user.email})
+    # Hashed before a connection is checked out, it takes far longer than the insert
     hashed_password = pwd_context.hash(user.password)
 
     # No need to check if email or username already exists here,
@@ -56,14 +261,14 @@ def create_user(
     while retry_count < 5:
         try:
             user.code = common.generate_user_code()
-            with conn.transaction():
+            with uow() as conn, conn.transaction():
                 db_user_id = user_storage.create_user(
                     conn, user, hashed_password, trace_id, logger
                 )
                 user_created = user_storage.get_user_by_id(
                     conn, db_user_id, trace_id, logger
                 )
-            return User(**user_created.model_dump()), None
+            return to_public_user(user_created), None
         except (Exception, UniqueViolation) as e:
             if isinstance(e, UniqueViolation):
                 retry_count += 1
@@ -95,42 +300,33 @@ def create_user(
     return None, ValueError(f"Failed to create user after {retry_count} attempts")
 
 
-def get_user_by_email(
-    conn: Connection,
-    email: str,
-    trace_id: str,
-    logger: AppLogger = Depends(get_service_logger),
-) -> Union[User, Tuple[None, ValueError]]:
-    logger.info({"trace_id": trace_id, "email": email})
-    db_user = user_storage.get_user_by_email(conn, email, trace_id, logger)
-    if not db_user:
-        return None, ValueError("User not found")
-    return User(**db_user.model_dump()), None
-
-
 def authenticate_user(
-    conn: Connection,
+    uow: UnitOfWork,
     email: str,
     password: str,
     trace_id: str,
     logger: AppLogger = Depends(get_service_logger),
 ) -> Union[User, Tuple[None, ValueError]]:
     logger.info({"trace_id": trace_id, "email": email})
-    db_user = user_storage.get_user_by_email(conn, email, trace_id, logger)
+    with uow() as conn:
+        db_user = user_storage.get_user_by_email_ci(conn, email, trace_id, logger)
+    # Verified after the connection is returned
     if not db_user or not pwd_context.verify(password, db_user.hashed_password):
         return None, ValueError("Invalid email or password")
-    return User(**db_user.model_dump()), None
+    if pwd_context.needs_update(db_user.hashed_password):
+        # The plain password is only at hand now; rehash it without making
+        # this login wait
+        password_rehasher.submit(db_user.id, db_user.hashed_password, password)
+    return to_public_user(db_user), None
 
 
-import secrets
-
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + (
         expires_delta or timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     )
     to_encode.update({"exp": expire, "type": "access", "nonce": secrets.token_hex(8)})
-    return encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+    return key_ring.encode(to_encode)
 
 
 def create_refresh_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -139,11 +335,147 @@ def create_refresh_token(data: dict, expires_delta: Optional[timedelta] = None):
         expires_delta or timedelta(minutes=settings.REFRESH_TOKEN_EXPIRE_MINUTES)
     )
     to_encode.update({"exp": expire, "type": "refresh", "nonce": secrets.token_hex(8)})
-    return encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+    return key_ring.encode(to_encode)
+
+
+def _token_pair(
+    email: str, family_id: UUID, jti: UUID, refresh_expires: timedelta
+) -> Dict[str, str]:
+    return {
+        "access_token": create_access_token(
+            data={"sub": email, "fam": str(family_id)},
+            expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
+        ),
+        "token_type": "bearer",
+        "refresh_token": create_refresh_token(
+            data={"sub": email, "fam": str(family_id), "jti": str(jti)},
+            expires_delta=refresh_expires,
+        ),
+    }
+
+
+def issue_tokens(
+    uow: UnitOfWork,
+    user: User,
+    trace_id: str,
+    logger: AppLogger = Depends(get_service_logger),
+) -> Dict[str, str]:
+    """
+    Starts a new refresh token family for a login and returns its first
+    access and refresh tokens.
+    """
+    logger.info({"trace_id": trace_id, "user_id": user.id})
+    family_id, jti = uuid4(), uuid4()
+    refresh_expires = timedelta(minutes=REFRESH_TOKEN_EXPIRE_MINUTES)
+    with uow() as conn:
+        user_storage.insert_refresh_token(
+            conn,
+            jti,
+            family_id,
+            user.id,
+            datetime.now(timezone.utc) + refresh_expires,
+            trace_id,
+            logger,
+        )
+        purge_expired_refresh_tokens(conn, trace_id, logger)
+    return _token_pair(user.email, family_id, jti, refresh_expires)
+
+
+def is_token_family_revoked(
+    get_connection: Callable[[], ContextManager[Any]],
+    family_id: str,
+    trace_id: str,
+    logger: AppLogger = Depends(get_service_logger),
+) -> bool:
+    """
+    Checks a token family against the revocation filter, and against the
+    database only when the filter reports a possible hit. A connection is
+    checked out just for that, or to reload the filter when it is due.
+    """
+    if revoked_families.is_stale():
+        with get_connection() as conn:
+            revoked_families.sync(
+                lambda since: [
+                    (str(family), revoked_at)
+                    for family, revoked_at in user_storage.get_revoked_token_families(
+                        conn, since, trace_id, logger
+                    )
+                ]
+            )
+    if not revoked_families.might_contain(family_id):
+        return False
+    with get_connection() as conn:
+        revoked = user_storage.is_token_family_revoked(
+            conn, UUID(family_id), trace_id, logger
+        )
+    if not revoked:
+        revoked_families.false_positive()
+    return revoked
+
+
+def rotate_refresh_token(
+    uow: UnitOfWork,
+    payload: Dict[str, Any],
+    trace_id: str,
+    logger: AppLogger = Depends(get_service_logger),
+) -> Union[Dict[str, str], Tuple[None, ValueError]]:
+    """
+    Exchanges a decoded refresh token for a new access and refresh token pair
+    in the same family. Each refresh token works once: presenting one again
+    means it was copied, so its whole family is revoked, including the
+    tokens its legitimate holder was issued since.
+    """
+    logger.info({"trace_id": trace_id})
+    try:
+        jti, family_id = UUID(payload["jti"]), UUID(payload["fam"])
+    except (KeyError, TypeError, ValueError):
+        # Includes refresh tokens issued before rotation, which have no jti
+        return None, ValueError("Invalid refresh token")
+    if is_token_family_revoked(uow, str(family_id), trace_id, logger):
+        return None, ValueError("Refresh token revoked")
+
+    new_jti = uuid4()
+    refresh_expires = timedelta(minutes=REFRESH_TOKEN_EXPIRE_MINUTES)
+    reused = False
+    with uow() as conn, conn.transaction():
+        db_user = user_storage.rotate_refresh_token(
+            conn,
+            jti,
+            new_jti,
+            datetime.now(timezone.utc) + refresh_expires,
+            trace_id,
+            logger,
+        )
+        if db_user is None:
+            token = user_storage.get_refresh_token(conn, jti, trace_id, logger)
+            reused = (
+                token is not None
+                and token["used_at"] is not None
+                and token["revoked_at"] is None
+            )
+            if reused:
+                user_storage.revoke_token_family(
+                    conn, token["family_id"], trace_id, logger
+                )
+        purge_expired_refresh_tokens(conn, trace_id, logger)
+    if reused:
+        revoked_families.add(str(family_id))
+        metrics.inc("refresh_token_reuse_total")
+        logger.warning(
+            {
+                "trace_id": trace_id,
+                "message": "Refresh token reused, family revoked",
+                "family_id": str(family_id),
+            }
+        )
+        return None, ValueError("Refresh token reused")
+    if db_user is None:
+        return None, ValueError("Invalid refresh token")
+    return _token_pair(db_user.email, family_id, new_jti, refresh_expires), None
 
 
 def update_password(
-    conn: Connection,
+    uow: UnitOfWork,
     user_id: int,
     old_password: str,
     new_password: str,
@@ -153,32 +485,43 @@ def update_password(
     """
     Update a user's password after verifying the old password.
     Returns (True, None) on success, (False, ValueError) on failure.
+
+    Both passwords are hashed with no connection checked out. The new hash
+    is only stored if the one the old password was verified against is still
+    current, instead of holding the row lock across the hashing.
     """
     logger.info({"trace_id": trace_id, "user_id": user_id})
-    with conn.transaction():
-        userLock = user_storage.lock_user(conn, user_id, trace_id, logger)
-        if userLock is None:
-            logger.warning(
-                {"trace_id": trace_id, "user_id": user_id, "message": "User not found"}
-            )
-            return False, ValueError("User not found")
-        if not pwd_context.verify(old_password, userLock.hashed_password):
-            logger.warning(
-                {
-                    "trace_id": trace_id,
-                    "user_id": user_id,
-                    "message": "Password mismatch",
-                }
-            )
-            return False, ValueError("Password mismatch")
-        hashed_password = pwd_context.hash(new_password)
-        success = user_storage.update_password(
-            conn, user_id, hashed_password, trace_id, logger
+    with uow() as conn:
+        db_user = user_storage.get_user_by_id(conn, user_id, trace_id, logger)
+    if db_user is None:
+        logger.warning(
+            {"trace_id": trace_id, "user_id": user_id, "message": "User not found"}
         )
-        if success:
-            return True, None
-        else:
-            return False, ValueError("Failed to update password")
+        return False, ValueError("User not found")
+    if not pwd_context.verify(old_password, db_user.hashed_password):
+        logger.warning(
+            {
+                "trace_id": trace_id,
+                "user_id": user_id,
+                "message": "Password mismatch",
+            }
+        )
+        return False, ValueError("Password mismatch")
+    hashed_password = pwd_context.hash(new_password)
+    with uow() as conn:
+        success = user_storage.replace_password_hash(
+            conn, user_id, db_user.hashed_password, hashed_password, trace_id, logger
+        )
+    if success:
+        return True, None
+    logger.warning(
+        {
+            "trace_id": trace_id,
+            "user_id": user_id,
+            "message": "Password changed concurrently",
+        }
+    )
+    return False, ValueError("Failed to update password")
 
 
 def get_user_by_id(
@@ -191,7 +534,7 @@ def get_user_by_id(
     db_user = user_storage.get_user_by_id(conn, user_id, trace_id, logger)
     if not db_user:
         return None, ValueError("User not found")
-    return User(**db_user.model_dump()), None
+    return to_public_user(db_user), None
 
 
 def update_avatar_url(
@@ -2,22 +2,189 @@
 This module contains the database operations for users.
 """
 
-from typing import List, Optional
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple, Union
+from uuid import UUID
 
-from psycopg import Connection
+from psycopg import Connection, Cursor
+from psycopg.rows import args_row
+
+from app.settings import settings
 
 from ..core.logger import AppLogger
-from .models import UserCreate, UserInDB
+from . import common
+from .models import UserCreate, UserRow
+
+# Builds UserRow tuples straight from the column values, without a dict per
+# row. Queries using it must select the columns in UserRow's field order.
+user_row = args_row(UserRow)
+
+# Hot statements, run on (nearly) every authenticated request. They are
+# prepared on first use and psycopg keeps the prepared handle on the pooled
+# connection, so subsequent calls skip parsing and planning on the server.
+STATEMENTS = {
+    # Matched through users_email_lower_idx, which login uses too, so one
+    # covering index serves both
+    "get_user_by_email": "SELECT id, username, email, code, hashed_password, avatar_url, updated_at FROM users WHERE lower(email) = lower(%(email)s) AND email = %(email)s;",
+    # An exact match wins over other casings of the same address
+    "get_user_by_email_ci": "SELECT id, username, email, code, hashed_password, avatar_url, updated_at FROM users WHERE lower(email) = lower(%s) ORDER BY email = %s DESC, id LIMIT 1;",
+    "get_user_by_id": "SELECT id, username, email, code, hashed_password, avatar_url, updated_at FROM users WHERE id = %s;",
+    "lock_user": "SELECT id, username, email, code, hashed_password, avatar_url, updated_at FROM users WHERE id = %s FOR UPDATE;",
+    "update_password": "UPDATE users SET hashed_password = %s, updated_at = clock_timestamp() WHERE id = %s;",
+    "replace_password_hash": "UPDATE users SET hashed_password = %s, updated_at = clock_timestamp() WHERE id = %s AND hashed_password = %s;",
+    "update_avatar_url": "UPDATE users SET avatar_url = %s, updated_at = clock_timestamp() WHERE id = %s;",
+    "get_users_by_ids_or_codes": "SELECT id, username, email, code, hashed_password, avatar_url, updated_at FROM users WHERE id = ANY(%s) OR code = ANY(%s);",
+    "create_user": "INSERT INTO users (username, email, code, hashed_password) VALUES (%(username)s, %(email)s, %(code)s, %(hashed_password)s) RETURNING id;",
+    "insert_refresh_token": "INSERT INTO refresh_tokens (jti, family_id, user_id, expires_at) VALUES (%s, %s, %s, %s);",
+    # Marks the token used, issues its successor in the same family and
+    # returns the user, in one round trip. No row: unknown, expired, already
+    # used or revoked.
+    "rotate_refresh_token": (
+        "WITH used AS (UPDATE refresh_tokens SET used_at = now() WHERE jti = %(jti)s AND used_at IS NULL AND revoked_at IS NULL AND expires_at > now() RETURNING family_id, user_id), "
+        "successor AS (INSERT INTO refresh_tokens (jti, family_id, user_id, expires_at) SELECT %(new_jti)s, family_id, user_id, %(expires_at)s FROM used) "
+        "SELECT u.id, u.username, u.email, u.code, u.hashed_password, u.avatar_url, u.updated_at FROM users u JOIN used ON u.id = used.user_id;"
+    ),
+    "get_refresh_token": "SELECT family_id, user_id, used_at, revoked_at FROM refresh_tokens WHERE jti = %s;",
+    "revoke_token_family": "UPDATE refresh_tokens SET revoked_at = now() WHERE family_id = %s AND revoked_at IS NULL;",
+    "is_token_family_revoked": "SELECT EXISTS (SELECT 1 FROM refresh_tokens WHERE family_id = %s AND revoked_at IS NOT NULL) AS revoked;",
+    "get_revoked_token_families": "SELECT family_id, max(revoked_at) AS revoked_at FROM refresh_tokens WHERE revoked_at > %s GROUP BY family_id;",
+    # SKIP LOCKED: workers purging at once take different rows
+    "purge_expired_refresh_tokens": "DELETE FROM refresh_tokens WHERE jti IN (SELECT jti FROM refresh_tokens WHERE expires_at <= now() LIMIT %s FOR UPDATE SKIP LOCKED);",
+    "get_live_revoked_token_families": "SELECT family_id, max(revoked_at) AS revoked_at FROM refresh_tokens WHERE revoked_at IS NOT NULL AND expires_at > now() GROUP BY family_id;",
+}
+
+# USERS_TABLE_LAYOUT=partitioned: users is hash partitioned on id and email,
+# username and code are kept unique by global lookup tables. Lookups by those
+# keys resolve the id first, so a single partition is scanned.
+PARTITIONED_STATEMENTS = {
+    **STATEMENTS,
+    "get_user_by_email": "SELECT id, username, email, code, hashed_password, avatar_url, updated_at FROM users WHERE id = (SELECT user_id FROM user_emails WHERE email = %(email)s);",
+    "get_user_by_email_ci": "SELECT id, username, email, code, hashed_password, avatar_url, updated_at FROM users WHERE id = (SELECT user_id FROM user_emails WHERE lower(email) = lower(%s) ORDER BY email = %s DESC, user_id LIMIT 1);",
+    "get_users_by_ids_or_codes": "SELECT id, username, email, code, hashed_password, avatar_url, updated_at FROM users WHERE id = ANY(%s::integer[] || ARRAY(SELECT user_id FROM user_codes WHERE code = ANY(%s)));",
+    "create_user": (
+        "WITH new_user AS (INSERT INTO users (username, email, code, hashed_password) VALUES (%(username)s, %(email)s, %(code)s, %(hashed_password)s) RETURNING id), "
+        "emails AS (INSERT INTO user_emails (email, user_id) SELECT %(email)s, id FROM new_user), "
+        "usernames AS (INSERT INTO user_usernames (username, user_id) SELECT %(username)s, id FROM new_user), "
+        "codes AS (INSERT INTO user_codes (code, user_id) SELECT %(code)s, id FROM new_user) "
+        "SELECT id FROM new_user;"
+    ),
+}
+
+
+# Bulk import (see app/users/bulk_import.py). Each batch is copied into the
+# users_import staging table; the checks flag rejected rows by setting their
+# error, in order, so a row gets the first reason that applies.
+IMPORT_STAGING_TABLE = """
+    CREATE TEMP TABLE users_import (
+        line INTEGER PRIMARY KEY,
+        id INTEGER,
+        username TEXT NOT NULL,
+        email TEXT NOT NULL,
+        code TEXT NOT NULL,
+        hashed_password TEXT NOT NULL,
+        error TEXT
+    ) ON COMMIT DROP;
+"""
+IMPORT_STATEMENTS = {
+    "check_lengths": "UPDATE users_import SET error = CASE WHEN length(username) > 50 THEN 'Username is longer than 50 characters' ELSE 'Email is longer than 255 characters' END WHERE length(username) > 50 OR length(email) > 255;",
+    "check_email_taken": "UPDATE users_import i SET error = 'Email already registered' WHERE error IS NULL AND EXISTS (SELECT 1 FROM users u WHERE u.email = i.email);",
+    "check_username_taken": "UPDATE users_import i SET error = 'Username already taken' WHERE error IS NULL AND EXISTS (SELECT 1 FROM users u WHERE u.username = i.username);",
+    "check_email_repeated": "UPDATE users_import i SET error = 'Email repeats line ' || d.first FROM (SELECT line, min(line) OVER (PARTITION BY email) AS first FROM users_import WHERE error IS NULL) d WHERE i.line = d.line AND d.first < d.line;",
+    "check_username_repeated": "UPDATE users_import i SET error = 'Username repeats line ' || d.first FROM (SELECT line, min(line) OVER (PARTITION BY username) AS first FROM users_import WHERE error IS NULL) d WHERE i.line = d.line AND d.first < d.line;",
+    # Lines whose generated code is taken, or repeats an earlier line's
+    "find_code_conflicts": "SELECT line FROM users_import i WHERE error IS NULL AND (EXISTS (SELECT 1 FROM users u WHERE u.code = i.code) OR EXISTS (SELECT 1 FROM users_import o WHERE o.code = i.code AND o.line < i.line AND o.error IS NULL));",
+    "set_codes": "UPDATE users_import i SET code = c.code FROM unnest(%s::integer[], %s::text[]) AS c(line, code) WHERE i.line = c.line;",
+    "reject_lines": "UPDATE users_import SET error = %s WHERE line = ANY(%s);",
+    "assign_ids": "UPDATE users_import SET id = nextval(pg_get_serial_sequence('users', 'id')) WHERE error IS NULL;",
+    "insert_users": "INSERT INTO users (id, username, email, code, hashed_password) SELECT id, username, email, code, hashed_password FROM users_import WHERE error IS NULL;",
+    "report": "SELECT line, id, CASE WHEN error IS NULL THEN code END AS code, error FROM users_import ORDER BY line;",
+}
+PARTITIONED_IMPORT_STATEMENTS = {
+    **IMPORT_STATEMENTS,
+    "check_email_taken": "UPDATE users_import i SET error = 'Email already registered' WHERE error IS NULL AND EXISTS (SELECT 1 FROM user_emails u WHERE u.email = i.email);",
+    "check_username_taken": "UPDATE users_import i SET error = 'Username already taken' WHERE error IS NULL AND EXISTS (SELECT 1 FROM user_usernames u WHERE u.username = i.username);",
+    "find_code_conflicts": "SELECT line FROM users_import i WHERE error IS NULL AND (EXISTS (SELECT 1 FROM user_codes u WHERE u.code = i.code) OR EXISTS (SELECT 1 FROM users_import o WHERE o.code = i.code AND o.line < i.line AND o.error IS NULL));",
+    "insert_users": (
+        "WITH accepted AS (SELECT id, username, email, code, hashed_password FROM users_import WHERE error IS NULL), "
+        "new_users AS (INSERT INTO users (id, username, email, code, hashed_password) SELECT * FROM accepted), "
+        "emails AS (INSERT INTO user_emails (email, user_id) SELECT email, id FROM accepted), "
+        "usernames AS (INSERT INTO user_usernames (username, user_id) SELECT username, id FROM accepted) "
+        "INSERT INTO user_codes (code, user_id) SELECT code, id FROM accepted;"
+    ),
+}
+IMPORT_CHECKS = (
+    "check_lengths",
+    "check_email_taken",
+    "check_username_taken",
+    "check_email_repeated",
+    "check_username_repeated",
+)
+IMPORT_CODE_ATTEMPTS = 5
 
 
-def get_users(conn: Connection, trace_id: str, logger: AppLogger) -> List[UserInDB]:
+def get_statements() -> Dict[str, str]:
+    """
+    Returns the statements for the configured USERS_TABLE_LAYOUT.
+    """
+    if settings.USERS_TABLE_LAYOUT == "partitioned":
+        return PARTITIONED_STATEMENTS
+    return STATEMENTS
+
+
+def execute_statement(
+    cur: Cursor, name: str, params: Union[tuple, Dict[str, Any]]
+) -> Cursor:
+    """
+    Executes a registered statement, preparing it unless prepared statements
+    are disabled (e.g. behind a transaction-pooling pgbouncer).
+    """
+    return cur.execute(
+        get_statements()[name], params, prepare=settings.DB_PREPARED_STATEMENTS
+    )
+
+
+def get_users(conn: Connection, trace_id: str, logger: AppLogger) -> List[UserRow]:
+    logger.info({"trace_id": trace_id})
+    with conn.cursor(row_factory=user_row) as cur:
+        cur.execute(
+            "SELECT id, username, email, code, hashed_password, avatar_url, "
+            "updated_at FROM users;"
+        )
+        return cur.fetchall()
+
+
+def get_public_users(
+    conn: Connection, trace_id: str, logger: AppLogger
+) -> List[Dict[str, Any]]:
+    """
+    Returns the public columns of every user in id order as dict rows, ready
+    to encode.
+    """
     logger.info({"trace_id": trace_id})
     with conn.cursor() as cur:
         cur.execute(
-            "SELECT id, username, email, code, hashed_password, avatar_url FROM users;"
+            "SELECT id, username, email, code, avatar_url FROM users ORDER BY id;"
         )
-        rows = cur.fetchall()
-        return [UserInDB(**row) for row in rows]
+        return cur.fetchall()
+
+
+def get_public_users_version(
+    conn: Connection, trace_id: str, logger: AppLogger
+) -> Tuple[int, Any]:
+    """
+    Returns the number of users and the sum of their updated_at,
+    which changes whenever one is added, removed or updated. One aggregate:
+    no row leaves the server.
+    """
+    logger.info({"trace_id": trace_id})
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT count(*) AS users, "
+            "coalesce(sum(extract(epoch FROM updated_at)), 0) AS version "
+            "FROM users;"
+        )
+        row = cur.fetchone()
+        return row["users"], row["version"]
 
 
 def get_user_by_email(
@@ -25,17 +192,26 @@ def get_user_by_email(
     email: str,
     trace_id: str,
     logger: AppLogger,
-) -> Optional[UserInDB]:
+) -> Optional[UserRow]:
     logger.info({"trace_id": trace_id, "email": email})
-    with conn.cursor() as cur:
-        cur.execute(
-            "SELECT id, username, email, code, hashed_password, avatar_url FROM users WHERE email = %s;",
-            (email,),
-        )
-        row = cur.fetchone()
-        if row:
-            return UserInDB(**row)
-        return None
+    with conn.cursor(row_factory=user_row) as cur:
+        execute_statement(cur, "get_user_by_email", {"email": email})
+        return cur.fetchone()
+
+
+def get_user_by_email_ci(
+    conn: Connection,
+    email: str,
+    trace_id: str,
+    logger: AppLogger,
+) -> Optional[UserRow]:
+    """
+    Looks a user up by email ignoring case, through users_email_lower_idx.
+    """
+    logger.info({"trace_id": trace_id, "email": email})
+    with conn.cursor(row_factory=user_row) as cur:
+        execute_statement(cur, "get_user_by_email_ci", (email, email))
+        return cur.fetchone()
 
 
 def get_user_by_id(
@@ -43,17 +219,24 @@ def get_user_by_id(
     user_id: int,
     trace_id: str,
     logger: AppLogger,
-) -> Optional[UserInDB]:
+) -> Optional[UserRow]:
     logger.info({"trace_id": trace_id, "user_id": user_id})
-    with conn.cursor() as cur:
-        cur.execute(
-            "SELECT id, username, email, code, hashed_password, avatar_url FROM users WHERE id = %s;",
-            (user_id,),
-        )
-        row = cur.fetchone()
-        if row:
-            return UserInDB(**row)
-        return None
+    with conn.cursor(row_factory=user_row) as cur:
+        execute_statement(cur, "get_user_by_id", (user_id,))
+        return cur.fetchone()
+
+
+def get_users_by_ids_or_codes(
+    conn: Connection,
+    ids: List[int],
+    codes: List[str],
+    trace_id: str,
+    logger: AppLogger,
+) -> List[UserRow]:
+    logger.info({"trace_id": trace_id, "ids": len(ids), "codes": len(codes)})
+    with conn.cursor(row_factory=user_row) as cur:
+        execute_statement(cur, "get_users_by_ids_or_codes", (list(ids), list(codes)))
+        return cur.fetchall()
 
 
 def create_user(
@@ -65,13 +248,15 @@ def create_user(
 ) -> int:
     logger.info({"trace_id": trace_id, "email": user.email})
     with conn.cursor() as cur:
-        cur.execute(
-            """
-            INSERT INTO users (username, email, code, hashed_password)
-            VALUES (%s, %s, %s, %s)
-            RETURNING id;
-            """,
-            (user.username, user.email, user.code, hashed_password),
+        execute_statement(
+            cur,
+            "create_user",
+            {
+                "username": user.username,
+                "email": user.email,
+                "code": user.code,
+                "hashed_password": hashed_password,
+            },
         )
         row = cur.fetchone()
         if row and "id" in row:
@@ -88,10 +273,7 @@ def update_password(
 ) -> bool:
     logger.info({"trace_id": trace_id, "user_id": user_id})
     with conn.cursor() as cur:
-        cur.execute(
-            "UPDATE users SET hashed_password = %s WHERE id = %s;",
-            (hashed_password, user_id),
-        )
+        execute_statement(cur, "update_password", (hashed_password, user_id))
         if cur.rowcount == 0:
             logger.warning(
                 {"trace_id": trace_id, "user_id": user_id, "message": "User not found"}
@@ -100,22 +282,34 @@ def update_password(
         return True
 
 
+def replace_password_hash(
+    conn: Connection,
+    user_id: int,
+    old_hash: str,
+    new_hash: str,
+    trace_id: str,
+    logger: AppLogger,
+) -> bool:
+    """
+    Stores `new_hash` only if the stored hash is still `old_hash`, so a
+    password changed in the meantime is kept.
+    """
+    logger.info({"trace_id": trace_id, "user_id": user_id})
+    with conn.cursor() as cur:
+        execute_statement(cur, "replace_password_hash", (new_hash, user_id, old_hash))
+        return cur.rowcount == 1
+
+
 def lock_user(
     conn: Connection,
     user_id: int,
     trace_id: str,
     logger: AppLogger,
-) -> Optional[UserInDB]:
+) -> Optional[UserRow]:
     logger.info({"trace_id": trace_id, "id": user_id})
-    with conn.cursor() as cur:
-        cur.execute(
-            "SELECT id, username, email, code, hashed_password, avatar_url FROM users WHERE id = %s FOR UPDATE;",
-            (user_id,),
-        )
-        row = cur.fetchone()
-        if row:
-            return UserInDB(**row)
-        return None
+    with conn.cursor(row_factory=user_row) as cur:
+        execute_statement(cur, "lock_user", (user_id,))
+        return cur.fetchone()
 
 
 def update_avatar_url(
@@ -127,13 +321,160 @@ def update_avatar_url(
 ) -> bool:
     logger.info({"trace_id": trace_id, "user_id": user_id, "avatar_url": avatar_url})
     with conn.cursor() as cur:
-        cur.execute(
-            "UPDATE users SET avatar_url = %s WHERE id = %s;",
-            (avatar_url, user_id),
-        )
+        execute_statement(cur, "update_avatar_url", (avatar_url, user_id))
         if cur.rowcount == 0:
             logger.warning(
                 {"trace_id": trace_id, "user_id": user_id, "message": "User not found"}
             )
             return False
         return True
+
+
+def import_users(
+    conn: Connection,
+    rows: List[Tuple[int, UserCreate, str]],
+    trace_id: str,
+    logger: AppLogger,
+) -> List[Dict[str, Any]]:
+    """
+    Loads one batch of (line, user, hashed_password) through the staging
+    table and returns {"line", "id", "code", "error"} for each row, where
+    rows with an error were not inserted. Runs in a transaction (savepoint
+    if one is open); a unique violation from a concurrent write rolls the
+    whole batch back.
+    """
+    logger.info({"trace_id": trace_id, "rows": len(rows)})
+    if settings.USERS_TABLE_LAYOUT == "partitioned":
+        statements = PARTITIONED_IMPORT_STATEMENTS
+    else:
+        statements = IMPORT_STATEMENTS
+    with conn.transaction(), conn.cursor() as cur:
+        cur.execute(IMPORT_STAGING_TABLE)
+        with cur.copy(
+            "COPY users_import (line, username, email, code, hashed_password) FROM STDIN"
+        ) as copy:
+            for line, user, hashed_password in rows:
+                copy.write_row(
+                    (
+                        line,
+                        user.username,
+                        user.email,
+                        common.generate_user_code(),
+                        hashed_password,
+                    )
+                )
+        for name in IMPORT_CHECKS:
+            cur.execute(statements[name])
+
+        # Codes are random, so conflicts are rare: regenerate only the
+        # conflicting ones until none are left
+        for _ in range(IMPORT_CODE_ATTEMPTS):
+            conflicts = [
+                row["line"] for row in cur.execute(statements["find_code_conflicts"])
+            ]
+            if not conflicts:
+                break
+            cur.execute(
+                statements["set_codes"],
+                (conflicts, [common.generate_user_code() for _ in conflicts]),
+            )
+        else:
+            cur.execute(
+                statements["reject_lines"],
+                (f"No unique code after {IMPORT_CODE_ATTEMPTS} attempts", conflicts),
+            )
+
+        cur.execute(statements["assign_ids"])
+        cur.execute(statements["insert_users"])
+        report = cur.execute(statements["report"]).fetchall()
+        cur.execute("DROP TABLE users_import;")
+    return report
+
+
+def insert_refresh_token(
+    conn: Connection,
+    jti: UUID,
+    family_id: UUID,
+    user_id: int,
+    expires_at: datetime,
+    trace_id: str,
+    logger: AppLogger,
+):
+    logger.info({"trace_id": trace_id, "user_id": user_id})
+    with conn.cursor() as cur:
+        execute_statement(
+            cur, "insert_refresh_token", (jti, family_id, user_id, expires_at)
+        )
+
+
+def rotate_refresh_token(
+    conn: Connection,
+    jti: UUID,
+    new_jti: UUID,
+    expires_at: datetime,
+    trace_id: str,
+    logger: AppLogger,
+) -> Optional[UserRow]:
+    logger.info({"trace_id": trace_id})
+    with conn.cursor(row_factory=user_row) as cur:
+        execute_statement(
+            cur,
+            "rotate_refresh_token",
+            {"jti": jti, "new_jti": new_jti, "expires_at": expires_at},
+        )
+        return cur.fetchone()
+
+
+def get_refresh_token(
+    conn: Connection, jti: UUID, trace_id: str, logger: AppLogger
+) -> Optional[Dict[str, Any]]:
+    logger.info({"trace_id": trace_id})
+    with conn.cursor() as cur:
+        execute_statement(cur, "get_refresh_token", (jti,))
+        return cur.fetchone()
+
+
+def revoke_token_family(
+    conn: Connection, family_id: UUID, trace_id: str, logger: AppLogger
+) -> int:
+    logger.info({"trace_id": trace_id, "family_id": str(family_id)})
+    with conn.cursor() as cur:
+        execute_statement(cur, "revoke_token_family", (family_id,))
+        return cur.rowcount
+
+
+def is_token_family_revoked(
+    conn: Connection, family_id: UUID, trace_id: str, logger: AppLogger
+) -> bool:
+    logger.info({"trace_id": trace_id, "family_id": str(family_id)})
+    with conn.cursor() as cur:
+        execute_statement(cur, "is_token_family_revoked", (family_id,))
+        return cur.fetchone()["revoked"]
+
+
+def purge_expired_refresh_tokens(
+    conn: Connection, limit: int, trace_id: str, logger: AppLogger
+) -> int:
+    """
+    Deletes up to `limit` refresh tokens past their expiry and returns how
+    many. Their JWTs no longer verify, so the rows are never read again.
+    """
+    logger.info({"trace_id": trace_id, "limit": limit})
+    with conn.cursor() as cur:
+        execute_statement(cur, "purge_expired_refresh_tokens", (limit,))
+        return cur.rowcount
+
+
+def get_revoked_token_families(
+    conn: Connection, since: Optional[datetime], trace_id: str, logger: AppLogger
+) -> List[Tuple[UUID, datetime]]:
+    """
+    Families revoked after `since`, or all those with unexpired tokens.
+    """
+    logger.info({"trace_id": trace_id})
+    with conn.cursor() as cur:
+        if since is None:
+            execute_statement(cur, "get_live_revoked_token_families", ())
+        else:
+            execute_statement(cur, "get_revoked_token_families", (since,))
+        return [(row["family_id"], row["revoked_at"]) for row in cur.fetchall()]
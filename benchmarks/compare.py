@@ -0,0 +1,46 @@
+"""
+Compares two saved benchmark result files scenario by scenario.
+
+Usage:
+    uv run python -m benchmarks.compare benchmarks/results/loadtest-A.json benchmarks/results/loadtest-B.json
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+METRICS = ("rps", "p50_ms", "p95_ms", "p99_ms", "errors")
+
+
+def _delta(before: float, after: float) -> str:
+    if not before:
+        return "n/a"
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("candidate", type=Path)
+    args = parser.parse_args()
+
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+    candidate = json.loads(args.candidate.read_text(encoding="utf-8"))
+    print(
+        f"baseline {baseline.get('git_revision')} vs "
+        f"candidate {candidate.get('git_revision')}"
+    )
+    header = f"{'scenario':<18}" + "".join(f"{metric:>24}" for metric in METRICS)
+    print(header)
+    for name, before in baseline["scenarios"].items():
+        after = candidate["scenarios"].get(name)
+        if after is None:
+            continue
+        cells = "".join(
+            f"{f'{after[m]} ({_delta(before[m], after[m])})':>24}" for m in METRICS
+        )
+        print(f"{name:<18}{cells}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Bandwidth and latency of GET /users per response encoding.
+
+Fetches a large synthetic listing through the app with each Accept-Encoding
+the server can produce, and reports the bytes on the wire, the server-side
+latency (compression included) and the transfer time those bytes would take
+at --mbps. No database is needed: the storage call is replaced by synthetic
+rows.
+
+Usage:
+    uv run python -m benchmarks.compression --rows 10000 --repeat 20 --mbps 50
+"""
+
+import argparse
+import json
+import time
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+from app.database import get_read_connection_provider
+from app.main import app
+from app.middleware.compression import available_encodings
+from app.settings import settings
+
+from .common import summarize
+
+
+def _rows(count: int):
+    updated_at = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return [
+        {
+            "id": i,
+            "username": f"user_{i}",
+            "email": f"user_{i}@example.com",
+            "code": f"{i:07d}",
+            "avatar_url": None if i % 2 else f"https://cdn.example.com/{i}.png",
+            "updated_at": updated_at,
+        }
+        for i in range(1, count + 1)
+    ]
+
+
+def _fetch(client: TestClient, accept_encoding: str) -> int:
+    with client.stream(
+        "GET", "/users/", headers={"Accept-Encoding": accept_encoding}
+    ) as response:
+        return sum(len(chunk) for chunk in response.iter_raw())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument(
+        "--mbps", type=float, default=50.0, help="Link speed for transfer times"
+    )
+    args = parser.parse_args()
+
+    encodings = ["identity"] + available_encodings(
+        settings.COMPRESSION_ENCODINGS.split(",")
+    )
+    results = {}
+    app.dependency_overrides[get_read_connection_provider] = lambda: (
+        lambda: nullcontext(None)
+    )
+    with patch(
+        "app.users.storage.get_public_users", return_value=_rows(args.rows)
+    ), patch(
+        "app.users.storage.get_public_users_version", return_value=(args.rows, 0)
+    ), patch("app.main.settings.MIGRATIONS_ON_STARTUP", new="off"), TestClient(
+        app
+    ) as client:
+        for encoding in encodings:
+            latencies = []
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                size = _fetch(client, encoding)
+                latencies.append(time.perf_counter() - t0)
+            transfer = size * 8 / (args.mbps * 1e6)
+            results[encoding] = {
+                "bytes": size,
+                "transfer_seconds": round(transfer, 4),
+                "latency": summarize(latencies),
+            }
+    app.dependency_overrides.clear()
+
+    identity = results["identity"]["bytes"]
+    for result in results.values():
+        result["ratio"] = round(identity / result["bytes"], 2)
+    print(
+        json.dumps({"rows": args.rows, "mbps": args.mbps, "results": results}, indent=2)
+    )
+
+
+if __name__ == "__main__":
+    main()
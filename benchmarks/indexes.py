@@ -0,0 +1,202 @@
+"""
+Plans and latency of the users access paths before and after the
+002_users_access_path_indexes migration.
+
+Seeds a scratch schema migrated to 001 (10% of the users inactive), measures
+the auth lookup by email, the case-insensitive login lookup and the users
+listing, then applies the remaining migrations and measures again.
+Each query reports its EXPLAIN (ANALYZE, BUFFERS) plan nodes, heap fetches
+and buffers, plus client-side latency through the storage functions.
+
+Usage:
+    uv run python -m benchmarks.indexes --users 1000000 --lookups 2000
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from typing import Union
+
+import psycopg
+from psycopg.rows import dict_row
+
+from app.core.migrations import migrate
+from app.users import storage as user_storage
+
+from .common import (
+    get_benchmark_database_url,
+    summarize,
+    temporary_schema,
+    write_results,
+)
+
+# A realistic hash width keeps the heap (and the covering index) honest
+HASH = "$pbkdf2-sha256$29000$" + "x" * 66
+
+
+class _NullLogger:
+    """Keeps log I/O out of the measured latency."""
+
+    def info(self, message: dict):
+        pass
+
+    def warning(self, message: dict):
+        pass
+
+    def error(self, message: dict):
+        pass
+
+
+def _seed(conn: psycopg.Connection, users: int):
+    conn.execute(
+        """
+        INSERT INTO users (username, email, code, hashed_password, is_active)
+        SELECT 'user_' || i, 'user_' || i || '@example.com',
+               lpad(i::text, 7, '0'), %s, i %% 10 <> 0
+        FROM generate_series(1, %s) AS i;
+        """,
+        (HASH, users),
+    )
+    conn.commit()
+
+
+def _vacuum(conn: psycopg.Connection):
+    # Index-only scans need an up-to-date visibility map
+    conn.autocommit = True
+    conn.execute("VACUUM (ANALYZE) users;")
+    conn.autocommit = False
+
+
+def _walk(node: dict):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _walk(child)
+
+
+def _explain(conn: psycopg.Connection, query: str, params: Union[tuple, dict]) -> dict:
+    row = conn.execute(
+        f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}", params
+    ).fetchone()
+    plan = row["QUERY PLAN"][0]
+    nodes = list(_walk(plan["Plan"]))
+    return {
+        "nodes": [
+            f"{node['Node Type']}"
+            + (f" using {node['Index Name']}" if "Index Name" in node else "")
+            for node in nodes
+        ],
+        "heap_fetches": sum(node.get("Heap Fetches", 0) for node in nodes),
+        "shared_buffers": plan["Plan"].get("Shared Hit Blocks", 0)
+        + plan["Plan"].get("Shared Read Blocks", 0),
+        "execution_ms": round(plan["Execution Time"], 4),
+    }
+
+
+def _time(fn, repeat: int, budget: float):
+    """
+    Runs `fn` up to `repeat` times, stopping early once `budget` seconds are
+    spent (sequential scans over 1M rows take a while).
+    """
+    latencies = []
+    deadline = time.perf_counter() + budget
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t0)
+        if t0 > deadline:
+            break
+    return summarize(latencies)
+
+
+def _measure(
+    conn: psycopg.Connection, users: int, lookups: int, listings: int, budget: float
+):
+    logger = _NullLogger()
+    sample = f"user_{users // 2 + 1}@example.com"
+    statements = user_storage.get_statements()
+    results = {
+        "get_user_by_email": {
+            "plan": _explain(conn, statements["get_user_by_email"], {"email": sample}),
+            "latency": _time(
+                lambda: user_storage.get_user_by_email(
+                    conn,
+                    f"user_{random.randint(1, users)}@example.com",
+                    "bench",
+                    logger,
+                ),
+                lookups,
+                budget,
+            ),
+        },
+        "get_user_by_email_ci": {
+            "plan": _explain(
+                conn, statements["get_user_by_email_ci"], (sample.upper(),) * 2
+            ),
+            "latency": _time(
+                lambda: user_storage.get_user_by_email_ci(
+                    conn,
+                    f"USER_{random.randint(1, users)}@Example.com",
+                    "bench",
+                    logger,
+                ),
+                lookups,
+                budget,
+            ),
+        },
+        "get_public_users": {
+            "plan": _explain(
+                conn,
+                "SELECT id, username, email, code, avatar_url FROM users ORDER BY id;",
+                (),
+            ),
+            "latency": _time(
+                lambda: user_storage.get_public_users(conn, "bench", logger),
+                listings,
+                budget,
+            ),
+        },
+    }
+    conn.rollback()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--listings", type=int, default=3)
+    parser.add_argument(
+        "--budget", type=float, default=20.0, help="Max seconds per access path"
+    )
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    database_url = get_benchmark_database_url()
+    results = {}
+    with psycopg.connect(database_url, row_factory=dict_row) as conn:
+        with temporary_schema(conn, target=1):
+            print(f"seeding {args.users} users", file=sys.stderr)
+            _seed(conn, args.users)
+            _vacuum(conn)
+            results["before"] = _measure(
+                conn, args.users, args.lookups, args.listings, args.budget
+            )
+
+            t0 = time.perf_counter()
+            migrate(conn)
+            results["migration_seconds"] = round(time.perf_counter() - t0, 2)
+            _vacuum(conn)
+            results["after"] = _measure(
+                conn, args.users, args.lookups, args.listings, args.budget
+            )
+
+    output = {"config": vars(args), "results": results}
+    print(json.dumps(output, indent=2))
+    if not args.no_save:
+        print(f"saved {write_results('indexes', output)}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+"""
+Load test for the auth and user endpoints.
+
+Seeds a dataset of users, then drives each scenario with a fixed number of
+requests at the given concurrency and reports RPS and p50/p95/p99 latency.
+Results are saved as JSON under benchmarks/results/ (tagged with the git
+revision) for comparison with `python -m benchmarks.compare`.
+
+With --spawn, the app runs in a uvicorn subprocess against a throwaway
+database (created from BENCH_DATABASE_URL/TEST_DATABASE_URL and dropped
+afterwards) and a local S3 stand-in for avatar uploads.
+
+Usage:
+    uv run python -m benchmarks.loadtest --spawn --users 200 --requests 1000 --concurrency 32
+    uv run python -m benchmarks.loadtest --base-url http://127.0.0.1:8000 --scenarios login,users_me
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List
+
+import httpx
+
+from .common import summarize, throwaway_database, write_results
+from .s3_stub import start_s3_stub
+
+PASSWORDS = ("loadtest-password-a", "loadtest-password-b")
+
+
+@dataclass
+class Account:
+    email: str
+    password: str
+    access_token: str = ""
+    refresh_token: str = ""
+
+
+@dataclass
+class LoadState:
+    accounts: List[Account] = field(default_factory=list)
+    # Accounts whose password changes are exclusive to one request at a time
+    password_queue: asyncio.Queue = None
+    # Refresh tokens rotate on use: two requests presenting the same one
+    # would look like a stolen token and revoke the account's tokens
+    refresh_queue: asyncio.Queue = None
+    avatar: bytes = b"\x89PNG\r\n\x1a\n" + b"\x00" * 2048
+
+
+def _bearer(account: Account) -> Dict[str, str]:
+    return {"Authorization": f"Bearer {account.access_token}"}
+
+
+async def _register(client: httpx.AsyncClient, email: str, password: str):
+    return await client.post(
+        "/register",
+        json={"username": email.split("@")[0], "email": email, "password": password},
+    )
+
+
+async def _login(client: httpx.AsyncClient, account: Account):
+    response = await client.post(
+        "/login", data={"username": account.email, "password": account.password}
+    )
+    if response.status_code == 200:
+        tokens = response.json()
+        account.access_token = tokens["access_token"]
+        account.refresh_token = tokens["refresh_token"]
+    return response
+
+
+async def scenario_register(client, state: LoadState):
+    email = f"lt_{uuid.uuid4().hex[:12]}@example.com"
+    return await _register(client, email, PASSWORDS[0])
+
+
+async def scenario_login(client, state: LoadState):
+    account = random.choice(state.accounts)
+    return await client.post(
+        "/login", data={"username": account.email, "password": account.password}
+    )
+
+
+async def refresh_account(client: httpx.AsyncClient, account: Account, **request):
+    response = await client.request(**request)
+    if response.status_code == 200:
+        tokens = response.json()
+        account.access_token = tokens["access_token"]
+        account.refresh_token = tokens["refresh_token"]
+    return response
+
+
+async def scenario_refresh(client, state: LoadState):
+    account = await state.refresh_queue.get()
+    try:
+        return await refresh_account(
+            client,
+            account,
+            method="POST",
+            url="/refresh",
+            json={"refresh_token": account.refresh_token},
+        )
+    finally:
+        state.refresh_queue.put_nowait(account)
+
+
+async def scenario_users_me(client, state: LoadState):
+    return await client.get("/users/me", headers=_bearer(random.choice(state.accounts)))
+
+
+async def scenario_users_list(client, state: LoadState):
+    return await client.get("/users/")
+
+
+async def scenario_update_password(client, state: LoadState):
+    account = await state.password_queue.get()
+    try:
+        new_password = (
+            PASSWORDS[1] if account.password == PASSWORDS[0] else PASSWORDS[0]
+        )
+        response = await client.post(
+            "/update-password",
+            headers=_bearer(account),
+            json={"old_password": account.password, "new_password": new_password},
+        )
+        if response.status_code == 200:
+            account.password = new_password
+        return response
+    finally:
+        state.password_queue.put_nowait(account)
+
+
+async def scenario_avatar_upload(client, state: LoadState):
+    return await client.post(
+        "/users/me/avatar",
+        headers=_bearer(random.choice(state.accounts)),
+        files={"file": ("avatar.png", state.avatar, "image/png")},
+    )
+
+
+SCENARIOS: Dict[str, Callable[[httpx.AsyncClient, LoadState], Awaitable]] = {
+    "register": scenario_register,
+    "login": scenario_login,
+    "refresh": scenario_refresh,
+    "users_me": scenario_users_me,
+    "users_list": scenario_users_list,
+    "update_password": scenario_update_password,
+    "avatar_upload": scenario_avatar_upload,
+}
+
+
+async def _drive(client, state: LoadState, scenario, requests: int, concurrency: int):
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            t0 = time.perf_counter()
+            try:
+                response = await scenario(client, state)
+                statuses[response.status_code] = (
+                    statuses.get(response.status_code, 0) + 1
+                )
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - t0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        **summarize(latencies),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "errors": errors,
+        "status_codes": {str(code): count for code, count in sorted(statuses.items())},
+    }
+
+
+async def seed_accounts(client, users: int, concurrency: int) -> LoadState:
+    state = LoadState(password_queue=asyncio.Queue(), refresh_queue=asyncio.Queue())
+    run_id = uuid.uuid4().hex[:6]
+    accounts = [
+        Account(email=f"seed_{run_id}_{i}@example.com", password=PASSWORDS[0])
+        for i in range(users)
+    ]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def seed_one(account: Account):
+        async with semaphore:
+            await _register(client, account.email, account.password)
+            await _login(client, account)
+
+    await asyncio.gather(*(seed_one(account) for account in accounts))
+    state.accounts = [account for account in accounts if account.access_token]
+    if not state.accounts:
+        raise RuntimeError("Seeding failed: no account could log in")
+    for account in state.accounts:
+        state.password_queue.put_nowait(account)
+        state.refresh_queue.put_nowait(account)
+    return state
+
+
+async def run_load_test(
+    base_url: str,
+    scenarios: List[str],
+    users: int,
+    requests: int,
+    concurrency: int,
+) -> dict:
+    limits = httpx.Limits(
+        max_connections=concurrency, max_keepalive_connections=concurrency
+    )
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=60
+    ) as client:
+        state = await seed_accounts(client, users, concurrency)
+        results = {}
+        for name in scenarios:
+            results[name] = await _drive(
+                client, state, SCENARIOS[name], requests, concurrency
+            )
+            print(f"{name}: {json.dumps(results[name])}", file=sys.stderr)
+        return results
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def spawned_app(workers: int):
+    """
+    Runs the app in uvicorn against a throwaway database and S3 stand-in.
+    """
+    with ExitStack() as stack:
+        database_url = stack.enter_context(throwaway_database())
+        s3 = start_s3_stub()
+        stack.callback(s3.shutdown)
+        s3_url = f"http://127.0.0.1:{s3.server_address[1]}"
+        port = _free_port()
+        env = {
+            **os.environ,
+            "DATABASE_URL": database_url,
+            "ENV": "production",
+            "R2_ENDPOINT_URL": s3_url,
+            "R2_PUBLIC_BASE_URL": s3_url,
+            "R2_BUCKET_NAME": os.getenv("R2_BUCKET_NAME", "loadtest"),
+            "R2_ACCESS_KEY_ID": "loadtest",
+            "R2_SECRET_ACCESS_KEY": "loadtest",
+            # Every simulated client logs in from 127.0.0.1
+            "LOGIN_RATE_LIMIT_BACKEND": "off",
+        }
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "app.main:app",
+                "--port",
+                str(port),
+                "--workers",
+                str(workers),
+                "--log-level",
+                "warning",
+            ],
+            env=env,
+            stdout=subprocess.DEVNULL,
+        )
+        stack.callback(process.wait, 30)
+        stack.callback(process.terminate)
+        base_url = f"http://127.0.0.1:{port}"
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                if httpx.get(f"{base_url}/", timeout=1).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if process.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError("uvicorn did not start")
+            time.sleep(0.2)
+        yield base_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--spawn", action="store_true")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--scenarios",
+        default=",".join(SCENARIOS),
+        help=f"Comma-separated subset of: {', '.join(SCENARIOS)}",
+    )
+    parser.add_argument("--users", type=int, default=100, help="Seeded accounts")
+    parser.add_argument("--requests", type=int, default=500, help="Per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    def run(base_url: str) -> dict:
+        return asyncio.run(
+            run_load_test(
+                base_url, scenarios, args.users, args.requests, args.concurrency
+            )
+        )
+
+    if args.spawn:
+        with spawned_app(args.workers) as base_url:
+            results = run(base_url)
+    else:
+        results = run(args.base_url)
+
+    output = {
+        "config": {
+            "users": args.users,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "workers": args.workers if args.spawn else None,
+        },
+        "scenarios": results,
+    }
+    print(json.dumps(output, indent=2))
+    if not args.no_save:
+        print(f"saved {write_results('loadtest', output)}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+Lookup and insert latency of the heap and hash-partitioned users layouts.
+
+For each USERS_TABLE_LAYOUT, seeds a scratch schema migrated with that layout
+(the partitioned one also fills the email, username and code lookup tables),
+then measures the storage functions: lookups by email (exact and
+case-insensitive), by id and a batch of ids and codes, plus create_user
+committed one row at a time. Each lookup also reports how many users
+partitions its plan actually executed.
+
+Usage:
+    uv run python -m benchmarks.partitioning --users 5000000 --lookups 5000
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from typing import Union
+from unittest.mock import patch
+
+import psycopg
+from psycopg.rows import dict_row
+
+from app.settings import settings
+from app.users import storage as user_storage
+from app.users.models import UserCreate
+
+from .common import (
+    get_benchmark_database_url,
+    summarize,
+    temporary_schema,
+    write_results,
+)
+from .indexes import HASH, _NullLogger, _vacuum, _walk
+
+LAYOUTS = ("heap", "partitioned")
+
+
+def _seed(conn: psycopg.Connection, users: int, layout: str):
+    conn.execute(
+        """
+        INSERT INTO users (username, email, code, hashed_password)
+        SELECT 'user_' || i, 'user_' || i || '@example.com',
+               lpad(i::text, 7, '0'), %s
+        FROM generate_series(1, %s) AS i;
+        """,
+        (HASH, users),
+    )
+    if layout == "partitioned":
+        conn.execute("INSERT INTO user_emails SELECT email, id FROM users;")
+        conn.execute("INSERT INTO user_usernames SELECT username, id FROM users;")
+        conn.execute("INSERT INTO user_codes SELECT code, id FROM users;")
+    conn.commit()
+    # Later inserts start after the seeded ids
+    conn.execute(
+        "SELECT setval(pg_get_serial_sequence('users', 'id'), max(id)) FROM users;"
+    )
+    conn.commit()
+
+
+def _scanned_partitions(
+    conn: psycopg.Connection, query: str, params: Union[tuple, dict]
+) -> int:
+    row = conn.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {query}", params).fetchone()
+    return sum(
+        1
+        for node in _walk(row["QUERY PLAN"][0]["Plan"])
+        if node.get("Relation Name", "").startswith("users")
+        and node.get("Actual Loops", 0) > 0
+    )
+
+
+def _time(fn, repeat: int):
+    latencies = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t0)
+    return summarize(latencies)
+
+
+def _measure(conn: psycopg.Connection, users: int, lookups: int, inserts: int):
+    logger = _NullLogger()
+    statements = user_storage.get_statements()
+    sample = users // 2 + 1
+    batch = 50
+
+    def email():
+        return f"user_{random.randint(1, users)}@example.com"
+
+    def ids_and_codes():
+        return (
+            [random.randint(1, users) for _ in range(batch)],
+            [str(random.randint(1, users)).zfill(7) for _ in range(batch)],
+        )
+
+    results = {
+        "get_user_by_email": {
+            "partitions_scanned": _scanned_partitions(
+                conn,
+                statements["get_user_by_email"],
+                {"email": f"user_{sample}@example.com"},
+            ),
+            "latency": _time(
+                lambda: user_storage.get_user_by_email(conn, email(), "bench", logger),
+                lookups,
+            ),
+        },
+        "get_user_by_email_ci": {
+            "partitions_scanned": _scanned_partitions(
+                conn,
+                statements["get_user_by_email_ci"],
+                (f"USER_{sample}@example.com",) * 2,
+            ),
+            "latency": _time(
+                lambda: user_storage.get_user_by_email_ci(
+                    conn, email().upper(), "bench", logger
+                ),
+                lookups,
+            ),
+        },
+        "get_user_by_id": {
+            "partitions_scanned": _scanned_partitions(
+                conn, statements["get_user_by_id"], (sample,)
+            ),
+            "latency": _time(
+                lambda: user_storage.get_user_by_id(
+                    conn, random.randint(1, users), "bench", logger
+                ),
+                lookups,
+            ),
+        },
+        f"get_users_by_ids_or_codes_{batch}+{batch}": {
+            "partitions_scanned": _scanned_partitions(
+                conn, statements["get_users_by_ids_or_codes"], ids_and_codes()
+            ),
+            "latency": _time(
+                lambda: user_storage.get_users_by_ids_or_codes(
+                    conn, *ids_and_codes(), "bench", logger
+                ),
+                lookups // 10,
+            ),
+        },
+    }
+    conn.rollback()
+
+    def insert():
+        i = next(counter)
+        user = UserCreate(
+            username=f"new_{i}", email=f"new_{i}@example.com", password="password"
+        )
+        user.code = f"N{i:06d}"
+        user_storage.create_user(conn, user, HASH, "bench", logger)
+        conn.commit()
+
+    counter = iter(range(inserts))
+    results["create_user"] = {"latency": _time(insert, inserts)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=5_000_000)
+    parser.add_argument("--lookups", type=int, default=5000)
+    parser.add_argument("--inserts", type=int, default=2000)
+    parser.add_argument("--layouts", nargs="+", choices=LAYOUTS, default=LAYOUTS)
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    database_url = get_benchmark_database_url()
+    results = {}
+    with psycopg.connect(database_url, row_factory=dict_row) as conn:
+        for layout in args.layouts:
+            with patch.object(settings, "USERS_TABLE_LAYOUT", layout):
+                with temporary_schema(conn):
+                    print(f"seeding {args.users} users ({layout})", file=sys.stderr)
+                    t0 = time.perf_counter()
+                    _seed(conn, args.users, layout)
+                    _vacuum(conn)
+                    seed_seconds = round(time.perf_counter() - t0, 2)
+                    results[layout] = {
+                        "seed_seconds": seed_seconds,
+                        **_measure(conn, args.users, args.lookups, args.inserts),
+                    }
+
+    output = {"config": vars(args), "results": results}
+    print(json.dumps(output, indent=2))
+    if not args.no_save:
+        print(f"saved {write_results('partitioning', output)}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Per-lookup latency of the hot user queries with and without server-side
+prepared statements.
+
+Usage:
+    uv run python -m benchmarks.prepared_statements --users 10000 --lookups 5000
+"""
+
+import argparse
+import json
+import random
+import time
+
+import psycopg
+from psycopg.rows import dict_row
+
+from app.settings import settings
+from app.users import storage as user_storage
+
+from .common import get_benchmark_database_url, summarize, temporary_schema
+
+
+class _NullLogger:
+    """Keeps log I/O out of the measured latency."""
+
+    def info(self, message: dict):
+        pass
+
+    def warning(self, message: dict):
+        pass
+
+    def error(self, message: dict):
+        pass
+
+
+def _seed(conn: psycopg.Connection, users: int):
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO users (username, email, code, hashed_password)
+            SELECT 'user_' || i, 'user_' || i || '@example.com',
+                   lpad(i::text, 7, '0'), 'hashed'
+            FROM generate_series(1, %s) AS i;
+            """,
+            (users,),
+        )
+    conn.commit()
+
+
+def _run(conn: psycopg.Connection, users: int, lookups: int, prepared: bool):
+    settings.DB_PREPARED_STATEMENTS = prepared
+    logger = _NullLogger()
+    by_email, by_id = [], []
+    for _ in range(lookups):
+        i = random.randint(1, users)
+        t0 = time.perf_counter()
+        user_storage.get_user_by_email(conn, f"user_{i}@example.com", "bench", logger)
+        by_email.append(time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        user_storage.get_user_by_id(conn, i, "bench", logger)
+        by_id.append(time.perf_counter() - t0)
+    conn.rollback()
+    return {
+        "get_user_by_email": summarize(by_email),
+        "get_user_by_id": summarize(by_id),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--lookups", type=int, default=5000)
+    args = parser.parse_args()
+
+    database_url = get_benchmark_database_url()
+    results = {}
+    with psycopg.connect(database_url, row_factory=dict_row) as setup_conn:
+        with temporary_schema(setup_conn) as schema_name:
+            _seed(setup_conn, args.users)
+            for mode, prepared in (("prepared", True), ("unprepared", False)):
+                # Mirrors get_connection_kwargs(): no automatic preparation
+                # when prepared statements are switched off.
+                kwargs = {} if prepared else {"prepare_threshold": None}
+                with psycopg.connect(
+                    database_url, row_factory=dict_row, **kwargs
+                ) as conn:
+                    conn.execute(f"SET search_path TO {schema_name};")
+                    conn.commit()
+                    results[mode] = _run(conn, args.users, args.lookups, prepared)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Concurrent avatar uploads: boto3 on the default executor vs the async client.
+
+Runs the local S3 stand-in, in its own process, with a per-upload delay
+standing in for the network, then uploads --uploads files of --size bytes, --concurrency at a
+time, through each path. Reports the wall time, per-upload latency and the
+peak number of threads the process used.
+
+Usage:
+    uv run python -m benchmarks.r2_upload --uploads 500 --concurrency 200 --delay-ms 50
+"""
+
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import threading
+import time
+
+import boto3
+from botocore.client import Config
+
+from app.core.r2_storage import AsyncR2Client
+
+from .common import summarize
+from .s3_stub import spawned_s3_stub
+
+BUCKET = "bench"
+
+
+class ThreadPeak:
+    """
+    Samples the process's thread count on a background thread.
+    """
+
+    def __init__(self):
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(0.005):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+async def _run(upload, count: int, concurrency: int):
+    slots = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i: int):
+        async with slots:
+            t0 = time.perf_counter()
+            await upload(i)
+            latencies.append(time.perf_counter() - t0)
+
+    with ThreadPeak() as threads:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(count)))
+        elapsed = time.perf_counter() - t0
+    return {
+        "seconds": round(elapsed, 3),
+        "uploads_per_second": round(count / elapsed, 1),
+        "peak_threads": threads.peak,
+        "latency": summarize(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--uploads", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--size", type=int, default=64 * 1024)
+    parser.add_argument("--delay-ms", type=float, default=50.0)
+    parser.add_argument(
+        "--max-concurrency", type=int, default=16, help="R2_MAX_CONCURRENCY"
+    )
+    args = parser.parse_args()
+
+    with spawned_s3_stub(args.delay_ms / 1000) as endpoint:
+        data = bytes(range(256)) * (args.size // 256)
+        sha256 = hashlib.sha256(data).hexdigest()
+
+        boto_client = boto3.client(
+            "s3",
+            endpoint_url=endpoint,
+            aws_access_key_id="bench",
+            aws_secret_access_key="bench",
+            config=Config(signature_version="s3v4"),
+            region_name="auto",
+        )
+
+        async def boto3_upload(i: int):
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(
+                None,
+                lambda: boto_client.upload_fileobj(
+                    io.BytesIO(data), BUCKET, f"boto/{i}"
+                ),
+            )
+
+        async_client = AsyncR2Client(
+            "bench", endpoint, "bench", "bench", "auto", args.max_concurrency, 60.0
+        )
+
+        async def async_upload(i: int):
+            await async_client.put_object(
+                BUCKET, f"async/{i}", io.BytesIO(data), len(data), sha256=sha256
+            )
+
+        async def run_all():
+            results = {
+                "boto3_default_executor": await _run(
+                    boto3_upload, args.uploads, args.concurrency
+                ),
+                "async_client": await _run(
+                    async_upload, args.uploads, args.concurrency
+                ),
+            }
+            await async_client.aclose()
+            return results
+
+        results = asyncio.run(run_all())
+    print(
+        json.dumps(
+            {
+                "uploads": args.uploads,
+                "concurrency": args.concurrency,
+                "size": args.size,
+                "delay_ms": args.delay_ms,
+                "results": results,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Replays captured traffic (TRAFFIC_CAPTURE_PATH) against a local instance and
+compares the replayed latency distribution per route with the recorded one.
+
+Captured bodies have credentials redacted, so the replay seeds its own
+accounts and fills redacted fields, bearer tokens and login usernames from
+them. Multipart bodies are replaced by random bytes of the recorded size.
+
+Requests are sent at the recorded pace divided by --speed (2 = twice as
+fast), or as fast as --concurrency allows with --speed 0.
+
+Usage:
+    uv run python -m benchmarks.replay logs/traffic.jsonl --spawn --speed 1
+    uv run python -m benchmarks.replay logs/traffic.jsonl --base-url http://127.0.0.1:8000 --speed 4
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import httpx
+
+from app.core.redaction import PASSWORD_KEYS
+
+from .common import summarize, write_results
+from .loadtest import Account, LoadState, refresh_account, seed_accounts, spawned_app
+
+REDACTED = "[REDACTED]"
+
+
+def load_capture(path: Path) -> List[dict]:
+    with path.open(encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return sorted(records, key=lambda record: record["timestamp"])
+
+
+def route_of(record: dict) -> str:
+    return f"{record['method']} {record['path']}"
+
+
+def _fill(values: Dict[str, str], record: dict, account: Account) -> Dict[str, str]:
+    filled = dict(values)
+    for key, value in values.items():
+        lowered = key.lower()
+        if lowered in PASSWORD_KEYS:
+            # Setting the same password keeps the seeded account usable
+            filled[key] = account.password
+        elif lowered == "email":
+            if record["path"] == "/register":
+                filled[key] = f"replay_{uuid.uuid4().hex[:12]}@example.com"
+            else:
+                filled[key] = account.email
+        elif lowered == "refresh_token":
+            filled[key] = account.refresh_token
+        elif lowered == "username" and record["path"] == "/login":
+            filled[key] = account.email
+        elif lowered == "username" and record["path"] == "/register":
+            filled[key] = f"replay_{uuid.uuid4().hex[:12]}"
+        elif value == REDACTED:
+            filled[key] = account.password
+    return filled
+
+
+def build_request(record: dict, account: Account) -> dict:
+    """
+    Turns a captured record into httpx.request() keyword arguments.
+    """
+    request = {"method": record["method"], "url": record["path"], "headers": {}}
+    if record.get("query"):
+        request["url"] = f"{record['path']}?{record['query']}"
+    if record.get("authenticated"):
+        request["headers"]["Authorization"] = f"Bearer {account.access_token}"
+
+    body = record.get("body") or {}
+    content_type = record.get("content_type", "")
+    if "multipart/form-data" in content_type:
+        # Roughly the file size: the capture holds the whole multipart body
+        size = max(record.get("content_length", 0) - 200, 1)
+        request["files"] = {
+            "file": ("replay.png", os.urandom(size), "application/octet-stream")
+        }
+    elif isinstance(body, dict) and "form_data" in body:
+        request["data"] = _fill(body["form_data"], record, account)
+    elif isinstance(body, dict) and body and "detail" not in body:
+        request["json"] = _fill(body, record, account)
+    elif body and not isinstance(body, dict):
+        request["json"] = body
+    return request
+
+
+async def replay(
+    client: httpx.AsyncClient,
+    records: List[dict],
+    state: LoadState,
+    speed: float,
+    concurrency: int,
+) -> Tuple[Dict[str, List[float]], Dict[str, int]]:
+    """
+    Sends the records and returns replayed latencies per route, plus how many
+    responses per route had a different status code than when captured.
+    """
+    latencies: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    origin = records[0]["timestamp"]
+    started = time.perf_counter()
+
+    async def send(record: dict):
+        if speed > 0:
+            delay = (record["timestamp"] - origin) / speed
+            await asyncio.sleep(max(0.0, delay - (time.perf_counter() - started)))
+        async with semaphore:
+            # An account's refresh token is replaced by each refresh, so
+            # refreshes take the account for themselves
+            refresh = record["path"] == "/refresh"
+            if refresh:
+                account = await state.refresh_queue.get()
+            else:
+                account = random.choice(state.accounts)
+            request = build_request(record, account)
+            t0 = time.perf_counter()
+            route = route_of(record)
+            try:
+                if refresh:
+                    response = await refresh_account(client, account, **request)
+                else:
+                    response = await client.request(**request)
+                failed = response.status_code != record["status_code"]
+            except httpx.HTTPError:
+                failed = True
+            finally:
+                if refresh:
+                    state.refresh_queue.put_nowait(account)
+            latencies.setdefault(route, []).append(time.perf_counter() - t0)
+            if failed:
+                errors[route] = errors.get(route, 0) + 1
+
+    await asyncio.gather(*(send(record) for record in records))
+    return latencies, errors
+
+
+def compare(
+    records: List[dict],
+    replayed: Dict[str, List[float]],
+    errors: Dict[str, int],
+) -> dict:
+    recorded: Dict[str, List[float]] = {}
+    for record in records:
+        recorded.setdefault(route_of(record), []).append(record["duration_seconds"])
+    report = {}
+    for route, durations in sorted(recorded.items()):
+        report[route] = {
+            "recorded": summarize(durations),
+            "replayed": summarize(replayed.get(route, [])),
+            "status_mismatches": errors.get(route, 0),
+        }
+    return report
+
+
+async def run_replay(
+    base_url: str,
+    records: List[dict],
+    users: int,
+    speed: float,
+    concurrency: int,
+) -> dict:
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=60
+    ) as client:
+        state = await seed_accounts(client, users, concurrency)
+        replayed, errors = await replay(client, records, state, speed, concurrency)
+    return compare(records, replayed, errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "capture", type=Path, help="JSONL file from TRAFFIC_CAPTURE_PATH"
+    )
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--spawn", action="store_true")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--users", type=int, default=50, help="Seeded accounts")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--limit", type=int, default=None, help="Replay first N")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    records = load_capture(args.capture)[: args.limit]
+    if not records:
+        parser.error(f"{args.capture} has no captured requests")
+
+    def run(base_url: str) -> dict:
+        return asyncio.run(
+            run_replay(base_url, records, args.users, args.speed, args.concurrency)
+        )
+
+    if args.spawn:
+        with spawned_app(args.workers) as base_url:
+            routes = run(base_url)
+    else:
+        routes = run(args.base_url)
+
+    output = {
+        "config": {
+            "capture": str(args.capture),
+            "requests": len(records),
+            "speed": args.speed,
+            "concurrency": args.concurrency,
+        },
+        "routes": routes,
+    }
+    print(json.dumps(output, indent=2))
+    if not args.no_save:
+        print(f"saved {write_results('replay', output)}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Memory needed to load users through the storage and service layers.
+
+"legacy" mirrors the previous path: dict rows -> UserInDB -> User per row.
+"compact" is the current one: UserRow tuples from the storage layer, with
+User models built only at the API boundary.
+
+Usage:
+    uv run python -m benchmarks.row_memory --users 100000
+    uv run python -m benchmarks.row_memory --users 100000 --from-db
+"""
+
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import psycopg
+from psycopg.rows import dict_row
+
+from app.users import services
+from app.users import storage as user_storage
+from app.users.models import User, UserRow
+
+from .common import UserInDB, get_benchmark_database_url, temporary_schema
+
+
+class _NullLogger:
+    """Keeps log I/O out of the measurement."""
+
+    def info(self, message: dict):
+        pass
+
+    def warning(self, message: dict):
+        pass
+
+    def error(self, message: dict):
+        pass
+
+
+def _measure(load):
+    gc.collect()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    result = load()
+    elapsed = time.perf_counter() - t0
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return {
+        "retained_mb": round(current / 1024 / 1024, 2),
+        "peak_mb": round(peak / 1024 / 1024, 2),
+        "seconds": round(elapsed, 3),
+    }
+
+
+def _synthetic_values(count: int):
+    started = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    return [
+        (
+            i,
+            f"user_{i}",
+            f"user_{i}@example.com",
+            f"{i:07d}",
+            "$pbkdf2-sha256$29000$hashedpasswordvalue",
+            None,
+            started + timedelta(seconds=i),
+        )
+        for i in range(1, count + 1)
+    ]
+
+
+def _synthetic(count: int):
+    values = _synthetic_values(count)
+    names = UserRow._fields
+
+    def legacy():
+        rows = [dict(zip(names, row)) for row in values]
+        db_users = [UserInDB(**row) for row in rows]
+        return rows, db_users, [User(**u.model_dump()) for u in db_users]
+
+    def compact_storage():
+        return [UserRow(*row) for row in values]
+
+    def compact():
+        db_users = [UserRow(*row) for row in values]
+        return db_users, [services.to_public_user(u) for u in db_users]
+
+    return {
+        "legacy": _measure(legacy),
+        "compact_storage_only": _measure(compact_storage),
+        "compact": _measure(compact),
+    }
+
+
+def _from_db(count: int):
+    logger = _NullLogger()
+    with psycopg.connect(get_benchmark_database_url(), row_factory=dict_row) as conn:
+        with temporary_schema(conn):
+            conn.execute(
+                """
+                INSERT INTO users (username, email, code, hashed_password)
+                SELECT 'user_' || i, 'user_' || i || '@example.com',
+                       lpad(i::text, 7, '0'), 'hashed'
+                FROM generate_series(1, %s) AS i;
+                """,
+                (count,),
+            )
+            conn.commit()
+
+            def legacy():
+                rows = conn.execute(
+                    "SELECT id, username, email, code, hashed_password, avatar_url FROM users;"
+                ).fetchall()
+                db_users = [UserInDB(**row) for row in rows]
+                return rows, db_users, [User(**u.model_dump()) for u in db_users]
+
+            def compact():
+                db_users = user_storage.get_users(conn, "bench", logger)
+                return db_users, [services.to_public_user(u) for u in db_users]
+
+            return {"legacy": _measure(legacy), "compact": _measure(compact)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--from-db", action="store_true")
+    args = parser.parse_args()
+
+    results = _from_db(args.users) if args.from_db else _synthetic(args.users)
+    print(json.dumps({"users": args.users, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Minimal S3-compatible stand-in for benchmarks: accepts PutObject and serves
+GetObject/HeadObject from memory. Authentication is not checked. With a
+delay, each PutObject waits that long before answering, like a remote store.
+
+Usage:
+    uv run python -m benchmarks.s3_stub --port 9000 --delay-ms 50
+    export R2_ENDPOINT_URL=http://127.0.0.1:9000
+"""
+
+import argparse
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, Tuple
+
+
+class S3StubHandler(BaseHTTPRequestHandler):
+    objects: Dict[str, Tuple[bytes, str]] = {}
+    lock = threading.Lock()
+    protocol_version = "HTTP/1.1"
+    delay_seconds = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        if "aws-chunked" in self.headers.get("Content-Encoding", ""):
+            body = _decode_aws_chunked(body)
+        return body
+
+    def do_PUT(self):
+        body = self._read_body()
+        if self.delay_seconds:
+            time.sleep(self.delay_seconds)
+        with self.lock:
+            self.objects[self.path] = (
+                body,
+                self.headers.get("Content-Type", "binary/octet-stream"),
+            )
+        self.send_response(200)
+        self.send_header("ETag", f'"{len(body):x}"')
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        with self.lock:
+            found = self.objects.get(self.path)
+        if found is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body, content_type = found
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        with self.lock:
+            found = self.objects.get(self.path)
+        self.send_response(200 if found else 404)
+        self.send_header("Content-Length", str(len(found[0]) if found else 0))
+        self.end_headers()
+
+
+class S3StubServer(ThreadingHTTPServer):
+    # The default backlog of 5 drops connections under concurrent uploads
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def _decode_aws_chunked(body: bytes) -> bytes:
+    """
+    Strips the aws-chunked framing boto3 uses for streaming uploads.
+    """
+    data, pos = bytearray(), 0
+    while pos < len(body):
+        line_end = body.index(b"\r\n", pos)
+        size = int(body[pos:line_end].split(b";")[0], 16)
+        if size == 0:
+            break
+        start = line_end + 2
+        data += body[start : start + size]
+        pos = start + size + 2
+    return bytes(data)
+
+
+def start_s3_stub(port: int = 0, delay_seconds: float = 0.0) -> S3StubServer:
+    """
+    Starts the stand-in on a background thread and returns the server.
+    """
+    S3StubHandler.delay_seconds = delay_seconds
+    server = S3StubServer(("127.0.0.1", port), S3StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@contextmanager
+def spawned_s3_stub(delay_seconds: float = 0.0) -> Iterator[str]:
+    """
+    Runs the stand-in in its own process, so its threads stay out of the
+    caller's measurements, and yields its URL.
+    """
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.s3_stub",
+            "--port",
+            "0",
+            "--delay-ms",
+            str(delay_seconds * 1000),
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        yield process.stdout.readline().split()[-1]
+    finally:
+        process.terminate()
+        process.wait(30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--delay-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    S3StubHandler.delay_seconds = args.delay_ms / 1000
+    server = S3StubServer(("127.0.0.1", args.port), S3StubHandler)
+    port = server.server_address[1]
+    print(f"S3 stand-in listening on http://127.0.0.1:{port}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
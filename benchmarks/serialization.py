@@ -0,0 +1,92 @@
+"""
+Serialization cost of GET /users with a large result set.
+
+Compares the previous per-row path (UserInDB -> model_dump() -> User ->
+jsonable_encoder -> json.dumps) with the cached TypeAdapter path, and times
+the full GET /users round trip through the app. No database is needed: the
+storage call is replaced by synthetic rows.
+
+Usage:
+    uv run python -m benchmarks.serialization --rows 10000 --repeat 20
+"""
+
+import argparse
+import json
+import time
+from contextlib import nullcontext
+from unittest.mock import patch
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.testclient import TestClient
+
+from app.database import get_read_connection_provider
+from app.main import app
+from app.users.models import User, users_adapter
+
+from .common import UserInDB, summarize
+
+
+def _rows(count: int):
+    return [
+        {
+            "id": i,
+            "username": f"user_{i}",
+            "email": f"user_{i}@example.com",
+            "code": f"{i:07d}",
+            "hashed_password": "$pbkdf2-sha256$29000$hashed",
+            "avatar_url": None if i % 2 else f"https://cdn.example.com/{i}.png",
+        }
+        for i in range(1, count + 1)
+    ]
+
+
+def _legacy_path(rows) -> bytes:
+    users = [User(**UserInDB(**row).model_dump()) for row in rows]
+    return json.dumps(jsonable_encoder(users)).encode("utf-8")
+
+
+def _adapter_path(rows) -> bytes:
+    return users_adapter.dump_json(users_adapter.validate_python(rows))
+
+
+def _time(fn, repeat: int):
+    latencies = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t0)
+    return summarize(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rows = _rows(args.rows)
+    public_rows = [
+        {key: value for key, value in row.items() if key != "hashed_password"}
+        for row in rows
+    ]
+    results = {
+        "legacy_models_and_json_dumps": _time(lambda: _legacy_path(rows), args.repeat),
+        "cached_type_adapter": _time(lambda: _adapter_path(public_rows), args.repeat),
+    }
+
+    app.dependency_overrides[get_read_connection_provider] = lambda: (
+        lambda: nullcontext(None)
+    )
+    with patch("app.users.storage.get_public_users", return_value=public_rows), patch(
+        "app.users.storage.get_public_users_version", return_value=(args.rows, 0)
+    ), patch("app.main.settings.MIGRATIONS_ON_STARTUP", new="off"), TestClient(
+        app
+    ) as client:
+        results["GET /users"] = _time(lambda: client.get("/users/"), args.repeat)
+    app.dependency_overrides.clear()
+
+    print(json.dumps({"rows": args.rows, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Profiles the CPU-bound service paths (password hashing, JWT encoding and
+users serialization) against the in-memory storage backend, so the numbers
+carry no database or network noise.
+
+Usage:
+    uv run python -m benchmarks.service_profile --users 200 --repeat 50
+    uv run python -m benchmarks.service_profile --profile authenticate_user
+"""
+
+import argparse
+import cProfile
+import json
+import pstats
+import time
+from unittest.mock import patch
+
+from app.dependencies.logger import get_app_logger
+from app.users import memory_storage
+from app.users import services as user_service
+from app.users.models import UserCreate
+
+from .common import summarize
+
+PASSWORD = "profile-password"
+
+
+def _time(fn, repeat: int):
+    latencies = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - t0)
+    return summarize(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=200, help="Seeded users")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument(
+        "--profile", default=None, help="Print cProfile stats for this operation"
+    )
+    args = parser.parse_args()
+
+    logger = get_app_logger("benchmark.service_profile")
+    conn = memory_storage.connect(memory_storage.MemoryDatabase())
+    uow = user_service.UnitOfWork(lambda: conn, "benchmark")
+
+    def create_user(i: int):
+        user_service.create_user(
+            uow,
+            UserCreate(
+                username=f"profile_{i}",
+                email=f"profile_{i}@example.com",
+                password=PASSWORD,
+            ),
+            "benchmark",
+            logger,
+        )
+
+    operations = {
+        "create_user": create_user,
+        "authenticate_user": lambda i: user_service.authenticate_user(
+            uow, f"profile_{i % args.users}@example.com", PASSWORD, "benchmark", logger
+        ),
+        "create_access_token": lambda i: user_service.create_access_token(
+            {"sub": f"profile_{i}@example.com"}
+        ),
+        "get_users_json": lambda i: user_service.get_users_json(
+            uow, "benchmark", logger
+        ),
+    }
+    if args.profile and args.profile not in operations:
+        parser.error(f"--profile must be one of: {', '.join(operations)}")
+
+    results = {}
+    with patch.object(user_service, "user_storage", memory_storage):
+        results["create_user"] = _time(create_user, args.users)
+        for name, fn in operations.items():
+            if name != "create_user":
+                results[name] = _time(fn, args.repeat)
+        if args.profile:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            for i in range(args.repeat):
+                operations[args.profile](args.users + i)
+            profiler.disable()
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
+
+    print(json.dumps({"users": args.users, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
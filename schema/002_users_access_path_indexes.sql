@@ -0,0 +1,10 @@
+-- migrate: no-transaction
+
+-- Email lookups: login (get_user_by_email_ci) matches lower(email), and the
+-- auth lookup by exact email (get_user_by_email) narrows the same key down
+-- with email = %s. The index carries every UserRow column, so both are
+-- index-only scans. The users_email_key constraint keeps its plain index.
+DROP INDEX CONCURRENTLY IF EXISTS users_email_lower_idx;
+CREATE INDEX CONCURRENTLY users_email_lower_idx
+    ON users (lower(email))
+    INCLUDE (id, username, email, code, hashed_password, avatar_url, updated_at);
@@ -0,0 +1,10 @@
+-- Shared counters for LOGIN_RATE_LIMIT_BACKEND=postgres (app/core/rate_limit.py).
+-- One row per limiter, key and fixed window; window_start is in epoch
+-- milliseconds. Unlogged: losing the counters in a crash only resets limits.
+CREATE UNLOGGED TABLE rate_limits (
+    limiter VARCHAR(50) NOT NULL,
+    key VARCHAR(255) NOT NULL,
+    window_start BIGINT NOT NULL,
+    hits INTEGER NOT NULL,
+    PRIMARY KEY (limiter, key, window_start)
+);
@@ -0,0 +1,18 @@
+-- Issued refresh tokens, by JWT id (jti). Each login starts a family; every
+-- /refresh marks the presented token used and issues its successor in the
+-- same family. Presenting a used token again revokes the whole family.
+CREATE TABLE refresh_tokens (
+    jti UUID PRIMARY KEY,
+    family_id UUID NOT NULL,
+    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    issued_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    used_at TIMESTAMP WITH TIME ZONE,
+    revoked_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX refresh_tokens_family_idx ON refresh_tokens (family_id);
+
+-- Revocation filter syncs read only revoked rows
+CREATE INDEX refresh_tokens_revoked_idx ON refresh_tokens (revoked_at)
+    WHERE revoked_at IS NOT NULL;
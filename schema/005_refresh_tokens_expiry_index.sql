@@ -0,0 +1,7 @@
+-- migrate: no-transaction
+
+-- Logins and refreshes purge expired refresh tokens a batch at a time; this
+-- finds the batch without scanning the table.
+DROP INDEX CONCURRENTLY IF EXISTS refresh_tokens_expires_at_idx;
+CREATE INDEX CONCURRENTLY refresh_tokens_expires_at_idx
+    ON refresh_tokens (expires_at);
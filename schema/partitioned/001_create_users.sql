@@ -0,0 +1,47 @@
+-- USERS_TABLE_LAYOUT=partitioned: users is hash partitioned on id. Unique
+-- constraints can't span partitions unless they include the partition key,
+-- so email, username and code each live in a global lookup table whose
+-- primary key enforces uniqueness and maps back to the user's id.
+CREATE TABLE users (
+    id SERIAL PRIMARY KEY,
+    code VARCHAR(7) NOT NULL,
+    username VARCHAR(50) NOT NULL,
+    email VARCHAR(255) NOT NULL,
+    hashed_password VARCHAR(255) NOT NULL,
+    avatar_url VARCHAR(255),
+    is_active BOOLEAN DEFAULT TRUE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+) PARTITION BY HASH (id);
+
+CREATE TABLE users_p00 PARTITION OF users FOR VALUES WITH (MODULUS 16, REMAINDER 0);
+CREATE TABLE users_p01 PARTITION OF users FOR VALUES WITH (MODULUS 16, REMAINDER 1);
+CREATE TABLE users_p02 PARTITION OF users FOR VALUES WITH (MODULUS 16, REMAINDER 2);
+CREATE TABLE users_p03 PARTITION OF users FOR VALUES WITH (MODULUS 16, REMAINDER 3);
+CREATE TABLE users_p04 PARTITION OF users FOR VALUES WITH (MODULUS 16, REMAINDER 4);
+CREATE TABLE users_p05 PARTITION OF users FOR VALUES WITH (MODULUS 16, REMAINDER 5);
+CREATE TABLE users_p06 PARTITION OF users FOR VALUES WITH (MODULUS 16, REMAINDER 6);
+CREATE TABLE users_p07 PARTITION OF users FOR VALUES WITH (MODULUS 16, REMAINDER 7);
+CREATE TABLE users_p08 PARTITION OF users FOR VALUES WITH (MODULUS 16, REMAINDER 8);
+CREATE TABLE users_p09 PARTITION OF users FOR VALUES WITH (MODULUS 16, REMAINDER 9);
+CREATE TABLE users_p10 PARTITION OF users FOR VALUES WITH (MODULUS 16, REMAINDER 10);
+CREATE TABLE users_p11 PARTITION OF users FOR VALUES WITH (MODULUS 16, REMAINDER 11);
+CREATE TABLE users_p12 PARTITION OF users FOR VALUES WITH (MODULUS 16, REMAINDER 12);
+CREATE TABLE users_p13 PARTITION OF users FOR VALUES WITH (MODULUS 16, REMAINDER 13);
+CREATE TABLE users_p14 PARTITION OF users FOR VALUES WITH (MODULUS 16, REMAINDER 14);
+CREATE TABLE users_p15 PARTITION OF users FOR VALUES WITH (MODULUS 16, REMAINDER 15);
+
+CREATE TABLE user_emails (
+    email VARCHAR(255) PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE
+);
+
+CREATE TABLE user_usernames (
+    username VARCHAR(50) PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE
+);
+
+CREATE TABLE user_codes (
+    code VARCHAR(7) PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE
+);
@@ -0,0 +1,8 @@
+-- migrate: no-transaction
+
+-- Partitioned layout counterpart of 002. Email lookups go through
+-- user_emails' primary key; the case-insensitive login lookup gets an index
+-- on lower(email) carrying what it returns.
+DROP INDEX CONCURRENTLY IF EXISTS user_emails_lower_idx;
+CREATE INDEX CONCURRENTLY user_emails_lower_idx
+    ON user_emails (lower(email)) INCLUDE (email, user_id);
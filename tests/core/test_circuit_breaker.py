@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+from app.core.circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+)
+from app.core.metrics import metrics
+
+
+def _fail(breaker: CircuitBreaker, times: int):
+    for _ in range(times):
+        breaker.failure(breaker.allow())
+
+
+def test_circuit_breaker_opens_after_consecutive_failures():
+    """
+    Test that only an unbroken run of failures opens the breaker.
+    """
+    breaker = CircuitBreaker("test_opens", failure_threshold=3, open_seconds=60)
+
+    _fail(breaker, 2)
+    breaker.success(breaker.allow())
+    _fail(breaker, 2)
+    assert breaker.state == CLOSED
+
+    _fail(breaker, 1)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError) as e:
+        breaker.allow()
+    assert 0 < e.value.retry_after <= 60
+    assert metrics.get("circuit_breaker_rejected_total", breaker="test_opens") == 1
+    gauges = metrics.snapshot()["gauges"]
+    assert gauges['circuit_breaker_state{breaker="test_opens"}'] == 2
+
+
+def test_circuit_breaker_half_open_probe_closes():
+    """
+    Test that after open_seconds one probe goes through and its success
+    closes the breaker.
+    """
+    breaker = CircuitBreaker("test_probe", failure_threshold=1, open_seconds=0.05)
+    _fail(breaker, 1)
+    time.sleep(0.06)
+
+    probe = breaker.allow()
+    assert probe is True
+    assert breaker.state == HALF_OPEN
+    # Only one probe at a time
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+    breaker.success(probe)
+    assert breaker.state == CLOSED
+    assert breaker.allow() is False
+
+
+def test_circuit_breaker_failed_probe_reopens():
+    """
+    Test that a failed probe opens the breaker for another open_seconds.
+    """
+    breaker = CircuitBreaker("test_reopen", failure_threshold=1, open_seconds=0.05)
+    _fail(breaker, 1)
+    time.sleep(0.06)
+
+    breaker.failure(breaker.allow())
+
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    assert (
+        metrics.get(
+            "circuit_breaker_transitions_total", breaker="test_reopen", state=OPEN
+        )
+        == 2
+    )
+
+
+def test_circuit_breaker_release_frees_probe():
+    """
+    Test that a released probe frees its slot and leaves the breaker half open.
+    """
+    breaker = CircuitBreaker("test_release", failure_threshold=1, open_seconds=0.05)
+    _fail(breaker, 1)
+    time.sleep(0.06)
+
+    breaker.release(breaker.allow())
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow() is True
@@ -0,0 +1,107 @@
+from contextlib import contextmanager
+from http.cookies import SimpleCookie
+from typing import Optional
+from unittest.mock import patch
+
+from fastapi import Request, Response
+
+from app import database
+from app.core.metrics import metrics
+
+
+class FakePool:
+    """
+    Stands in for a ConnectionPool and hands out its own name as connection.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    @contextmanager
+    def connection(self):
+        yield self.name
+
+
+def test_read_connection_uses_primary_without_replica():
+    """
+    Test that reads fall back to the primary pool when no replica is configured.
+    """
+    with patch.object(database, "pool", FakePool("primary")), patch.object(
+        database, "replica_pool", None
+    ), patch.object(database.settings, "DATABASE_REPLICA_URL", None):
+        with database.get_read_connection_context() as conn:
+            assert conn == "primary"
+
+
+def make_request(cookie: Optional[str] = None, subject: Optional[str] = None):
+    headers = []
+    if cookie is not None:
+        headers.append(
+            (b"cookie", f"{database.PRIMARY_STICKY_COOKIE}={cookie}".encode())
+        )
+    request = Request({"type": "http", "headers": headers})
+    if subject is not None:
+        request.state.subject = subject
+    return request
+
+
+def sticky_cookie(subject: str) -> str:
+    response = Response()
+    database.set_primary_sticky(response, subject)
+    return SimpleCookie(response.headers["set-cookie"])[
+        database.PRIMARY_STICKY_COOKIE
+    ].value
+
+
+def read_target(request: Request) -> str:
+    with database.get_read_connection_provider(request)() as conn:
+        return conn
+
+
+def test_read_connection_routes_to_replica_unless_sticky():
+    """
+    Test that reads go to the replica, except for the verified user whose
+    cookie says they wrote recently.
+    """
+    metrics.reset()
+    with patch.object(database, "pool", FakePool("primary")), patch.object(
+        database, "replica_pool", FakePool("replica")
+    ):
+        assert read_target(make_request(subject="writer@example.com")) == "replica"
+
+        cookie = sticky_cookie("writer@example.com")
+        assert read_target(make_request(cookie, "writer@example.com")) == "primary"
+        assert read_target(make_request(cookie, "other@example.com")) == "replica"
+        # Unauthenticated reads never trust the cookie
+        assert read_target(make_request(cookie)) == "replica"
+
+    assert metrics.get("db_reads_total", target="replica") == 3
+    assert metrics.get("db_reads_total", target="primary") == 1
+
+
+def test_primary_sticky_cookie_expires_and_rejects_forgeries():
+    """
+    Test that an expired or tampered cookie doesn't route to the primary.
+    """
+    cookie = sticky_cookie("writer@example.com")
+    assert database.is_primary_sticky(make_request(cookie, "writer@example.com"))
+
+    deadline, _, signature = cookie.partition(".")
+    for forged in (
+        f"{int(deadline) + 60}.{signature}",
+        f"{deadline}.{'0' * len(signature)}",
+        "not-a-cookie",
+    ):
+        assert not database.is_primary_sticky(
+            make_request(forged, "writer@example.com")
+        )
+
+    with patch.object(database.time, "time", return_value=int(deadline)):
+        assert not database.is_primary_sticky(
+            make_request(cookie, "writer@example.com")
+        )
+
+    with patch.object(database.settings, "REPLICA_STICKY_SECONDS", 0):
+        response = Response()
+        database.set_primary_sticky(response, "writer@example.com")
+        assert "set-cookie" not in response.headers
@@ -0,0 +1,154 @@
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+import pytest
+from psycopg import Connection
+from psycopg_pool import ConnectionPool
+
+from app.core.migrations import (
+    MigrationError,
+    check,
+    discover_migrations,
+    get_applied_versions,
+    migrate,
+    split_statements,
+)
+
+
+@pytest.fixture
+def empty_schema(db_pool: ConnectionPool):
+    schema_name = f"test_{uuid.uuid4().hex[:8]}"
+    with db_pool.connection() as conn:
+        conn.execute(f"CREATE SCHEMA {schema_name};")
+    yield schema_name
+    with db_pool.connection() as conn:
+        conn.execute(f"DROP SCHEMA IF EXISTS {schema_name} CASCADE;")
+
+
+@contextmanager
+def schema_connection(db_pool: ConnectionPool, schema_name: str):
+    with db_pool.connection() as conn:
+        conn.execute(f"SET search_path TO {schema_name};")
+        conn.commit()
+        yield conn
+
+
+def _write(directory: Path, files: dict) -> Path:
+    for name, sql in files.items():
+        (directory / name).write_text(sql, encoding="utf-8")
+    return directory
+
+
+def test_migrate_is_idempotent(db_conn: Connection):
+    """
+    Test that the fixture schema is fully migrated and re-running is a no-op.
+    """
+    check(db_conn)
+    db_conn.commit()
+    assert migrate(db_conn) == []
+    assert set(get_applied_versions(db_conn)) == {
+        migration.version for migration in discover_migrations()
+    }
+
+
+def test_check_reports_pending(
+    db_pool: ConnectionPool, empty_schema: str, tmp_path: Path
+):
+    """
+    Test that the startup check fails until the migrations are applied.
+    """
+    _write(tmp_path, {"001_a.sql": "CREATE TABLE a (id INT);"})
+    with schema_connection(db_pool, empty_schema) as conn:
+        with pytest.raises(MigrationError):
+            check(conn, tmp_path)
+        assert migrate(conn, tmp_path) == [1]
+        check(conn, tmp_path)
+
+        _write(tmp_path, {"002_b.sql": "CREATE TABLE b (id INT);"})
+        with pytest.raises(MigrationError):
+            check(conn, tmp_path)
+
+
+def test_failed_migration_rolls_back(
+    db_pool: ConnectionPool, empty_schema: str, tmp_path: Path
+):
+    """
+    Test that a failing migration leaves neither its changes nor its version.
+    """
+    _write(
+        tmp_path,
+        {
+            "001_a.sql": "CREATE TABLE a (id INT);",
+            "002_b.sql": "CREATE TABLE b (id INT);\nSELECT * FROM missing_table;",
+        },
+    )
+    with schema_connection(db_pool, empty_schema) as conn:
+        with pytest.raises(Exception):
+            migrate(conn, tmp_path)
+        assert set(get_applied_versions(conn)) == {1}
+        row = conn.execute("SELECT to_regclass('b') AS b;").fetchone()
+        assert row["b"] is None
+
+
+def test_no_transaction_migration(
+    db_pool: ConnectionPool, empty_schema: str, tmp_path: Path
+):
+    """
+    Test that CREATE INDEX CONCURRENTLY runs outside a transaction.
+    """
+    _write(
+        tmp_path,
+        {
+            "001_a.sql": "CREATE TABLE a (id INT, name TEXT);",
+            "002_a_name_idx.sql": (
+                "-- migrate: no-transaction\n"
+                "DROP INDEX CONCURRENTLY IF EXISTS a_name_idx;\n"
+                "CREATE INDEX CONCURRENTLY a_name_idx ON a (name);\n"
+            ),
+        },
+    )
+    with schema_connection(db_pool, empty_schema) as conn:
+        assert migrate(conn, tmp_path) == [1, 2]
+        row = conn.execute(
+            "SELECT indisvalid FROM pg_index WHERE indexrelid = 'a_name_idx'::regclass;"
+        ).fetchone()
+        assert row["indisvalid"] is True
+
+
+def test_split_statements():
+    sql = "-- migrate: no-transaction\nSELECT 1;\n\n-- comment\nSELECT 'a;b';\n"
+    assert split_statements(sql) == ["SELECT 1", "SELECT 'a;b'"]
+
+
+def test_concurrent_migrate_applies_once(
+    db_pool: ConnectionPool, empty_schema: str, tmp_path: Path
+):
+    """
+    Test that runners racing on the same schema apply each migration once.
+    """
+    _write(
+        tmp_path,
+        {
+            "001_a.sql": "SELECT pg_sleep(0.3);\nCREATE TABLE a (id INT);",
+            "002_b.sql": "CREATE TABLE b (id INT);",
+        },
+    )
+    applied, errors = [], []
+
+    def run():
+        try:
+            with schema_connection(db_pool, empty_schema) as conn:
+                applied.extend(migrate(conn, tmp_path))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    assert errors == []
+    assert sorted(applied) == [1, 2]
@@ -0,0 +1,85 @@
+import threading
+from unittest.mock import patch
+
+from passlib import hash as passlib_hash
+
+from app.core.metrics import metrics
+from app.core.passwords import BackgroundRehasher, PasswordHasher, calibrate
+
+
+def test_calibrate_scales_cost_to_target():
+    """
+    Test that the cost scales with the target, by rounds or by powers of two.
+    """
+    with patch("app.core.passwords.time_hash", return_value=0.01):
+        assert calibrate("pbkdf2_sha256", 0.04) == 4 * 29000
+        assert calibrate("scrypt", 0.04) == 16 + 2
+        # Never below passlib's default, however slow the CPU
+        assert calibrate("pbkdf2_sha256", 0.001) == 29000
+
+
+def test_calibrate_ignores_timing_noise():
+    """
+    Test that slightly different timings across boots give the same cost, and
+    that hashes of the step below aren't rehashed.
+    """
+    costs = set()
+    for elapsed in (0.0093, 0.0100, 0.0107):
+        with patch("app.core.passwords.time_hash", return_value=elapsed):
+            costs.add(calibrate("pbkdf2_sha256", 0.05))
+    assert costs == {4 * 29000}
+
+    hasher = PasswordHasher("pbkdf2_sha256", cost=4 * 29000)
+    previous = passlib_hash.pbkdf2_sha256.using(rounds=2 * 29000).hash("secret")
+    assert not hasher.needs_update(previous)
+
+
+def test_needs_update_for_cheaper_or_other_scheme():
+    """
+    Test that hashes with a lower cost or another scheme are due for a rehash
+    but still verify.
+    """
+    hasher = PasswordHasher("pbkdf2_sha256", cost=60000)
+    cheaper = passlib_hash.pbkdf2_sha256.using(rounds=29000).hash("secret")
+    scrypt = passlib_hash.scrypt.using(rounds=4).hash("secret")
+
+    assert hasher.verify("secret", cheaper)
+    assert hasher.verify("secret", scrypt)
+    assert hasher.needs_update(cheaper)
+    assert hasher.needs_update(scrypt)
+    assert not hasher.needs_update(hasher.hash("secret"))
+
+
+def test_verify_records_timings_per_scheme():
+    """
+    Test that verify timings are labelled with the hash's own scheme.
+    """
+    hasher = PasswordHasher("pbkdf2_sha256")
+    hasher.verify("secret", passlib_hash.scrypt.using(rounds=4).hash("secret"))
+
+    timings = metrics.snapshot()["timings"]
+    assert timings['password_verify_seconds{scheme="scrypt"}']["count"] >= 1
+
+
+def test_background_rehasher_deduplicates_and_saves():
+    """
+    Test that a queued key isn't queued twice and the new hash is saved.
+    """
+    hasher = PasswordHasher("pbkdf2_sha256")
+    release = threading.Event()
+    saved = []
+
+    def save(key, old_hash, new_hash):
+        release.wait(timeout=5)
+        saved.append((key, old_hash, new_hash))
+        return True
+
+    rehasher = BackgroundRehasher(hasher, save)
+    assert rehasher.submit(1, "old", "secret") is True
+    assert rehasher.submit(1, "old", "secret") is False
+    release.set()
+    rehasher.wait()
+
+    assert len(saved) == 1
+    assert hasher.verify("secret", saved[0][2])
+    assert rehasher.submit(1, "old", "secret") is True
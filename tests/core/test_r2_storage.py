@@ -0,0 +1,287 @@
+import asyncio
+import hashlib
+import io
+import threading
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+import httpx
+import pytest
+
+from app.core.circuit_breaker import CLOSED, CircuitBreaker
+from app.core.metrics import metrics
+from app.core.r2_storage import AsyncR2Client, R2Error, R2Unavailable, sign_request
+from app.core.retry_budget import RetryBudget
+
+
+def _client(name: str, handler, **kwargs) -> AsyncR2Client:
+    options = {"max_concurrency": 4, "timeout_seconds": 5.0}
+    options.update(kwargs)
+    return AsyncR2Client(
+        name,
+        "http://r2.test",
+        "AKID",
+        "SECRET",
+        "auto",
+        transport=httpx.MockTransport(handler),
+        **options,
+    )
+
+
+def test_sign_request_matches_botocore():
+    """
+    Test that the SigV4 signature is the one botocore computes.
+    """
+    botocore_auth = pytest.importorskip("botocore.auth")
+    from botocore.awsrequest import AWSRequest
+    from botocore.credentials import Credentials
+
+    body = b"avatar bytes"
+    url = "http://r2.test/bucket/avatars/user%201.png"
+    headers = {"Content-Type": "image/png", "X-Amz-Acl": "public-read"}
+    now = datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc)
+    request = AWSRequest(method="PUT", url=url, data=body, headers=dict(headers))
+    with patch.object(
+        botocore_auth, "get_current_datetime", return_value=now.replace(tzinfo=None)
+    ):
+        botocore_auth.S3SigV4Auth(Credentials("AKID", "SECRET"), "s3", "auto").add_auth(
+            request
+        )
+
+    signed = sign_request(
+        "PUT",
+        url,
+        headers,
+        hashlib.sha256(body).hexdigest(),
+        "AKID",
+        "SECRET",
+        "auto",
+        now,
+    )
+
+    assert signed["Authorization"] == request.headers["Authorization"]
+    assert signed["X-Amz-Date"] == "20240501T123000Z"
+
+
+def test_put_object_streams_signed_body():
+    """
+    Test that put_object sends the file with its hash, size and type.
+    """
+    received = {}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        received["url"] = str(request.url)
+        received["headers"] = request.headers
+        received["body"] = await request.aread()
+        return httpx.Response(200)
+
+    data = b"x" * 200_000
+    client = _client("test_put", handler)
+    asyncio.run(
+        client.put_object(
+            "bucket",
+            "avatars/a.png",
+            io.BytesIO(data),
+            len(data),
+            sha256=hashlib.sha256(data).hexdigest(),
+            content_type="image/png",
+        )
+    )
+
+    assert received["url"] == "http://r2.test/bucket/avatars/a.png"
+    assert received["body"] == data
+    assert received["headers"]["content-length"] == str(len(data))
+    assert "transfer-encoding" not in received["headers"]
+    assert (
+        received["headers"]["x-amz-content-sha256"] == hashlib.sha256(data).hexdigest()
+    )
+    assert received["headers"]["authorization"].startswith("AWS4-HMAC-SHA256 ")
+    assert (
+        metrics.get(
+            "r2_requests_total", client="test_put", operation="put_object", status="200"
+        )
+        == 1
+    )
+
+
+def test_put_object_reads_body_off_the_event_loop():
+    """
+    Test that the body is read on a worker thread, not the loop's.
+    """
+    readers = set()
+
+    class File(io.BytesIO):
+        def read(self, size=-1):
+            readers.add(threading.get_ident())
+            return super().read(size)
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        return httpx.Response(200)
+
+    client = _client("test_read_thread", handler)
+    data = b"z" * 200_000
+    asyncio.run(client.put_object("bucket", "k", File(data), len(data)))
+
+    assert readers and threading.get_ident() not in readers
+
+
+def test_put_object_bounds_concurrency():
+    """
+    Test that no more than max_concurrency requests are in flight at once.
+    """
+    state = {"in_flight": 0, "peak": 0}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        state["in_flight"] += 1
+        state["peak"] = max(state["peak"], state["in_flight"])
+        await asyncio.sleep(0.01)
+        state["in_flight"] -= 1
+        return httpx.Response(200)
+
+    client = _client("test_bound", handler, max_concurrency=3)
+
+    async def upload_many():
+        await asyncio.gather(
+            *(
+                client.put_object("bucket", f"k{i}", io.BytesIO(b"x"), 1)
+                for i in range(20)
+            )
+        )
+
+    asyncio.run(upload_many())
+    assert state["peak"] == 3
+
+
+@pytest.mark.parametrize("status", ["timeout", "500"])
+def test_put_object_raises_r2_error(status: str):
+    """
+    Test that timeouts and error statuses surface as R2Error.
+    """
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if status == "timeout":
+            await asyncio.sleep(1)
+        return httpx.Response(int(status) if status.isdigit() else 200)
+
+    client = _client(f"test_error_{status}", handler, timeout_seconds=0.05)
+
+    with pytest.raises(R2Error):
+        asyncio.run(client.put_object("bucket", "k", io.BytesIO(b"x"), 1))
+    assert (
+        metrics.get(
+            "r2_operations_total",
+            client=f"test_error_{status}",
+            operation="put_object",
+            result="error",
+        )
+        == 1
+    )
+
+
+def test_put_object_retries_transient_failures():
+    """
+    Test that a 503 is retried with the whole body, and a 403 is not.
+    """
+    bodies = []
+    statuses = [503, 200, 403]
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        bodies.append(await request.aread())
+        return httpx.Response(statuses[len(bodies) - 1])
+
+    client = _client(
+        "test_retry",
+        handler,
+        retry_budget=RetryBudget("test_retry", ratio=1, min_per_second=0),
+        max_retries=2,
+    )
+    data = b"y" * 100_000
+    asyncio.run(client.put_object("bucket", "k", io.BytesIO(data), len(data)))
+    assert bodies == [data, data]
+
+    with pytest.raises(R2Error):
+        asyncio.run(client.put_object("bucket", "k", io.BytesIO(data), len(data)))
+    assert len(bodies) == 3
+
+
+def test_put_object_retries_stop_when_budget_is_spent():
+    """
+    Test that retries stop once the retry budget is exhausted.
+    """
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        return httpx.Response(500)
+
+    client = _client(
+        "test_budget",
+        handler,
+        retry_budget=RetryBudget("test_budget", ratio=0.5, min_per_second=0),
+        max_retries=5,
+    )
+    for _ in range(4):
+        with pytest.raises(R2Error):
+            asyncio.run(client.put_object("bucket", "k", io.BytesIO(b"x"), 1))
+
+    # 4 first attempts earn 2 retries in total
+    assert len(calls) == 6
+
+
+def test_put_object_fails_fast_when_breaker_is_open():
+    """
+    Test that an open breaker rejects uploads without calling R2.
+    """
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        raise httpx.ConnectError("connection refused")
+
+    client = _client(
+        "test_breaker",
+        handler,
+        breaker=CircuitBreaker("test_breaker", failure_threshold=2, open_seconds=60),
+    )
+    for _ in range(2):
+        with pytest.raises(R2Error):
+            asyncio.run(client.put_object("bucket", "k", io.BytesIO(b"x"), 1))
+
+    with pytest.raises(R2Unavailable) as e:
+        asyncio.run(client.put_object("bucket", "k", io.BytesIO(b"x"), 1))
+
+    assert len(calls) == 2
+    assert e.value.retry_after > 0
+    assert (
+        metrics.get(
+            "r2_operations_total",
+            client="test_breaker",
+            operation="put_object",
+            result="rejected",
+        )
+        == 1
+    )
+
+
+@pytest.mark.parametrize("outcome", ["cancelled", "429"])
+def test_put_object_breaker_ignores_cancellations_and_throttling(outcome: str):
+    """
+    Test that a cancelled attempt or a 429 doesn't count as a breaker failure.
+    """
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if outcome == "cancelled":
+            await asyncio.sleep(1)
+        return httpx.Response(429)
+
+    breaker = CircuitBreaker(
+        f"test_ignore_{outcome}", failure_threshold=1, open_seconds=60
+    )
+    client = _client(
+        f"test_ignore_{outcome}", handler, timeout_seconds=0.05, breaker=breaker
+    )
+
+    with pytest.raises(R2Error):
+        asyncio.run(client.put_object("bucket", "k", io.BytesIO(b"x"), 1))
+    assert breaker.state == CLOSED
@@ -0,0 +1,109 @@
+import threading
+from contextlib import nullcontext
+
+from psycopg import Connection
+
+from app.core.metrics import metrics
+from app.core.rate_limit import MemoryRateLimiter, PostgresRateLimiter
+
+
+def test_memory_limiter_rejects_over_limit():
+    """
+    Test that attempts past the limit are rejected until the window slides.
+    """
+    limiter = MemoryRateLimiter("test_limit", limit=3, window=60)
+    now = 600.0  # Start of a window
+
+    assert [limiter._hit("a", now)[0] for _ in range(3)] == [True] * 3
+    allowed, retry_after = limiter._hit("a", now + 1)
+    assert allowed is False
+    assert 0 < retry_after <= 59
+    # Other keys have their own counters
+    assert limiter._hit("b", now + 1) == (True, 0.0)
+
+
+def test_memory_limiter_weights_previous_window():
+    """
+    Test the sliding approximation: the previous window counts by its overlap.
+    """
+    limiter = MemoryRateLimiter("test_slide", limit=4, window=60)
+    for _ in range(4):
+        limiter._hit("a", 610.0)
+
+    # 15s into the next window, 3/4 of the previous 4 attempts still count
+    assert limiter._hit("a", 675.0)[0] is True  # 3 + 1
+    assert limiter._hit("a", 675.0)[0] is False  # 3 + 2
+    # Two windows later nothing carries over
+    assert limiter._hit("a", 790.0) == (True, 0.0)
+
+
+def test_memory_limiter_clears_key():
+    """
+    Test that clear() forgets one key's attempts and keeps the others'.
+    """
+    limiter = MemoryRateLimiter("test_clear", limit=1, window=60)
+    for key in ("a", "a", "b", "b"):
+        limiter._hit(key, 600.0)
+
+    limiter.clear("a")
+    assert limiter._hit("a", 601.0) == (True, 0.0)
+    assert limiter._hit("b", 601.0)[0] is False
+
+
+def test_memory_limiter_sweeps_idle_keys():
+    """
+    Test that keys idle for two windows are dropped.
+    """
+    limiter = MemoryRateLimiter("test_sweep", limit=3, window=60, shards=1)
+    limiter._hit("old", 600.0)
+    limiter._hit("new", 700.0)
+    assert limiter.size() == 2
+    limiter._hit("new", 800.0)
+    assert limiter.size() == 1
+
+
+def test_memory_limiter_concurrent_hits():
+    """
+    Test that concurrent attempts on one key allow exactly `limit` of them.
+    """
+    limiter = MemoryRateLimiter("test_concurrent", limit=50, window=3600)
+    results = []
+    lock = threading.Lock()
+
+    def run():
+        for _ in range(20):
+            allowed, _ = limiter.hit("shared")
+            with lock:
+                results.append(allowed)
+
+    threads = [threading.Thread(target=run) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count(True) == 50
+    assert metrics.get(
+        "rate_limit_attempts_total", limiter="test_concurrent", result="rejected"
+    ) == (8 * 20 - 50)
+
+
+def test_postgres_limiter_shares_counters(db_conn: Connection):
+    """
+    Test that limiters on the same table share counters and purge old windows.
+    """
+    first = PostgresRateLimiter("test_shared", 2, 60, lambda: nullcontext(db_conn))
+    second = PostgresRateLimiter("test_shared", 2, 60, lambda: nullcontext(db_conn))
+
+    assert first._hit("a", 600.0)[0] is True
+    assert second._hit("a", 610.0)[0] is True
+    assert first._hit("a", 620.0)[0] is False
+    # Next window: 2 of the previous window's 3 attempts still count
+    assert second._hit("a", 680.0)[0] is False
+    # Two windows later the old rows are gone
+    assert first._hit("a", 800.0) == (True, 0.0)
+    row = db_conn.execute("SELECT count(*) AS n FROM rate_limits;").fetchone()
+    assert row["n"] == 1
+    second.clear("a")
+    row = db_conn.execute("SELECT count(*) AS n FROM rate_limits;").fetchone()
+    assert row["n"] == 0
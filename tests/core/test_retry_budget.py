@@ -0,0 +1,31 @@
+from app.core.metrics import metrics
+from app.core.retry_budget import RetryBudget
+
+
+def test_retry_budget_caps_retries_at_ratio():
+    """
+    Test that retries are limited to a fraction of the calls.
+    """
+    budget = RetryBudget("test_ratio", ratio=0.1, min_per_second=0)
+    for _ in range(50):
+        budget.record_call()
+
+    allowed = sum(budget.try_retry() for _ in range(20))
+
+    assert allowed == 5
+    assert (
+        metrics.get(
+            "retry_budget_retries_total", budget="test_ratio", result="exhausted"
+        )
+        == 15
+    )
+
+
+def test_retry_budget_allows_minimum_rate():
+    """
+    Test that a process with few calls can still retry at min_per_second.
+    """
+    budget = RetryBudget("test_minimum", ratio=0.1, min_per_second=0.5, window=10)
+    budget.record_call()
+
+    assert sum(budget.try_retry() for _ in range(10)) == 6
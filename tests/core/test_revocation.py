@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta, timezone
+
+from app.core.metrics import metrics
+from app.core.revocation import SYNC_OVERLAP, BloomFilter, RevocationFilter
+
+
+def test_bloom_filter_has_no_false_negatives():
+    """
+    Test that every added key is found and few others are.
+    """
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for i in range(1000):
+        bloom.add(f"revoked-{i}")
+
+    assert all(f"revoked-{i}" in bloom for i in range(1000))
+    false_positives = sum(f"live-{i}" in bloom for i in range(10000))
+    assert false_positives < 300  # 1% expected
+    assert bloom.count == 1000
+
+
+def test_revocation_filter_syncs_incrementally_then_rebuilds():
+    """
+    Test that syncs load from the watermark, and rebuilds drop keys the
+    database no longer reports.
+    """
+    revoked_at = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    rows = [("a", revoked_at)]
+    calls = []
+
+    def load(since):
+        calls.append(since)
+        return [row for row in rows if since is None or row[1] > since]
+
+    revocations = RevocationFilter(
+        "test_sync", capacity=100, error_rate=0.001, sync_seconds=0, rebuild_every=2
+    )
+    assert revocations.is_stale()
+    revocations.sync(load)
+    assert revocations.might_contain("a")
+    assert not revocations.might_contain("b")
+
+    rows.append(("b", revoked_at + timedelta(seconds=5)))
+    revocations.sync(load)
+    assert calls == [None, revoked_at - SYNC_OVERLAP]
+    assert revocations.might_contain("b")
+
+    # "a" expired; the next rebuild forgets it
+    del rows[0]
+    revocations.sync(load)
+    assert calls[-1] is None
+    assert not revocations.might_contain("a")
+    assert revocations.might_contain("b")
+    assert (
+        metrics.get(
+            "revocation_filter_checks_total", filter="test_sync", result="positive"
+        )
+        == 3
+    )
+
+
+def test_revocation_filter_keeps_keys_added_during_rebuild():
+    """
+    Test that a revocation recorded while a rebuild loads isn't lost.
+    """
+    revocations = RevocationFilter(
+        "test_rebuild", capacity=100, error_rate=0.001, sync_seconds=60
+    )
+
+    def load(since):
+        revocations.add("local")
+        return []
+
+    revocations.sync(load)
+    assert revocations.might_contain("local")
+    assert not revocations.is_stale()
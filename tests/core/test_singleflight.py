@@ -0,0 +1,64 @@
+import threading
+import time
+
+import pytest
+
+from app.core.metrics import metrics
+from app.core.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_result():
+    """
+    Test that concurrent callers with the same key run the function once.
+    """
+    metrics.reset()
+    group = SingleFlight("test")
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow_lookup():
+        calls.append(1)
+        started.set()
+        release.wait(timeout=5)
+        return {"email": "shared@example.com"}
+
+    results = []
+
+    def caller():
+        results.append(group.do("shared@example.com", slow_lookup))
+
+    leader = threading.Thread(target=caller)
+    leader.start()
+    started.wait(timeout=5)
+    followers = [threading.Thread(target=caller) for _ in range(4)]
+    for follower in followers:
+        follower.start()
+    # Let every follower reach the wait before the leader finishes
+    while metrics.get("singleflight_calls_total", group="test") < 5:
+        time.sleep(0.001)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [{"email": "shared@example.com"}] * 5
+    assert metrics.get("singleflight_shared_total", group="test") == 4
+
+    # Once the call has finished, the next caller runs it again
+    group.do("shared@example.com", slow_lookup)
+    assert len(calls) == 2
+
+
+def test_errors_are_shared_and_not_cached():
+    """
+    Test that the leader's exception is raised to callers and not remembered.
+    """
+    group = SingleFlight("test_errors")
+
+    def failing_lookup():
+        raise ValueError("database unavailable")
+
+    with pytest.raises(ValueError):
+        group.do("key", failing_lookup)
+    assert group.do("key", lambda: "recovered") == "recovered"
@@ -0,0 +1,77 @@
+import time
+
+import pytest
+
+from app.core.metrics import metrics
+from app.core.token_cache import TokenCache
+
+
+class Verifier:
+    def __init__(self, ttl: float = 60):
+        self.ttl = ttl
+        self.calls = 0
+
+    def __call__(self, token: str) -> dict:
+        self.calls += 1
+        if token.startswith("bad"):
+            raise ValueError("Invalid token")
+        return {"sub": token, "exp": int(time.time() + self.ttl)}
+
+
+def test_token_cache_verifies_each_token_once():
+    """
+    Test that repeated tokens are served from the cache.
+    """
+    cache = TokenCache("test_once", max_size=10)
+    verify = Verifier()
+
+    for _ in range(3):
+        assert cache.decode("a", verify)["sub"] == "a"
+    assert cache.decode("b", verify)["sub"] == "b"
+
+    assert verify.calls == 2
+    assert (
+        metrics.get("token_cache_lookups_total", cache="test_once", result="hit") == 2
+    )
+    assert cache.size() == 2
+
+
+def test_token_cache_skips_invalid_and_expired_tokens():
+    """
+    Test that failed verifications aren't cached and expired entries are
+    verified again.
+    """
+    cache = TokenCache("test_expired", max_size=10)
+    verify = Verifier()
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            cache.decode("bad", verify)
+    assert verify.calls == 2
+
+    verify.ttl = 1
+    cache.decode("a", verify)
+    cache._entries[next(iter(cache._entries))] = (time.time() - 1, {"sub": "a"})
+    cache.decode("a", verify)
+    assert verify.calls == 4
+    assert (
+        metrics.get("token_cache_lookups_total", cache="test_expired", result="expired")
+        == 1
+    )
+
+
+def test_token_cache_evicts_least_recently_used():
+    """
+    Test that the cache stays within its size, keeping recently used tokens.
+    """
+    cache = TokenCache("test_evict", max_size=2)
+    verify = Verifier()
+    cache.decode("a", verify)
+    cache.decode("b", verify)
+    cache.decode("a", verify)
+    cache.decode("c", verify)  # Evicts "b"
+
+    assert cache.size() == 2
+    cache.decode("a", verify)
+    assert verify.calls == 3
+    cache.decode("b", verify)
+    assert verify.calls == 4
@@ -0,0 +1,117 @@
+import asyncio
+import hashlib
+from typing import List, Optional
+
+import pytest
+
+from app.core.metrics import metrics
+from app.core.uploads import UploadTooLarge, read_upload
+
+BOUNDARY = "test-boundary"
+
+
+def _body(file: bytes, field: str = "file", extra: bytes = b"") -> bytes:
+    return (
+        (
+            f"--{BOUNDARY}\r\n"
+            'Content-Disposition: form-data; name="note"\r\n\r\n'
+            "hello\r\n"
+            f"--{BOUNDARY}\r\n"
+            f'Content-Disposition: form-data; name="{field}"; filename="a.png"\r\n'
+            "Content-Type: image/png\r\n\r\n"
+        ).encode()
+        + file
+        + extra
+        + f"\r\n--{BOUNDARY}--\r\n".encode()
+    )
+
+
+class Stream:
+    """
+    Yields a body in chunks, recording how much of it was read.
+    """
+
+    def __init__(self, body: bytes, chunk_size: int = 1024):
+        self.chunks: List[bytes] = [
+            body[i : i + chunk_size] for i in range(0, len(body), chunk_size)
+        ]
+        self.read = 0
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            self.read += len(chunk)
+            yield chunk
+
+
+def _read(
+    body: bytes,
+    max_bytes: int = 64 * 1024,
+    spool_bytes: int = 8 * 1024,
+    content_length: Optional[str] = None,
+    stream: Optional[Stream] = None,
+):
+    headers = {"content-type": f"multipart/form-data; boundary={BOUNDARY}"}
+    if content_length is not None:
+        headers["content-length"] = content_length
+    return asyncio.run(
+        read_upload(headers, stream or Stream(body), "file", max_bytes, spool_bytes)
+    )
+
+
+@pytest.mark.parametrize("size", [100, 32 * 1024])
+def test_read_upload_hashes_and_spools(size: int):
+    """
+    Test that the file part is hashed and spooled, in memory or on disk.
+    """
+    data = bytes(range(256)) * (size // 256)
+    spooled = metrics.get("upload_spooled_to_disk_total")
+
+    upload = _read(_body(data))
+
+    assert upload.filename == "a.png"
+    assert upload.content_type == "image/png"
+    assert upload.size == len(data)
+    assert upload.sha256 == hashlib.sha256(data).hexdigest()
+    assert upload.file.read() == data
+    assert upload.on_disk == (size > 8 * 1024)
+    assert metrics.get("upload_spooled_to_disk_total") == spooled + (size > 8 * 1024)
+    upload.close()
+
+
+def test_read_upload_stops_reading_past_limit():
+    """
+    Test that an oversized upload is rejected without reading the whole body.
+    """
+    stream = Stream(_body(b"x" * 1024 * 1024))
+
+    with pytest.raises(UploadTooLarge):
+        _read(b"", max_bytes=10 * 1024, stream=stream)
+
+    assert stream.read <= 12 * 1024
+
+
+def test_read_upload_rejects_declared_length():
+    """
+    Test that a Content-Length over the limit is rejected before reading.
+    """
+    stream = Stream(_body(b"x" * 1024))
+
+    with pytest.raises(UploadTooLarge):
+        _read(b"", max_bytes=1024, content_length=str(10**9), stream=stream)
+
+    assert stream.read == 0
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        _body(b"data", field="other"),
+        b"not multipart at all",
+    ],
+)
+def test_read_upload_rejects_invalid_bodies(body: bytes):
+    """
+    Test that a body without the file field, or not multipart, is a ValueError.
+    """
+    with pytest.raises(ValueError):
+        _read(body)
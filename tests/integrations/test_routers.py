@@ -1,9 +1,19 @@
 import io
+import json
+from contextlib import contextmanager, nullcontext
 from unittest.mock import patch
 
+from fastapi import Request
 from fastapi.testclient import TestClient
 from psycopg import Connection
 
+from app import database
+from app.core.metrics import metrics
+from app.core.r2_storage import R2Error, R2Unavailable
+from app.database import get_connection_provider, get_read_connection_provider
+from app.middleware.logging import get_traffic_capture
+from app.users import services
+
 
 def test_register_user(test_app_with_db: TestClient, db_conn: Connection):
     """
@@ -109,6 +119,68 @@ def test_login_for_access_token_incorrect_password(
     assert "X-Trace-ID" in response.headers
 
 
+def test_login_rate_limited(test_app_with_db: TestClient, db_conn: Connection):
+    """
+    Test that login attempts over the per-email limit get 429 without
+    reaching authentication.
+    """
+    from app.users import services
+
+    with patch("app.dependencies.rate_limit.settings.LOGIN_RATE_LIMIT_PER_EMAIL", 2):
+        with patch.object(
+            services, "authenticate_user", wraps=services.authenticate_user
+        ) as authenticate:
+            statuses = [
+                test_app_with_db.post(
+                    "/login",
+                    data={"username": "Brute@example.com", "password": "guess"},
+                ).status_code
+                for _ in range(2)
+            ]
+            response = test_app_with_db.post(
+                "/login",
+                data={"username": "brute@example.com", "password": "guess"},
+            )
+
+    assert statuses == [401, 401]
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert response.json()["detail"]["message"] == "Too many login attempts"
+    assert authenticate.call_count == 2
+
+
+def test_login_success_clears_email_limit(
+    test_app_with_db: TestClient, db_conn: Connection
+):
+    """
+    Test that successful logins don't count against the per-email limit, so
+    its owner logging in often is never locked out.
+    """
+    test_app_with_db.post(
+        "/register",
+        json={
+            "username": "frequent",
+            "email": "frequent@example.com",
+            "password": "password",
+        },
+    )
+    credentials = {"username": "frequent@example.com", "password": "password"}
+
+    with patch("app.dependencies.rate_limit.settings.LOGIN_RATE_LIMIT_PER_EMAIL", 2):
+        statuses = [
+            test_app_with_db.post("/login", data=credentials).status_code
+            for _ in range(4)
+        ]
+        typo = test_app_with_db.post(
+            "/login", data={**credentials, "password": "passwrod"}
+        )
+        response = test_app_with_db.post("/login", data=credentials)
+
+    assert statuses == [200] * 4
+    assert typo.status_code == 401
+    assert response.status_code == 200
+
+
 def test_read_users(test_app_with_db: TestClient, db_conn: Connection):
     """
     Test retrieving all users.
@@ -166,6 +238,117 @@ def test_read_users_me(test_app_with_db: TestClient, db_conn: Connection):
     assert "X-Trace-ID" in response.headers
 
 
+def test_read_users_me_key_removed(
+    test_app_with_db: TestClient, db_conn: Connection, tmp_path, monkeypatch
+):
+    """
+    Test that a cached access token stops authenticating once its signing
+    key is removed.
+    """
+    key_path = tmp_path / "current.secret"
+    key_path.write_text("current-secret")
+    for name, value in {
+        "keys_dir": str(tmp_path),
+        "reload_seconds": 0,
+        "_next_reload": 0.0,
+        "_keys": {},
+        "_signing": services.key_ring._signing,
+        "_jwks": None,
+    }.items():
+        monkeypatch.setattr(services.key_ring, name, value)
+    test_app_with_db.post(
+        "/register",
+        json={
+            "username": "key_removed_user",
+            "email": "key_removed@example.com",
+            "password": "mepassword",
+        },
+    )
+    login_response = test_app_with_db.post(
+        "/login", data={"username": "key_removed@example.com", "password": "mepassword"}
+    )
+    headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+    assert test_app_with_db.get("/users/me", headers=headers).status_code == 200
+
+    key_path.unlink()
+    response = test_app_with_db.get("/users/me", headers=headers)
+    assert response.status_code == 401
+
+
+def test_read_users_conditional(test_app_with_db: TestClient, db_conn: Connection):
+    """
+    Test that the users list answers 304 until a user is added.
+    """
+    test_app_with_db.post(
+        "/register",
+        json={
+            "username": "etag_user_1",
+            "email": "etag1@example.com",
+            "password": "etagpassword",
+        },
+    )
+    response = test_app_with_db.get("/users/")
+    etag = response.headers["ETag"]
+    assert etag.startswith('W/"')
+    assert response.headers["Cache-Control"] == "no-cache"
+
+    response = test_app_with_db.get("/users/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+
+    test_app_with_db.post(
+        "/register",
+        json={
+            "username": "etag_user_2",
+            "email": "etag2@example.com",
+            "password": "etagpassword",
+        },
+    )
+    response = test_app_with_db.get("/users/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert len(response.json()) == 2
+
+
+def test_read_users_me_conditional(test_app_with_db: TestClient, db_conn: Connection):
+    """
+    Test that /users/me answers 304 until the user is updated.
+    """
+    test_app_with_db.post(
+        "/register",
+        json={
+            "username": "etag_me",
+            "email": "etag_me@example.com",
+            "password": "etagpassword",
+        },
+    )
+    token = test_app_with_db.post(
+        "/login", data={"username": "etag_me@example.com", "password": "etagpassword"}
+    ).json()["access_token"]
+    auth = {"Authorization": f"Bearer {token}"}
+
+    response = test_app_with_db.get("/users/me", headers=auth)
+    etag = response.headers["ETag"]
+    assert response.headers["Cache-Control"] == "private, no-cache"
+    response = test_app_with_db.get(
+        "/users/me", headers={**auth, "If-None-Match": f'"other", {etag}'}
+    )
+    assert response.status_code == 304
+
+    test_app_with_db.post(
+        "/update-password",
+        headers=auth,
+        json={"old_password": "etagpassword", "new_password": "newetagpassword"},
+    )
+    response = test_app_with_db.get(
+        "/users/me", headers={**auth, "If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.json()["email"] == "etag_me@example.com"
+    assert response.headers["ETag"] != etag
+
+
 def test_read_users_me_unauthorized(test_app_with_db: TestClient, db_conn: Connection):
     """
     Test retrieving current user without authentication.
@@ -211,6 +394,63 @@ def test_update_password(test_app_with_db: TestClient, db_conn: Connection):
     assert "X-Trace-ID" in response.headers
 
 
+def test_update_password_reads_own_write_from_primary(
+    test_app_with_db: TestClient, db_conn: Connection
+):
+    """
+    Test that after a write, the signed cookie routes the writer's reads to
+    the primary, and only theirs.
+    """
+    for name in ("sticky_a", "sticky_b"):
+        test_app_with_db.post(
+            "/register",
+            json={
+                "username": name,
+                "email": f"{name}@example.com",
+                "password": "stickypassword",
+            },
+        )
+    tokens = {
+        name: test_app_with_db.post(
+            "/login",
+            data={"username": f"{name}@example.com", "password": "stickypassword"},
+        ).json()["access_token"]
+        for name in ("sticky_a", "sticky_b")
+    }
+    test_app_with_db.cookies.clear()
+    reads = []
+
+    def read_connection_provider(request: Request):
+        def checkout():
+            reads.append(database.is_primary_sticky(request))
+            return nullcontext(db_conn)
+
+        return checkout
+
+    app = test_app_with_db.app
+    app.dependency_overrides[get_read_connection_provider] = read_connection_provider
+
+    def read_me(name: str) -> bool:
+        reads.clear()
+        response = test_app_with_db.get(
+            "/users/me", headers={"Authorization": f"Bearer {tokens[name]}"}
+        )
+        assert response.status_code == 200
+        return reads[-1]
+
+    assert not read_me("sticky_a")
+    response = test_app_with_db.post(
+        "/update-password",
+        headers={"Authorization": f"Bearer {tokens['sticky_a']}"},
+        json={"old_password": "stickypassword", "new_password": "newpassword"},
+    )
+    assert response.status_code == 200
+    assert database.PRIMARY_STICKY_COOKIE in response.cookies
+    assert read_me("sticky_a")
+    # The same client sends the cookie along, but for another user
+    assert not read_me("sticky_b")
+
+
 def test_upload_avatar(test_app_with_db: TestClient, db_conn: Connection):
     """
     Test uploading a user avatar.
@@ -296,6 +536,192 @@ def test_upload_avatar_no_bucket(test_app_with_db: TestClient, db_conn: Connecti
         assert "X-Trace-ID" in response.headers
 
 
+def test_upload_avatar_too_large(test_app_with_db: TestClient, db_conn: Connection):
+    """
+    Test that an avatar over AVATAR_MAX_BYTES is rejected with 413 and not
+    uploaded.
+    """
+    test_app_with_db.post(
+        "/register",
+        json={
+            "username": "large_avatar_user",
+            "email": "largeavatar@example.com",
+            "password": "largeavatarpassword",
+        },
+    )
+    login_response = test_app_with_db.post(
+        "/login",
+        data={"username": "largeavatar@example.com", "password": "largeavatarpassword"},
+    )
+    token = login_response.json()["access_token"]
+
+    file = io.BytesIO(b"x" * 2048)
+    with patch("app.users.routers.upload_file_to_r2") as mock_upload, patch(
+        "app.dependencies.uploads.settings.AVATAR_MAX_BYTES", new=1024
+    ):
+        response = test_app_with_db.post(
+            "/users/me/avatar",
+            headers={"Authorization": f"Bearer {token}"},
+            files={"file": ("avatar.jpg", file, "image/jpeg")},
+        )
+
+    assert response.status_code == 413
+    assert "trace_id" in response.json()["detail"]
+    mock_upload.assert_not_called()
+
+
+def test_upload_avatar_storage_error(test_app_with_db: TestClient, db_conn: Connection):
+    """
+    Test that a failed R2 upload is a 502 and leaves avatar_url unset.
+    """
+    test_app_with_db.post(
+        "/register",
+        json={
+            "username": "r2_error_user",
+            "email": "r2error@example.com",
+            "password": "r2errorpassword",
+        },
+    )
+    login_response = test_app_with_db.post(
+        "/login",
+        data={"username": "r2error@example.com", "password": "r2errorpassword"},
+    )
+    token = login_response.json()["access_token"]
+
+    with patch(
+        "app.users.routers.upload_file_to_r2",
+        side_effect=R2Error("put_object timed out"),
+    ):
+        response = test_app_with_db.post(
+            "/users/me/avatar",
+            headers={"Authorization": f"Bearer {token}"},
+            files={"file": ("avatar.jpg", io.BytesIO(b"image"), "image/jpeg")},
+        )
+
+    assert response.status_code == 502
+    assert response.json()["detail"]["message"] == "Failed to store avatar"
+    me = test_app_with_db.get(
+        "/users/me", headers={"Authorization": f"Bearer {token}"}
+    ).json()
+    assert me["avatar_url"] is None
+
+
+def test_upload_avatar_storage_unavailable(
+    test_app_with_db: TestClient, db_conn: Connection
+):
+    """
+    Test that an open R2 circuit breaker is a 503 with Retry-After.
+    """
+    test_app_with_db.post(
+        "/register",
+        json={
+            "username": "r2_down_user",
+            "email": "r2down@example.com",
+            "password": "r2downpassword",
+        },
+    )
+    login_response = test_app_with_db.post(
+        "/login", data={"username": "r2down@example.com", "password": "r2downpassword"}
+    )
+    token = login_response.json()["access_token"]
+
+    with patch(
+        "app.users.routers.upload_file_to_r2",
+        side_effect=R2Unavailable("put_object rejected", 12.3),
+    ):
+        response = test_app_with_db.post(
+            "/users/me/avatar",
+            headers={"Authorization": f"Bearer {token}"},
+            files={"file": ("avatar.jpg", io.BytesIO(b"image"), "image/jpeg")},
+        )
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "13"
+
+
+def test_upload_avatar_holds_no_connection_during_upload(
+    test_app_with_db: TestClient, db_conn: Connection
+):
+    """
+    Test that the avatar route checks out its connection only after R2 has
+    stored the file.
+    """
+    test_app_with_db.post(
+        "/register",
+        json={
+            "username": "no_hold_user",
+            "email": "nohold@example.com",
+            "password": "noholdpassword",
+        },
+    )
+    login_response = test_app_with_db.post(
+        "/login", data={"username": "nohold@example.com", "password": "noholdpassword"}
+    )
+    token = login_response.json()["access_token"]
+
+    events = []
+
+    @contextmanager
+    def recording_connection():
+        events.append("checkout")
+        yield db_conn
+
+    async def upload(*args, **kwargs):
+        events.append("upload")
+        return "https://cdn.example.com/avatar.jpg"
+
+    app = test_app_with_db.app
+    app.dependency_overrides[get_connection_provider] = lambda: recording_connection
+    with patch("app.users.routers.upload_file_to_r2", side_effect=upload):
+        response = test_app_with_db.post(
+            "/users/me/avatar",
+            headers={"Authorization": f"Bearer {token}"},
+            files={"file": ("avatar.jpg", io.BytesIO(b"image"), "image/jpeg")},
+        )
+
+    assert response.status_code == 200
+    assert response.json()["avatar_url"] == "https://cdn.example.com/avatar.jpg"
+    assert events == ["upload", "checkout"]
+
+
+def test_read_users_holds_no_connection_while_encoding(
+    test_app_with_db: TestClient, db_conn: Connection
+):
+    """
+    Test that the users list is encoded after its connections are returned.
+    """
+    test_app_with_db.post(
+        "/register",
+        json={
+            "username": "encode_user",
+            "email": "encode@example.com",
+            "password": "encodepassword",
+        },
+    )
+    events = []
+
+    @contextmanager
+    def recording_connection():
+        events.append("checkout")
+        yield db_conn
+        events.append("return")
+
+    def dump_json(*args, **kwargs):
+        events.append("encode")
+        return b"[]"
+
+    app = test_app_with_db.app
+    app.dependency_overrides[get_read_connection_provider] = lambda: (
+        recording_connection
+    )
+    with patch("app.users.services.users_adapter.dump_json", side_effect=dump_json):
+        response = test_app_with_db.get("/users/")
+
+    assert response.status_code == 200
+    # The ETag query, then the rows
+    assert events == ["checkout", "return", "checkout", "return", "encode"]
+
+
 def test_refresh_access_token(test_app_with_db: TestClient, db_conn: Connection):
     """
     Test refreshing the access token.
@@ -329,4 +755,285 @@ def test_refresh_access_token(test_app_with_db: TestClient, db_conn: Connection)
     assert "access_token" in data
     assert "token_type" in data
     assert data["access_token"] != old_access_token
-    assert "X-Trace-ID" in response.headers
\ No newline at end of file
+    assert "X-Trace-ID" in response.headers
+
+
+def test_refresh_token_reuse_revokes_family(
+    test_app_with_db: TestClient, db_conn: Connection
+):
+    """
+    Test that a refresh token presented twice revokes every token of its
+    family, including the access and refresh tokens rotated from it.
+    """
+    test_app_with_db.post(
+        "/register",
+        json={
+            "username": "reuse_user",
+            "email": "reuse@example.com",
+            "password": "reusepassword",
+        },
+    )
+    login_data = test_app_with_db.post(
+        "/login",
+        data={"username": "reuse@example.com", "password": "reusepassword"},
+    ).json()
+
+    rotated = test_app_with_db.post(
+        "/refresh", json={"refresh_token": login_data["refresh_token"]}
+    )
+    assert rotated.status_code == 200
+    rotated_data = rotated.json()
+    assert rotated_data["refresh_token"] != login_data["refresh_token"]
+
+    reused = test_app_with_db.post(
+        "/refresh", json={"refresh_token": login_data["refresh_token"]}
+    )
+    assert reused.status_code == 401
+    response = test_app_with_db.post(
+        "/refresh", json={"refresh_token": rotated_data["refresh_token"]}
+    )
+    assert response.status_code == 401
+    response = test_app_with_db.get(
+        "/users/me",
+        headers={"Authorization": f"Bearer {rotated_data['access_token']}"},
+    )
+    assert response.status_code == 401
+
+    # A new login starts a new family
+    login_data = test_app_with_db.post(
+        "/login",
+        data={"username": "reuse@example.com", "password": "reusepassword"},
+    ).json()
+    response = test_app_with_db.get(
+        "/users/me",
+        headers={"Authorization": f"Bearer {login_data['access_token']}"},
+    )
+    assert response.status_code == 200
+
+
+def test_read_jwks(test_app_with_db: TestClient, db_conn: Connection):
+    """
+    Test that the JWKS is served with caching headers and no shared secrets.
+    """
+    response = test_app_with_db.get("/.well-known/jwks.json")
+    assert response.status_code == 200
+    assert response.json() == {"keys": []}
+    assert response.headers["Cache-Control"].startswith("public, max-age=")
+
+
+def test_read_metrics(test_app_with_db: TestClient, db_conn: Connection):
+    """
+    Test that the metrics endpoint exposes counters, gauges and timings.
+    """
+    response = test_app_with_db.get("/metrics")
+    assert response.status_code == 200
+    data = response.json()
+    assert set(data) == {"counters", "gauges", "timings"}
+
+
+def test_connection_hold_time_per_route(
+    test_app_with_db: TestClient, db_conn: Connection
+):
+    """
+    Test that connection hold times are reported per route template.
+    """
+    metrics.reset()
+    test_app_with_db.post(
+        "/register",
+        json={
+            "username": "hold_user",
+            "email": "hold@example.com",
+            "password": "holdpassword",
+        },
+    )
+    test_app_with_db.post(
+        "/login", data={"username": "hold@example.com", "password": "holdpassword"}
+    )
+
+    timings = test_app_with_db.get("/metrics").json()["timings"]
+    assert timings['db_connection_hold_seconds{route="/register"}']["count"] == 1
+    # The user lookup and the refresh token insert, each in its own checkout
+    assert timings['db_connection_hold_seconds{route="/login"}']["count"] == 2
+    assert 'db_connection_wait_seconds{route="/login"}' in timings
+
+
+def test_read_users_batch(test_app_with_db: TestClient, db_conn: Connection):
+    """
+    Test resolving users by id and code through the batch endpoint.
+    """
+    first = test_app_with_db.post(
+        "/register",
+        json={
+            "username": "batch_user_1",
+            "email": "batch1@example.com",
+            "password": "batchpassword",
+        },
+    ).json()
+    second = test_app_with_db.post(
+        "/register",
+        json={
+            "username": "batch_user_2",
+            "email": "batch2@example.com",
+            "password": "batchpassword",
+        },
+    ).json()
+
+    response = test_app_with_db.post(
+        "/users/batch",
+        json={"ids": [second["id"], 9999], "codes": [first["code"], second["code"]]},
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert [user["id"] for user in data] == [second["id"], first["id"]]
+    assert "X-Trace-ID" in response.headers
+
+
+def test_read_users_batch_too_large(test_app_with_db: TestClient, db_conn: Connection):
+    """
+    Test that oversized batches are rejected.
+    """
+    with patch("app.users.routers.settings.USERS_BATCH_MAX_SIZE", new=2):
+        response = test_app_with_db.post(
+            "/users/batch", json={"ids": [1, 2], "codes": ["abcdefg"]}
+        )
+    assert response.status_code == 400
+    data = response.json()
+    assert data["detail"]["message"] == "At most 2 ids and codes per batch"
+    assert "trace_id" in data["detail"]
+
+
+def test_read_users_json_shape(test_app_with_db: TestClient, db_conn: Connection):
+    """
+    Test that the pre-encoded users listing only exposes public fields.
+    """
+    test_app_with_db.post(
+        "/register",
+        json={
+            "username": "json_user",
+            "email": "json@example.com",
+            "password": "jsonpassword",
+        },
+    )
+
+    response = test_app_with_db.get("/users/")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    data = response.json()
+    assert set(data[0]) == {"id", "username", "email", "code", "avatar_url"}
+    assert data[0]["email"] == "json@example.com"
+
+
+def test_traffic_capture(test_app_with_db: TestClient, db_conn: Connection, tmp_path):
+    """
+    Test that captured traffic keeps the request shape but not credentials.
+    """
+    capture_path = tmp_path / "traffic.jsonl"
+    with patch(
+        "app.middleware.logging.settings.TRAFFIC_CAPTURE_PATH", new=str(capture_path)
+    ):
+        response = test_app_with_db.post(
+            "/register",
+            json={
+                "username": "capture_user",
+                "email": "capture@example.com",
+                "password": "capturepassword",
+            },
+        )
+        get_traffic_capture().wait()
+    assert response.status_code == 201
+
+    lines = capture_path.read_text().splitlines()
+    assert len(lines) == 1
+    record = json.loads(lines[0])
+    assert record["method"] == "POST"
+    assert record["path"] == "/register"
+    assert record["status_code"] == 201
+    assert record["authenticated"] is False
+    assert record["body"]["password"] == "[REDACTED]"
+    assert "capturepassword" not in lines[0]
+
+
+def test_traffic_capture_update_password(
+    test_app_with_db: TestClient, db_conn: Connection, tmp_path
+):
+    """
+    Test that neither the old nor the new password of a password change is
+    captured.
+    """
+    test_app_with_db.post(
+        "/register",
+        json={
+            "username": "capture_change",
+            "email": "capture_change@example.com",
+            "password": "oldcapturepassword",
+        },
+    )
+    token = test_app_with_db.post(
+        "/login",
+        data={
+            "username": "capture_change@example.com",
+            "password": "oldcapturepassword",
+        },
+    ).json()["access_token"]
+
+    capture_path = tmp_path / "traffic.jsonl"
+    with patch(
+        "app.middleware.logging.settings.TRAFFIC_CAPTURE_PATH", new=str(capture_path)
+    ):
+        response = test_app_with_db.post(
+            "/update-password",
+            headers={"Authorization": f"Bearer {token}"},
+            json={
+                "old_password": "oldcapturepassword",
+                "new_password": "newcapturepassword",
+            },
+        )
+        get_traffic_capture().wait()
+    assert response.status_code == 200
+
+    lines = capture_path.read_text().splitlines()
+    assert len(lines) == 1
+    record = json.loads(lines[0])
+    assert record["body"] == {
+        "old_password": "[REDACTED]",
+        "new_password": "[REDACTED]",
+    }
+    assert "capturepassword" not in lines[0]
+
+
+def test_traffic_capture_login(
+    test_app_with_db: TestClient, db_conn: Connection, tmp_path
+):
+    """
+    Test that the email a login form sends as its username isn't captured.
+    """
+    test_app_with_db.post(
+        "/register",
+        json={
+            "username": "capture_login",
+            "email": "capture_login@example.com",
+            "password": "capturepassword",
+        },
+    )
+
+    capture_path = tmp_path / "traffic.jsonl"
+    with patch(
+        "app.middleware.logging.settings.TRAFFIC_CAPTURE_PATH", new=str(capture_path)
+    ):
+        response = test_app_with_db.post(
+            "/login",
+            data={
+                "username": "capture_login@example.com",
+                "password": "capturepassword",
+            },
+        )
+        get_traffic_capture().wait()
+    assert response.status_code == 200
+
+    lines = capture_path.read_text().splitlines()
+    assert len(lines) == 1
+    record = json.loads(lines[0])
+    assert record["body"] == {
+        "form_data": {"username": "[REDACTED]", "password": "[REDACTED]"}
+    }
+    assert "capture_login" not in lines[0]
@@ -0,0 +1,187 @@
+import gzip
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import Response, StreamingResponse
+from fastapi.testclient import TestClient
+
+from app.core.metrics import metrics
+from app.middleware import compression
+from app.middleware.compression import (
+    CompressionMiddleware,
+    available_encodings,
+    negotiate,
+)
+
+ROWS = [{"id": i, "email": f"user{i}@example.com"} for i in range(200)]
+
+
+@pytest.fixture
+def client() -> TestClient:
+    app = FastAPI()
+    app.add_middleware(
+        CompressionMiddleware, encodings=["zstd", "br", "gzip"], minimum_size=512
+    )
+
+    @app.api_route("/large", methods=["GET", "HEAD"])
+    def large():
+        return Response(
+            json.dumps(ROWS),
+            media_type="application/json",
+            headers={"ETag": '"v1"'},
+        )
+
+    @app.get("/small")
+    def small():
+        return {"ok": True}
+
+    @app.get("/image")
+    def image():
+        return Response(b"\x89PNG" * 1000, media_type="image/png")
+
+    @app.get("/stream")
+    def stream():
+        return StreamingResponse(
+            (json.dumps(row).encode() for row in ROWS), media_type="application/json"
+        )
+
+    return TestClient(app)
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, expected",
+    [
+        ("gzip, deflate", "gzip"),
+        ("br;q=0.5, zstd", "zstd"),
+        ("gzip;q=1.0, zstd;q=0.8", "gzip"),
+        ("zstd, br, gzip", "zstd"),
+        ("*", "zstd"),
+        ("*, zstd;q=0", "br"),
+        ("gzip;q=0", None),
+        ("identity", None),
+        ("", None),
+    ],
+)
+def test_negotiate(accept_encoding: str, expected):
+    """
+    Test that the highest q-value wins, ties going to the server's order.
+    """
+    assert negotiate(accept_encoding, ["zstd", "br", "gzip"]) == expected
+
+
+def test_available_encodings_keeps_gzip():
+    """
+    Test that unknown encodings are dropped and gzip is always available.
+    """
+    encodings = available_encodings(["deflate", "gzip"])
+    assert encodings == ["gzip"]
+
+
+def test_compresses_large_json(client: TestClient):
+    """
+    Test that a large JSON body is gzipped and its strong ETag weakened.
+    """
+    before = metrics.get(
+        "http_compression_bytes_total", encoding="gzip", direction="out"
+    )
+    with client.stream("GET", "/large", headers={"Accept-Encoding": "gzip"}) as r:
+        raw = b"".join(r.iter_raw())
+    assert r.headers["Content-Encoding"] == "gzip"
+    assert r.headers["Vary"] == "Accept-Encoding"
+    assert r.headers["ETag"] == 'W/"v1"'
+    assert "Content-Length" not in r.headers
+    assert json.loads(gzip.decompress(raw)) == ROWS
+    assert len(raw) < len(json.dumps(ROWS)) / 3
+    assert metrics.get(
+        "http_compression_bytes_total", encoding="gzip", direction="out"
+    ) == before + len(raw)
+
+
+@pytest.mark.parametrize(
+    "encoding, module",
+    [("zstd", "zstandard"), ("br", "brotli")],
+)
+def test_compresses_with_optional_encodings(
+    client: TestClient, encoding: str, module: str
+):
+    """
+    Test zstd and br negotiation and round trips, when their package is
+    installed.
+    """
+    package = pytest.importorskip(module)
+    with client.stream(
+        "GET", "/large", headers={"Accept-Encoding": f"gzip;q=0.5, {encoding}"}
+    ) as r:
+        raw = b"".join(r.iter_raw())
+    assert r.headers["Content-Encoding"] == encoding
+    if encoding == "zstd":
+        body = package.ZstdDecompressor().decompressobj().decompress(raw)
+    else:
+        body = package.decompress(raw)
+    assert json.loads(body) == ROWS
+
+
+def test_logs_unavailable_encodings(monkeypatch):
+    """
+    Test that a configured encoding that can't be used is logged once, when
+    the middleware is built, and skipped.
+    """
+    warnings = []
+
+    class Logger:
+        def warning(self, message):
+            warnings.append(message)
+
+    monkeypatch.setitem(
+        compression.COMPRESSORS, "zstd", (compression._zstd, "missing_zstandard")
+    )
+    middleware = CompressionMiddleware(
+        FastAPI(), ["zstd", "deflate", "gzip"], minimum_size=512, logger=Logger()
+    )
+
+    assert middleware.encodings == ["gzip"]
+    assert [(w["encoding"], w["reason"]) for w in warnings] == [
+        ("zstd", "missing_zstandard is not installed"),
+        ("deflate", "unknown encoding"),
+    ]
+
+
+def test_compresses_streamed_body(client: TestClient):
+    """
+    Test that a streamed body is compressed chunk by chunk.
+    """
+    with client.stream("GET", "/stream", headers={"Accept-Encoding": "gzip"}) as r:
+        raw = b"".join(r.iter_raw())
+    assert r.headers["Content-Encoding"] == "gzip"
+    expected = b"".join(json.dumps(row).encode() for row in ROWS)
+    assert gzip.decompress(raw) == expected
+
+
+@pytest.mark.parametrize(
+    "path, accept_encoding, vary",
+    [
+        ("/small", "gzip", True),
+        ("/image", "gzip", False),
+        ("/large", "identity", True),
+    ],
+)
+def test_passes_through(client: TestClient, path: str, accept_encoding: str, vary):
+    """
+    Test that small bodies, non-text types and clients without a supported
+    encoding get the response as is.
+    """
+    response = client.get(path, headers={"Accept-Encoding": accept_encoding})
+    assert response.status_code == 200
+    assert "Content-Encoding" not in response.headers
+    assert response.headers["Content-Length"] == str(len(response.content))
+    assert ("Vary" in response.headers) == vary
+
+
+def test_head_is_not_compressed(client: TestClient):
+    """
+    Test that HEAD keeps the uncompressed Content-Length.
+    """
+    response = client.head("/large", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+    assert response.headers["Content-Length"] == str(len(json.dumps(ROWS)))
@@ -1,13 +1,27 @@
+import io
+import multiprocessing
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta, timezone
 from unittest.mock import patch
+from uuid import uuid4
 
 from jwt import decode
+from passlib import hash as passlib_hash
 from psycopg import Connection
 from psycopg.errors import UniqueViolation
 
+from app.core.metrics import metrics
 from app.dependencies.logger import get_app_logger
 from app.settings import settings
+from app.users import bulk_import
 from app.users import services as user_service
-from app.users.models import UserCreate, UserInDB
+from app.users import storage as user_storage
+from app.users.loader import UserLoader
+from app.users.models import UserCreate, UserRow
+
+
+def uow(conn: Connection) -> user_service.UnitOfWork:
+    return user_service.UnitOfWork(lambda: nullcontext(conn), "test")
 
 
 def test_create_user_service(db_conn: Connection):
@@ -21,7 +35,7 @@ def test_create_user_service(db_conn: Connection):
 
     logger = get_app_logger("test.service.create_user")
     created_user, err = user_service.create_user(
-        db_conn, user_to_create, "dummy_trace_id", logger
+        uow(db_conn), user_to_create, "dummy_trace_id", logger
     )
 
     assert err is None
@@ -49,11 +63,11 @@ def test_authenticate_user_service(db_conn: Connection):
         username="auth_user", email="auth@example.com", password="correct_password"
     )
     logger = get_app_logger("test.service.authenticate_user")
-    user_service.create_user(db_conn, user_to_create, "dummy_trace_id", logger)
+    user_service.create_user(uow(db_conn), user_to_create, "dummy_trace_id", logger)
 
     # Test successful authentication
     authenticated_user, err = user_service.authenticate_user(
-        db_conn, user_to_create.email, "correct_password", "dummy_trace_id", logger
+        uow(db_conn), user_to_create.email, "correct_password", "dummy_trace_id", logger
     )
     assert err is None
     assert authenticated_user is not None
@@ -61,7 +75,7 @@ def test_authenticate_user_service(db_conn: Connection):
 
     # Test failed authentication (wrong password)
     unauthenticated_user, err = user_service.authenticate_user(
-        db_conn, user_to_create.email, "wrong_password", "dummy_trace_id", logger
+        uow(db_conn), user_to_create.email, "wrong_password", "dummy_trace_id", logger
     )
     assert unauthenticated_user is None
     assert err is not None
@@ -99,17 +113,18 @@ def test_create_user_with_retry(db_conn: Connection):
             1,  # Simulate successful creation on the third attempt
         ]
 
-        mock_get_user_by_id.return_value = UserInDB(
+        mock_get_user_by_id.return_value = UserRow(
             id=1,
             username=user_to_create.username,
             email=user_to_create.email,
             code="testcode",
             hashed_password="hashed_password",
             avatar_url="",
+            updated_at=datetime.now(timezone.utc),
         )
 
         created_user, err = user_service.create_user(
-            db_conn, user_to_create, "dummy_trace_id", logger
+            uow(db_conn), user_to_create, "dummy_trace_id", logger
         )
 
         # Assert that the service retried 3 times
@@ -120,58 +135,158 @@ def test_create_user_with_retry(db_conn: Connection):
         assert created_user.email == user_to_create.email
 
 
-def test_get_user_by_email_service(db_conn: Connection):
+def test_update_password_service(db_conn: Connection):
     """
-    Test the get user by email service.
+    Test the update password service.
     """
     user_to_create = UserCreate(
         username="get_user_service",
         email="get_user@example.com",
         password="password",
     )
-    logger = get_app_logger("test.service.get_user_by_email")
-    user_service.create_user(db_conn, user_to_create, "dummy_trace_id", logger)
-
-    # Test found
-    found_user, err = user_service.get_user_by_email(
-        db_conn, user_to_create.email, "dummy_trace_id", logger
+    logger = get_app_logger("test.service.update_password")
+    new_user, err = user_service.create_user(
+        uow(db_conn), user_to_create, "dummy_trace_id", logger
     )
     assert err is None
-    assert found_user is not None
-    assert found_user.email == user_to_create.email
 
-    # Test not found
-    not_found_user, err = user_service.get_user_by_email(
-        db_conn, "nonexistent@example.com", "dummy_trace_id", logger
+    result, err = user_service.update_password(
+        uow(db_conn),
+        new_user.id,
+        "password",
+        "new_password",
+        "dummy_trace_id",
+        logger,
     )
-    assert isinstance(err, ValueError)
-    assert str(err) == "User not found"
-    assert not_found_user is None
+    assert result is True
+    assert err is None
 
 
-def test_update_password_service(db_conn: Connection):
+def test_update_password_concurrent_change(db_conn: Connection):
     """
-    Test the update password service.
+    Test that a password changed between the old password's check and the
+    update is kept, since the old password was verified against its
+    previous hash.
     """
-    user_to_create = UserCreate(
-        username="get_user_service",
-        email="get_user@example.com",
-        password="password",
+    logger = get_app_logger("test.service.update_password_concurrent")
+    created, _ = user_service.create_user(
+        uow(db_conn),
+        UserCreate(username="racer", email="racer@example.com", password="password"),
+        "dummy_trace_id",
+        logger,
     )
-    logger = get_app_logger("test.service.get_user_by_email")
-    user_service.create_user(db_conn, user_to_create, "dummy_trace_id", logger)
+    hash_password = user_service.pwd_context.hash
 
-    # Test found
-    found_user, err = user_service.get_user_by_email(
-        db_conn, user_to_create.email, "dummy_trace_id", logger
-    )
-    assert err is None
+    def hash_and_change(password: str) -> str:
+        user_storage.update_password(
+            db_conn, created.id, hash_password("other"), "dummy_trace_id", logger
+        )
+        return hash_password(password)
 
-    result, err = user_service.update_password(
-        db_conn, found_user.id, "password", "new_password", "dummy_trace_id", logger
+    with patch.object(user_service.pwd_context, "hash", side_effect=hash_and_change):
+        result, err = user_service.update_password(
+            uow(db_conn), created.id, "password", "new", "dummy_trace_id", logger
+        )
+
+    assert result is False
+    assert str(err) == "Failed to update password"
+    stored = user_storage.get_user_by_id(db_conn, created.id, "dummy_trace_id", logger)
+    assert user_service.pwd_context.verify("other", stored.hashed_password)
+
+
+def test_unit_of_work_hashes_without_connection(db_conn: Connection):
+    """
+    Test that passwords are hashed and verified with no connection checked
+    out, and that each checkout's hold time is recorded for the route.
+    """
+    logger = get_app_logger("test.service.unit_of_work")
+    held = []
+
+    @contextmanager
+    def get_connection():
+        held.append(db_conn)
+        try:
+            yield db_conn
+        finally:
+            held.pop()
+
+    unit = user_service.UnitOfWork(get_connection, "/test")
+    hasher = user_service.pwd_context
+    calls = []
+
+    def record(fn):
+        def wrapper(*args):
+            calls.append((fn.__name__, len(held)))
+            return fn(*args)
+
+        return wrapper
+
+    metrics.reset()
+    with patch.object(hasher, "hash", record(hasher.hash)), patch.object(
+        hasher, "verify", record(hasher.verify)
+    ):
+        created, err = user_service.create_user(
+            unit,
+            UserCreate(username="uow", email="uow@example.com", password="old"),
+            "dummy_trace_id",
+            logger,
+        )
+        assert err is None
+        user, err = user_service.authenticate_user(
+            unit, "uow@example.com", "old", "dummy_trace_id", logger
+        )
+        assert err is None
+        result, err = user_service.update_password(
+            unit, created.id, "old", "new", "dummy_trace_id", logger
+        )
+        assert result is True
+
+    assert calls == [("hash", 0), ("verify", 0), ("verify", 0), ("hash", 0)]
+    timings = metrics.snapshot()["timings"]
+    # create, authenticate, and update_password's read and write
+    assert timings['db_connection_hold_seconds{route="/test"}']["count"] == 4
+    assert timings['db_connection_wait_seconds{route="/test"}']["count"] == 4
+
+
+def test_issue_tokens_purges_expired_refresh_tokens(db_conn: Connection):
+    """
+    Test that logins purge expired refresh tokens a batch at a time, again on
+    the next login while batches come back full, then only once the purge
+    interval has passed.
+    """
+    logger = get_app_logger("test.service.purge_refresh_tokens")
+    user, _ = user_service.create_user(
+        uow(db_conn),
+        UserCreate(username="purger", email="purger@example.com", password="pw"),
+        "dummy_trace_id",
+        logger,
     )
-    assert result is True
-    assert err is None
+    expired = datetime.now(timezone.utc) - timedelta(days=1)
+
+    def add_expired(count: int):
+        for _ in range(count):
+            user_storage.insert_refresh_token(
+                db_conn, uuid4(), uuid4(), user.id, expired, "dummy_trace_id", logger
+            )
+
+    def count_expired() -> int:
+        return db_conn.execute(
+            "SELECT count(*) AS n FROM refresh_tokens WHERE expires_at <= now();"
+        ).fetchone()["n"]
+
+    add_expired(3)
+    with patch.object(user_service, "_next_token_purge", 0.0), patch.object(
+        user_service.settings, "REFRESH_TOKEN_PURGE_BATCH_SIZE", 2
+    ):
+        user_service.issue_tokens(uow(db_conn), user, "dummy_trace_id", logger)
+        assert count_expired() == 1
+        # The batch was full, so the next login purges too
+        user_service.issue_tokens(uow(db_conn), user, "dummy_trace_id", logger)
+        assert count_expired() == 0
+        # It wasn't, so the purge waits for REFRESH_TOKEN_PURGE_SECONDS
+        add_expired(1)
+        user_service.issue_tokens(uow(db_conn), user, "dummy_trace_id", logger)
+        assert count_expired() == 1
 
 
 def test_get_user_by_id_service(db_conn: Connection):
@@ -185,7 +300,7 @@ def test_get_user_by_id_service(db_conn: Connection):
     )
     logger = get_app_logger("test.service.get_user_by_email")
     new_user, err = user_service.create_user(
-        db_conn, user_to_create, "dummy_trace_id", logger
+        uow(db_conn), user_to_create, "dummy_trace_id", logger
     )
     assert err is None
 
@@ -216,7 +331,7 @@ def test_update_avatar_url_service(db_conn: Connection):
     logger = get_app_logger("test.service.update_avatar_url")
     # Create user
     created_user, err = user_service.create_user(
-        db_conn, user_to_create, "dummy_trace_id", logger
+        uow(db_conn), user_to_create, "dummy_trace_id", logger
     )
     assert err is None
     assert created_user is not None
@@ -245,3 +360,147 @@ def test_update_avatar_url_service(db_conn: Connection):
     assert result is False
     assert isinstance(err, ValueError)
     assert str(err) == "User not found"
+
+
+def test_user_loader_coalesces_lookups(db_conn: Connection):
+    """
+    Test that the loader resolves keys primed by different callers in one query
+    and serves repeated keys, including the batch call, from its cache.
+    """
+    logger = get_app_logger("test.service.user_loader")
+    first, _ = user_service.create_user(
+        uow(db_conn),
+        UserCreate(username="loader_1", email="loader1@example.com", password="pw"),
+        "dummy_trace_id",
+        logger,
+    )
+    second, _ = user_service.create_user(
+        uow(db_conn),
+        UserCreate(username="loader_2", email="loader2@example.com", password="pw"),
+        "dummy_trace_id",
+        logger,
+    )
+
+    loader = UserLoader(lambda: nullcontext(db_conn), "dummy_trace_id", logger)
+    loader.prime(ids=[first.id])
+    loader.prime(codes=[second.code])
+
+    with patch(
+        "app.users.storage.get_users_by_ids_or_codes",
+        wraps=user_storage.get_users_by_ids_or_codes,
+    ) as batch_query:
+        assert loader.load_by_code(second.code).id == second.id
+        assert loader.load_by_id(first.id).email == first.email
+        assert loader.load_by_id(first.id).email == first.email
+
+        users = user_service.get_users_batch(
+            loader,
+            [second.id, first.id, first.id],
+            [first.code],
+            "dummy_trace_id",
+            logger,
+        )
+
+    assert batch_query.call_count == 1
+    assert [user.id for user in users] == [second.id, first.id]
+
+
+def test_bulk_import_reports_every_line(db_conn: Connection):
+    """
+    Test importing a CSV file: hashed passwords, one report entry per line.
+    """
+    source = io.StringIO(
+        "username,email,password\n"
+        "bulk_1,bulk_1@example.com,secret_1\n"
+        "bulk_2,bulk_2@example.com,\n"
+        "bulk_3,bulk_1@example.com,secret_3\n"
+        "bulk_4,bulk_4@example.com,secret_4\n"
+    )
+    logger = get_app_logger("test.service.bulk_import")
+
+    report = list(
+        bulk_import.import_users(
+            db_conn,
+            bulk_import.read_records(source, "csv"),
+            "dummy_trace_id",
+            logger,
+            batch_size=2,
+            workers=2,
+        )
+    )
+
+    assert sorted((entry["line"], entry["status"]) for entry in report) == [
+        (2, "created"),
+        (3, "created"),
+        (4, "rejected"),
+        (5, "created"),
+    ]
+    db_user = user_storage.get_user_by_email(
+        db_conn, "bulk_4@example.com", "dummy_trace_id", logger
+    )
+    assert user_service.pwd_context.verify("secret_4", db_user.hashed_password)
+
+
+def test_bulk_import_workers_hash_at_configured_cost():
+    """
+    Test that spawned pool workers hash with the parent's scheme and cost.
+    """
+    pwd_context = user_service.pwd_context
+    scheme, cost = pwd_context.scheme, pwd_context.cost
+    pwd_context.configure("pbkdf2_sha256", 1000)
+    try:
+        with bulk_import.hash_executor(
+            1, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            [hashed] = executor.submit(bulk_import.hash_passwords, ["secret"]).result()
+    finally:
+        pwd_context.configure(scheme, cost)
+
+    assert passlib_hash.pbkdf2_sha256.from_string(hashed).rounds == 1000
+
+
+def test_bulk_import_read_records_ndjson():
+    """
+    Test that malformed NDJSON lines are reported rather than aborting.
+    """
+    source = io.StringIO(
+        '{"username": "a", "email": "a@example.com", "password": "p"}\n'
+        "not json\n"
+        "\n"
+        '{"username": "b", "email": "b@example.com"}\n'
+    )
+    records = list(bulk_import.read_records(source, "ndjson"))
+
+    assert [line for line, _ in records] == [1, 2, 4]
+    assert records[0][1].username == "a"
+    assert records[1][1].startswith("Invalid JSON")
+    assert records[2][1].startswith("password:")
+
+
+def test_authenticate_user_rehashes_outdated_hash(db_conn: Connection):
+    """
+    Test that a successful login upgrades a cheaper hash in the background.
+    """
+    logger = get_app_logger("test.service.rehash")
+    user = UserCreate(username="rehash", email="rehash@example.com", password="x")
+    user.code = "REHASH1"
+    old_hash = passlib_hash.pbkdf2_sha256.using(rounds=1000).hash("old_secret")
+    user_id = user_storage.create_user(
+        db_conn, user, old_hash, "dummy_trace_id", logger
+    )
+
+    with patch.object(
+        user_service, "get_connection_context", lambda: nullcontext(db_conn)
+    ):
+        authenticated, err = user_service.authenticate_user(
+            uow(db_conn), "rehash@example.com", "old_secret", "dummy_trace_id", logger
+        )
+        user_service.password_rehasher.wait()
+
+    assert err is None and authenticated.id == user_id
+    new_hash = user_storage.get_user_by_id(
+        db_conn, user_id, "dummy_trace_id", logger
+    ).hashed_password
+    assert new_hash != old_hash
+    assert user_service.pwd_context.verify("old_secret", new_hash)
+    assert not user_service.pwd_context.needs_update(new_hash)
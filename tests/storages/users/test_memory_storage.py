@@ -0,0 +1,268 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+from uuid import uuid4
+
+import pytest
+from psycopg.errors import UniqueViolation
+
+from app.dependencies.logger import get_app_logger
+from app.users import common, memory_storage
+from app.users import services as user_service
+from app.users.models import UserCreate
+
+logger = get_app_logger("test.memory_storage")
+
+
+def _create(conn, username: str, email: str, code: str = None) -> int:
+    user = UserCreate(username=username, email=email, password="password")
+    user.code = code or common.generate_user_code()
+    return memory_storage.create_user(conn, user, "hashed", "dummy_trace_id", logger)
+
+
+def test_memory_create_and_get_user():
+    """
+    Test that created users can be read back by email, id and code.
+    """
+    conn = memory_storage.connect(memory_storage.MemoryDatabase())
+    user_id = _create(conn, "memory_user", "memory@example.com", "abcdefg")
+
+    by_email = memory_storage.get_user_by_email(
+        conn, "memory@example.com", "dummy_trace_id", logger
+    )
+    assert by_email.id == user_id
+    assert by_email.hashed_password == "hashed"
+    assert memory_storage.get_user_by_id(conn, user_id, "dummy_trace_id", logger) == (
+        by_email
+    )
+    assert memory_storage.get_users_by_ids_or_codes(
+        conn, [9999], ["abcdefg"], "dummy_trace_id", logger
+    ) == [by_email]
+    assert memory_storage.get_public_users(conn, "dummy_trace_id", logger)[0] == {
+        "id": user_id,
+        "username": "memory_user",
+        "email": "memory@example.com",
+        "code": "abcdefg",
+        "avatar_url": None,
+    }
+
+
+@pytest.mark.parametrize(
+    "username, email, code",
+    [
+        ("memory_user", "other@example.com", "bbbbbbb"),
+        ("other_user", "memory@example.com", "bbbbbbb"),
+        ("other_user", "other@example.com", "aaaaaaa"),
+    ],
+)
+def test_memory_unique_constraints(username: str, email: str, code: str):
+    """
+    Test that email, username and code are unique.
+    """
+    conn = memory_storage.connect(memory_storage.MemoryDatabase())
+    _create(conn, "memory_user", "memory@example.com", "aaaaaaa")
+
+    with pytest.raises(UniqueViolation):
+        _create(conn, username, email, code)
+
+
+def test_memory_transaction_rollback():
+    """
+    Test that a failing transaction block reverts its writes.
+    """
+    conn = memory_storage.connect(memory_storage.MemoryDatabase())
+    user_id = _create(conn, "memory_user", "memory@example.com")
+    conn.commit()
+
+    with pytest.raises(RuntimeError):
+        with conn.transaction():
+            memory_storage.update_avatar_url(
+                conn, user_id, "https://example.com/a.png", "dummy_trace_id", logger
+            )
+            _create(conn, "second_user", "second@example.com")
+            raise RuntimeError("abort")
+
+    user = memory_storage.get_user_by_id(conn, user_id, "dummy_trace_id", logger)
+    assert user.avatar_url is None
+    assert (
+        memory_storage.get_user_by_email(
+            conn, "second@example.com", "dummy_trace_id", logger
+        )
+        is None
+    )
+
+
+def test_memory_lock_user_blocks_other_connection():
+    """
+    Test that a locked row blocks other connections until commit.
+    """
+    db = memory_storage.MemoryDatabase()
+    first = memory_storage.connect(db)
+    second = memory_storage.connect(db)
+    user_id = _create(first, "memory_user", "memory@example.com")
+    first.commit()
+
+    assert memory_storage.lock_user(first, user_id, "dummy_trace_id", logger)
+    acquired = threading.Event()
+
+    def lock_second():
+        with second.transaction():
+            memory_storage.lock_user(second, user_id, "dummy_trace_id", logger)
+            acquired.set()
+
+    thread = threading.Thread(target=lock_second)
+    thread.start()
+    time.sleep(0.2)
+    assert not acquired.is_set()
+
+    first.commit()
+    thread.join(timeout=2)
+    assert acquired.is_set()
+
+
+def test_memory_backend_create_user_service():
+    """
+    Test the create_user service against the in-memory backend, including
+    the retry on a code collision.
+    """
+    conn = memory_storage.connect(memory_storage.MemoryDatabase())
+    _create(conn, "memory_user", "memory@example.com", "aaaaaaa")
+    uow = user_service.UnitOfWork(lambda: conn, "test")
+    codes = iter(["aaaaaaa", "bbbbbbb"])
+
+    with patch.object(user_service, "user_storage", memory_storage), patch(
+        "app.users.services.common.generate_user_code", side_effect=lambda: next(codes)
+    ):
+        created_user, err = user_service.create_user(
+            uow,
+            UserCreate(
+                username="service_user",
+                email="service@example.com",
+                password="plain_password",
+            ),
+            "dummy_trace_id",
+            logger,
+        )
+        user, _ = user_service.authenticate_user(
+            uow, "service@example.com", "plain_password", "dummy_trace_id", logger
+        )
+
+    assert err is None
+    assert created_user.code == "bbbbbbb"
+    assert user.id == created_user.id
+
+
+def test_memory_replace_password_hash():
+    """
+    Test that the hash is replaced only while it still matches.
+    """
+    conn = memory_storage.connect(memory_storage.MemoryDatabase())
+    user_id = _create(conn, "memory_user", "memory@example.com")
+    conn.commit()
+
+    assert not memory_storage.replace_password_hash(
+        conn, user_id, "stale", "new", "dummy_trace_id", logger
+    )
+    assert memory_storage.replace_password_hash(
+        conn, user_id, "hashed", "new", "dummy_trace_id", logger
+    )
+    conn.rollback()
+    row = memory_storage.get_user_by_id(conn, user_id, "dummy_trace_id", logger)
+    assert row.hashed_password == "hashed"
+
+
+def test_memory_rotate_refresh_token():
+    """
+    Test rotation, reuse and family revocation, and that rollback undoes them.
+    """
+    conn = memory_storage.connect(memory_storage.MemoryDatabase())
+    user_id = _create(conn, "memory_user", "memory@example.com")
+    family_id, first, second = uuid4(), uuid4(), uuid4()
+    expires_at = datetime.now(timezone.utc) + timedelta(days=1)
+    memory_storage.insert_refresh_token(
+        conn, first, family_id, user_id, expires_at, "dummy_trace_id", logger
+    )
+    conn.commit()
+
+    row = memory_storage.rotate_refresh_token(
+        conn, first, second, expires_at, "dummy_trace_id", logger
+    )
+    assert row.id == user_id
+    assert (
+        memory_storage.rotate_refresh_token(
+            conn, first, uuid4(), expires_at, "dummy_trace_id", logger
+        )
+        is None
+    )
+    assert (
+        memory_storage.revoke_token_family(conn, family_id, "dummy_trace_id", logger)
+        == 2
+    )
+    assert memory_storage.is_token_family_revoked(
+        conn, family_id, "dummy_trace_id", logger
+    )
+    assert [
+        family
+        for family, _ in memory_storage.get_revoked_token_families(
+            conn, None, "dummy_trace_id", logger
+        )
+    ] == [family_id]
+
+    conn.rollback()
+    token = memory_storage.get_refresh_token(conn, first, "dummy_trace_id", logger)
+    assert token["used_at"] is None and token["revoked_at"] is None
+    assert (
+        memory_storage.get_refresh_token(conn, second, "dummy_trace_id", logger) is None
+    )
+
+
+def test_memory_purge_expired_refresh_tokens():
+    """
+    Test that the purge drops expired tokens only, and that rollback restores
+    them.
+    """
+    conn = memory_storage.connect(memory_storage.MemoryDatabase())
+    user_id = _create(conn, "purge_user", "purge@example.com")
+    now = datetime.now(timezone.utc)
+    expired, live = uuid4(), uuid4()
+    for jti, expires_at in [
+        (expired, now - timedelta(days=1)),
+        (live, now + timedelta(days=1)),
+    ]:
+        memory_storage.insert_refresh_token(
+            conn, jti, uuid4(), user_id, expires_at, "dummy_trace_id", logger
+        )
+    conn.commit()
+
+    assert (
+        memory_storage.purge_expired_refresh_tokens(conn, 10, "dummy_trace_id", logger)
+        == 1
+    )
+    assert (
+        memory_storage.get_refresh_token(conn, expired, "dummy_trace_id", logger)
+        is None
+    )
+    assert memory_storage.get_refresh_token(conn, live, "dummy_trace_id", logger)
+
+    conn.rollback()
+    assert memory_storage.get_refresh_token(conn, expired, "dummy_trace_id", logger)
+
+
+def test_memory_updates_move_row_version():
+    """
+    Test that updates set updated_at, which the list version follows.
+    """
+    conn = memory_storage.connect(memory_storage.MemoryDatabase())
+    user_id = _create(conn, "memory_user", "memory@example.com")
+    created = memory_storage.get_user_by_id(conn, user_id, "dummy_trace_id", logger)
+    version = memory_storage.get_public_users_version(conn, "dummy_trace_id", logger)
+
+    memory_storage.update_avatar_url(conn, user_id, "a.jpg", "dummy_trace_id", logger)
+
+    row = memory_storage.get_user_by_id(conn, user_id, "dummy_trace_id", logger)
+    assert row.updated_at > created.updated_at
+    assert (
+        memory_storage.get_public_users_version(conn, "dummy_trace_id", logger)
+        != version
+    )
@@ -0,0 +1,116 @@
+import uuid
+from unittest.mock import patch
+
+import pytest
+from psycopg import Connection
+from psycopg.errors import UniqueViolation
+from psycopg_pool import ConnectionPool
+
+from app.core.migrations import migrate
+from app.dependencies.logger import get_app_logger
+from app.users import common
+from app.users import storage as user_storage
+from app.users.models import UserCreate
+
+
+@pytest.fixture
+def partitioned_conn(db_pool: ConnectionPool):
+    """
+    A connection to a scratch schema migrated with the partitioned layout,
+    whatever USERS_TABLE_LAYOUT the session runs with.
+    """
+    schema_name = f"test_{uuid.uuid4().hex[:8]}"
+    with patch("app.core.migrations.settings.USERS_TABLE_LAYOUT", "partitioned"):
+        with patch("app.users.storage.settings.USERS_TABLE_LAYOUT", "partitioned"):
+            with db_pool.connection() as conn:
+                conn.execute(f"CREATE SCHEMA {schema_name};")
+                conn.execute(f"SET search_path TO {schema_name};")
+                conn.commit()
+                migrate(conn)
+                conn.autocommit = False
+                try:
+                    yield conn
+                finally:
+                    conn.rollback()
+                    conn.execute(f"DROP SCHEMA IF EXISTS {schema_name} CASCADE;")
+                    conn.commit()
+
+
+def _create(conn: Connection, username: str, email: str, code: str = None) -> int:
+    user = UserCreate(username=username, email=email, password="password")
+    user.code = code or common.generate_user_code()
+    return user_storage.create_user(
+        conn,
+        user,
+        "a_very_hashed_password",
+        "dummy_trace_id",
+        get_app_logger("test.storage.partitioned"),
+    )
+
+
+def test_partitioned_lookups(partitioned_conn: Connection):
+    """
+    Test that every lookup resolves through the partitioned layout.
+    """
+    logger = get_app_logger("test.storage.partitioned")
+    user_id = _create(partitioned_conn, "part_user", "Part@example.com", "PART001")
+    other_id = _create(partitioned_conn, "other_user", "other@example.com")
+
+    by_email = user_storage.get_user_by_email(
+        partitioned_conn, "Part@example.com", "dummy_trace_id", logger
+    )
+    by_email_ci = user_storage.get_user_by_email_ci(
+        partitioned_conn, "part@EXAMPLE.com", "dummy_trace_id", logger
+    )
+    by_id = user_storage.get_user_by_id(
+        partitioned_conn, user_id, "dummy_trace_id", logger
+    )
+    batch = user_storage.get_users_by_ids_or_codes(
+        partitioned_conn, [other_id], ["PART001"], "dummy_trace_id", logger
+    )
+
+    assert by_email == by_email_ci == by_id
+    assert by_id.code == "PART001"
+    assert [row.id for row in batch] == sorted([user_id, other_id])
+
+
+@pytest.mark.parametrize(
+    "username,email,code",
+    [
+        ("second", "part@example.com", None),
+        ("part_user", "second@example.com", None),
+        ("second", "second@example.com", "PART001"),
+    ],
+)
+def test_partitioned_unique_violation(
+    partitioned_conn: Connection, username: str, email: str, code: str
+):
+    """
+    Test that the lookup tables enforce uniqueness across partitions.
+    """
+    _create(partitioned_conn, "part_user", "part@example.com", "PART001")
+    with pytest.raises(UniqueViolation):
+        _create(partitioned_conn, username, email, code)
+
+
+def test_partitioned_email_lookup_scans_one_partition(partitioned_conn: Connection):
+    """
+    Test that the email lookup prunes all but one partition at run time.
+    """
+    for i in range(32):
+        _create(partitioned_conn, f"user_{i}", f"user_{i}@example.com")
+    partitioned_conn.execute("ANALYZE users;")
+
+    row = partitioned_conn.execute(
+        "EXPLAIN (ANALYZE, COSTS OFF, TIMING OFF, SUMMARY OFF, FORMAT TEXT) "
+        + user_storage.get_statements()["get_user_by_email"],
+        {"email": "user_7@example.com"},
+    ).fetchall()
+    plan = "\n".join(line["QUERY PLAN"] for line in row)
+
+    executed = [
+        line
+        for line in plan.splitlines()
+        if "on users_p" in line and "(never executed)" not in line
+    ]
+    assert len(executed) == 1, plan
@@ -1,13 +1,18 @@
 import threading
 import time
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+from uuid import uuid4
 
+import pytest
 from psycopg import Connection
 from psycopg_pool import ConnectionPool
 
 from app.dependencies.logger import get_app_logger
+from app.settings import settings
 from app.users import common
 from app.users import storage as user_storage
-from app.users.models import UserCreate, UserInDB
+from app.users.models import UserCreate, UserRow
 
 
 def test_create_user_and_get_user_by_id(db_conn: Connection):
@@ -26,13 +31,14 @@ def test_create_user_and_get_user_by_id(db_conn: Connection):
         db_conn, user_to_create, hashed_password, "dummy_trace_id", logger
     )
 
-    expected_user = UserInDB(
+    expected_user = UserRow(
         id=created_user_id,
         username=user_to_create.username,
         email=user_to_create.email,
         code=user_to_create.code,
         hashed_password=hashed_password,
         avatar_url=None,
+        updated_at=None,
     )
 
     retrieved_user = user_storage.get_user_by_id(
@@ -40,7 +46,8 @@ def test_create_user_and_get_user_by_id(db_conn: Connection):
     )
 
     assert created_user_id != 0
-    assert retrieved_user == expected_user
+    assert retrieved_user.updated_at is not None
+    assert retrieved_user._replace(updated_at=None) == expected_user
 
 
 def test_get_user_by_email(db_conn: Connection):
@@ -252,17 +259,21 @@ def test_update_avatar_url(db_conn: Connection):
         db_conn, user_to_create, hashed_password, "dummy_trace_id", logger
     )
 
+    created_user = user_storage.get_user_by_id(
+        db_conn, created_user_id, "dummy_trace_id", logger
+    )
     update_avatar = user_storage.update_avatar_url(
         db_conn, created_user_id, "avatar.jpg", "dummy_trace_id", logger
     )
 
-    expected_user = UserInDB(
+    expected_user = UserRow(
         id=created_user_id,
         username=user_to_create.username,
         email=user_to_create.email,
         code=user_to_create.code,
         hashed_password=hashed_password,
         avatar_url="avatar.jpg",
+        updated_at=None,
     )
 
     retrieved_user = user_storage.get_user_by_id(
@@ -270,4 +281,343 @@ def test_update_avatar_url(db_conn: Connection):
     )
 
     assert update_avatar is True
-    assert retrieved_user == expected_user
+    assert retrieved_user._replace(updated_at=None) == expected_user
+    # Updates move the row's version
+    assert retrieved_user.updated_at > created_user.updated_at
+
+
+def test_hot_statements_are_prepared(db_conn: Connection):
+    """
+    Test that hot lookups are prepared once on the connection and reused.
+    """
+    user_to_create = UserCreate(
+        username="storage_user", email="storage@example.com", password="password"
+    )
+    user_to_create.code = common.generate_user_code()
+
+    logger = get_app_logger("test.storage.hot_statements_are_prepared")
+    created_user_id = user_storage.create_user(
+        db_conn, user_to_create, "a_very_hashed_password", "dummy_trace_id", logger
+    )
+
+    for _ in range(3):
+        retrieved_user = user_storage.get_user_by_email(
+            db_conn, "storage@example.com", "dummy_trace_id", logger
+        )
+        assert retrieved_user.id == created_user_id
+
+    prepared = db_conn.execute(
+        "SELECT count(*) AS total FROM pg_prepared_statements WHERE statement = %s;",
+        (
+            user_storage.get_statements()["get_user_by_email"].replace(
+                "%(email)s", "$1"
+            ),
+        ),
+    ).fetchone()
+    assert prepared["total"] == 1
+
+
+def test_lookup_with_prepared_statements_disabled(db_conn: Connection):
+    """
+    Test that lookups still work with prepared statements switched off.
+    """
+    logger = get_app_logger("test.storage.lookup_with_prepared_statements_disabled")
+    user_to_create = UserCreate(
+        username="storage_user", email="storage@example.com", password="password"
+    )
+    user_to_create.code = common.generate_user_code()
+    created_user_id = user_storage.create_user(
+        db_conn, user_to_create, "a_very_hashed_password", "dummy_trace_id", logger
+    )
+
+    with patch("app.users.storage.settings.DB_PREPARED_STATEMENTS", new=False):
+        retrieved_user = user_storage.get_user_by_id(
+            db_conn, created_user_id, "dummy_trace_id", logger
+        )
+    assert retrieved_user is not None
+    assert retrieved_user.email == "storage@example.com"
+
+
+def test_get_users_by_ids_or_codes(db_conn: Connection):
+    """
+    Test resolving several users by id and code in one query.
+    """
+    logger = get_app_logger("test.storage.get_users_by_ids_or_codes")
+    created = []
+    for i in range(3):
+        user_to_create = UserCreate(
+            username=f"batch_user_{i}",
+            email=f"batch{i}@example.com",
+            password="password",
+        )
+        user_to_create.code = common.generate_user_code()
+        user_id = user_storage.create_user(
+            db_conn, user_to_create, "hashed_password", "dummy_trace_id", logger
+        )
+        created.append((user_id, user_to_create.code))
+
+    users = user_storage.get_users_by_ids_or_codes(
+        db_conn,
+        [created[0][0], 9999],
+        [created[1][1], created[0][1], "missing"],
+        "dummy_trace_id",
+        logger,
+    )
+    assert sorted(user.id for user in users) == [created[0][0], created[1][0]]
+
+
+def test_get_user_by_email_ci(db_conn: Connection):
+    """
+    Test the case-insensitive lookup, preferring an exact match.
+    """
+    logger = get_app_logger("test.storage.get_user_by_email_ci")
+    ids = {}
+    for username, email in (
+        ("upper_user", "Case@Example.com"),
+        ("lower_user", "case@example.com"),
+    ):
+        user_to_create = UserCreate(username=username, email=email, password="password")
+        user_to_create.code = common.generate_user_code()
+        ids[email] = user_storage.create_user(
+            db_conn, user_to_create, "hashed_password", "dummy_trace_id", logger
+        )
+
+    exact = user_storage.get_user_by_email_ci(
+        db_conn, "Case@Example.com", "dummy_trace_id", logger
+    )
+    assert exact.id == ids["Case@Example.com"]
+    other_case = user_storage.get_user_by_email_ci(
+        db_conn, "CASE@EXAMPLE.COM", "dummy_trace_id", logger
+    )
+    assert other_case.id == min(ids.values())
+    assert (
+        user_storage.get_user_by_email_ci(
+            db_conn, "missing@example.com", "dummy_trace_id", logger
+        )
+        is None
+    )
+
+
+def test_get_public_users_lists_active_users_in_order(db_conn: Connection):
+    """
+    Test that the public listing includes inactive users and is ordered by id.
+    """
+    logger = get_app_logger("test.storage.get_public_users")
+    ids = []
+    for i in range(3):
+        user_to_create = UserCreate(
+            username=f"listing_user_{i}",
+            email=f"listing{i}@example.com",
+            password="password",
+        )
+        user_to_create.code = common.generate_user_code()
+        ids.append(
+            user_storage.create_user(
+                db_conn, user_to_create, "hashed_password", "dummy_trace_id", logger
+            )
+        )
+    db_conn.execute("UPDATE users SET is_active = FALSE WHERE id = %s;", (ids[1],))
+
+    users = user_storage.get_public_users(db_conn, "dummy_trace_id", logger)
+    assert [user["id"] for user in users] == ids
+    assert "hashed_password" not in users[0]
+
+
+@pytest.mark.skipif(
+    settings.USERS_TABLE_LAYOUT == "partitioned",
+    reason="email lookups go through user_emails in the partitioned layout",
+)
+def test_email_lookup_is_index_only(db_conn: Connection):
+    """
+    Test that the auth and login lookups are both served by the covering
+    lower(email) index.
+    """
+    db_conn.execute("SET enable_seqscan = off; SET enable_bitmapscan = off;")
+    plans = [
+        db_conn.execute("EXPLAIN " + user_storage.STATEMENTS[name], params).fetchall()
+        for name, params in (
+            ("get_user_by_email", {"email": "storage@example.com"}),
+            ("get_user_by_email_ci", ("Storage@example.com",) * 2),
+        )
+    ]
+    db_conn.execute("RESET enable_seqscan; RESET enable_bitmapscan;")
+    for plan in plans:
+        assert any(
+            "Index Only Scan using users_email_lower_idx" in row["QUERY PLAN"]
+            for row in plan
+        )
+
+
+def test_public_users_version(db_conn: Connection):
+    """
+    Test that the list version changes with any update, from the listing
+    index alone.
+    """
+    logger = get_app_logger("test.storage.public_users_version")
+    user = UserCreate(username="version", email="version@example.com", password="x")
+    user.code = common.generate_user_code()
+    user_id = user_storage.create_user(
+        db_conn, user, "hashed", "dummy_trace_id", logger
+    )
+
+    version = user_storage.get_public_users_version(db_conn, "dummy_trace_id", logger)
+    assert version[0] == 1
+    user_storage.update_avatar_url(
+        db_conn, user_id, "avatar.jpg", "dummy_trace_id", logger
+    )
+    assert (
+        user_storage.get_public_users_version(db_conn, "dummy_trace_id", logger)
+        != version
+    )
+
+
+def test_import_users_flags_conflicts(db_conn: Connection):
+    """
+    Test that a staged batch inserts accepted rows and reports the rest.
+    """
+    logger = get_app_logger("test.storage.import_users")
+    existing = UserCreate(username="taken", email="taken@example.com", password="x")
+    existing.code = common.generate_user_code()
+    user_storage.create_user(db_conn, existing, "hash", "dummy_trace_id", logger)
+
+    def row(line, username, email):
+        return line, UserCreate(username=username, email=email, password="x"), "hash"
+
+    report = user_storage.import_users(
+        db_conn,
+        [
+            row(2, "new_1", "new_1@example.com"),
+            row(3, "new_2", "taken@example.com"),
+            row(4, "taken", "new_3@example.com"),
+            row(5, "new_4", "new_1@example.com"),
+            row(6, "x" * 51, "new_5@example.com"),
+        ],
+        "dummy_trace_id",
+        logger,
+    )
+
+    assert [entry["error"] for entry in report] == [
+        None,
+        "Email already registered",
+        "Username already taken",
+        "Email repeats line 2",
+        "Username is longer than 50 characters",
+    ]
+    created = user_storage.get_user_by_email(
+        db_conn, "new_1@example.com", "dummy_trace_id", logger
+    )
+    assert created.id == report[0]["id"]
+    assert created.code == report[0]["code"]
+    assert len(user_storage.get_users(db_conn, "dummy_trace_id", logger)) == 2
+
+
+def test_replace_password_hash_compares_old_hash(db_conn: Connection):
+    """
+    Test that a rehash doesn't overwrite a password changed in the meantime.
+    """
+    logger = get_app_logger("test.storage.replace_password_hash")
+    user = UserCreate(username="rehash", email="rehash@example.com", password="x")
+    user.code = common.generate_user_code()
+    user_id = user_storage.create_user(db_conn, user, "old", "dummy_trace_id", logger)
+    user_storage.update_password(db_conn, user_id, "changed", "dummy_trace_id", logger)
+
+    assert not user_storage.replace_password_hash(
+        db_conn, user_id, "old", "rehashed", "dummy_trace_id", logger
+    )
+    assert user_storage.replace_password_hash(
+        db_conn, user_id, "changed", "rehashed", "dummy_trace_id", logger
+    )
+    row = user_storage.get_user_by_id(db_conn, user_id, "dummy_trace_id", logger)
+    assert row.hashed_password == "rehashed"
+
+
+def test_rotate_refresh_token(db_conn: Connection):
+    """
+    Test that a refresh token rotates once, and that revoking its family
+    stops the successor.
+    """
+    logger = get_app_logger("test.storage.refresh_tokens")
+    user = UserCreate(username="rotate", email="rotate@example.com", password="x")
+    user.code = common.generate_user_code()
+    user_id = user_storage.create_user(
+        db_conn, user, "hashed", "dummy_trace_id", logger
+    )
+    family_id, first, second = uuid4(), uuid4(), uuid4()
+    expires_at = datetime.now(timezone.utc) + timedelta(days=1)
+    user_storage.insert_refresh_token(
+        db_conn, first, family_id, user_id, expires_at, "dummy_trace_id", logger
+    )
+
+    row = user_storage.rotate_refresh_token(
+        db_conn, first, second, expires_at, "dummy_trace_id", logger
+    )
+    assert row.id == user_id
+    # Used tokens don't rotate again
+    assert (
+        user_storage.rotate_refresh_token(
+            db_conn, first, uuid4(), expires_at, "dummy_trace_id", logger
+        )
+        is None
+    )
+    token = user_storage.get_refresh_token(db_conn, first, "dummy_trace_id", logger)
+    assert token["family_id"] == family_id
+    assert token["used_at"] is not None and token["revoked_at"] is None
+
+    assert not user_storage.is_token_family_revoked(
+        db_conn, family_id, "dummy_trace_id", logger
+    )
+    assert (
+        user_storage.revoke_token_family(db_conn, family_id, "dummy_trace_id", logger)
+        == 2
+    )
+    assert user_storage.is_token_family_revoked(
+        db_conn, family_id, "dummy_trace_id", logger
+    )
+    assert (
+        user_storage.rotate_refresh_token(
+            db_conn, second, uuid4(), expires_at, "dummy_trace_id", logger
+        )
+        is None
+    )
+    families = user_storage.get_revoked_token_families(
+        db_conn, None, "dummy_trace_id", logger
+    )
+    assert [family for family, _ in families] == [family_id]
+    assert (
+        user_storage.get_revoked_token_families(
+            db_conn, families[0][1], "dummy_trace_id", logger
+        )
+        == []
+    )
+
+
+def test_purge_expired_refresh_tokens(db_conn: Connection):
+    """
+    Test that the purge deletes expired refresh tokens up to its limit and
+    keeps the live ones.
+    """
+    logger = get_app_logger("test.storage.purge_refresh_tokens")
+    user = UserCreate(username="purge", email="purge@example.com", password="x")
+    user.code = common.generate_user_code()
+    user_id = user_storage.create_user(
+        db_conn, user, "hashed", "dummy_trace_id", logger
+    )
+    now = datetime.now(timezone.utc)
+    live = uuid4()
+    for jti, expires_at in [
+        (uuid4(), now - timedelta(days=2)),
+        (uuid4(), now - timedelta(days=1)),
+        (live, now + timedelta(days=1)),
+    ]:
+        user_storage.insert_refresh_token(
+            db_conn, jti, uuid4(), user_id, expires_at, "dummy_trace_id", logger
+        )
+
+    purged = [
+        user_storage.purge_expired_refresh_tokens(db_conn, 1, "dummy_trace_id", logger)
+        for _ in range(3)
+    ]
+
+    assert purged == [1, 1, 0]
+    rows = db_conn.execute("SELECT jti FROM refresh_tokens;").fetchall()
+    assert [row["jti"] for row in rows] == [live]